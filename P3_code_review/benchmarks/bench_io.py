@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Task Import/Export Benchmark
+
+Generates a task file of --size tasks in each format, imports it into an
+empty task store with `task_tracker.py import`'s code path, and exports
+every task back out, reporting tasks per second, MB per second and peak
+memory. For comparison, a --sample of the tasks is also imported with one
+commit per task, as adding them one at a time would.
+
+    python benchmarks/bench_io.py [--size 1000000] [--sample 10000]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from task_io import FORMATS, export_tasks, import_tasks  # noqa: E402
+from task_store import TaskStore  # noqa: E402
+
+WORDS = ('report', 'review', 'meeting', 'invoice', 'deploy', 'fix', 'bug', 'plan',
+         'budget', 'draft', 'call', 'client', 'release', 'notes', 'backup', 'audit')
+
+
+def generate_tasks(size, seed=0):
+    """Yield (ID, task) pairs for `size` made-up tasks."""
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    for number in range(1, size + 1):
+        yield str(number), {
+            'title': ' '.join(rng.sample(WORDS, 3)).capitalize(),
+            'description': f"Generated task {number}",
+            'due_date': (start + timedelta(days=rng.randrange(1000))).isoformat(),
+            'status': rng.choice(('incomplete', 'complete')),
+            'created_date': start.isoformat(),
+        }
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_import(path, fmt, tmp_dir, batch_size=None):
+    """Import a task file into a new store; returns (store, seconds)."""
+    store_dir = tempfile.mkdtemp(dir=tmp_dir)
+    store = TaskStore(os.path.join(store_dir, 'tasks.json'))
+    kwargs = {} if batch_size is None else {'batch_size': batch_size}
+    start = time.perf_counter()
+    with open(path, newline='', encoding='utf-8') as f:
+        imported = import_tasks(store, f, fmt, **kwargs)
+    elapsed = time.perf_counter() - start
+    assert imported == len(store.tasks), (imported, len(store.tasks))
+    return store, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--sample', type=int, default=10000,
+                        help='tasks imported with one commit per task')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{args.size} tasks")
+        print(f"{'format':>7} {'step':>14} {'seconds':>8} {'tasks/s':>9} {'MB/s':>6} "
+              f"{'peak MB':>8}")
+
+        def report(fmt, step, count, seconds, file_bytes):
+            print(f"{fmt:>7} {step:>14} {seconds:>8.2f} {count / seconds:>9.0f} "
+                  f"{file_bytes / 1e6 / seconds:>6.1f} {peak_rss_mb():>8.0f}")
+
+        for fmt in FORMATS:
+            path = os.path.join(tmp_dir, f"tasks.{fmt}")
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                export_tasks(generate_tasks(args.size), f, fmt)
+            file_bytes = os.path.getsize(path)
+
+            store, seconds = run_import(path, fmt, tmp_dir)
+            report(fmt, 'import', args.size, seconds, file_bytes)
+
+            out_path = os.path.join(tmp_dir, f"export.{fmt}")
+            start = time.perf_counter()
+            with open(out_path, 'w', newline='', encoding='utf-8') as f:
+                exported = export_tasks(store.iter_tasks(), f, fmt)
+            report(fmt, 'export', exported, time.perf_counter() - start, file_bytes)
+            store.close()
+            del store
+
+            sample_path = os.path.join(tmp_dir, f"sample.{fmt}")
+            with open(sample_path, 'w', newline='', encoding='utf-8') as f:
+                export_tasks(generate_tasks(args.sample), f, fmt)
+            store, seconds = run_import(sample_path, fmt, tmp_dir, batch_size=1)
+            report(fmt, 'import 1/commit', args.sample, seconds,
+                   os.path.getsize(sample_path))
+            store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Task Index
+
+Secondary indexes over the tasks, kept up to date by the TaskStore on
+every change, so filtered listings don't scan every task:
+
+- status buckets: the IDs of the tasks with each status;
+- a sorted list of (due_date, ID), so a date range is found by bisection
+  (YYYY-MM-DD dates sort in date order as strings);
+- the IDs of the tasks with each word in their title, plus a sorted list
+  of those words, so a keyword can also match the start of a word.
+
+A query reads the smallest candidate set its filters select and checks
+the other filters task by task.
+"""
+import bisect
+import heapq
+import re
+from datetime import date
+
+SORT_KEYS = ('id', 'due_date', 'title')
+
+_MAX_CHAR = chr(0x10FFFF)  # sorts after every character in a title word
+_WORD = re.compile(r'\w+')
+_BULK_MIN = 100  # batches this big are appended and sorted later, not insorted per task
+
+
+def title_words(title):
+    """Split a title into lowercase words."""
+    return set(_WORD.findall(str(title).lower()))
+
+
+def id_key(task_id):
+    """Sort key putting numeric IDs in numeric order ("9" before "10")."""
+    return (len(task_id), task_id)
+
+
+def _ordered(ids, key, descending, first):
+    """Sort IDs, or with `first`, just pick the first that many in order."""
+    if first is not None and first < len(ids):
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return pick(first, ids, key=key)
+    return sorted(ids, key=key, reverse=descending)
+
+
+class TaskIndex:
+    """Status, due date and title word indexes supporting filtered, sorted queries."""
+
+    def __init__(self, tasks=None):
+        """
+        Parameters:
+            tasks (dict): Tasks by ID to index
+        """
+        self._by_status = {}  # status -> set of IDs
+        self._due = []        # sorted (due_date, *id_key(ID))
+        self._by_word = {}    # title word -> set of IDs
+        self._words = []      # sorted title words
+        self._indexed = {}    # ID -> (status, due_date, words) as indexed
+        self._unsorted = False  # _due and _words have entries appended by add_many
+
+        self.add_many((tasks or {}).items())
+
+    def _add_entries(self, task_id, task):
+        """Add a task to the status and word indexes; returns the words new to the index."""
+        status = task.get('status', 'incomplete')
+        due_date = task.get('due_date') or None
+        words = title_words(task.get('title', ''))
+        self._indexed[task_id] = (status, due_date, words)
+        self._by_status.setdefault(status, set()).add(task_id)
+        new_words = []
+        for word in words:
+            ids = self._by_word.get(word)
+            if ids is None:
+                ids = self._by_word[word] = set()
+                new_words.append(word)
+            ids.add(task_id)
+        return new_words
+
+    def add(self, task_id, task):
+        """Index a task, replacing any previous entry with the same ID."""
+        self.remove(task_id)
+        self._sort_pending()
+        new_words = self._add_entries(task_id, task)
+        due_date = self._indexed[task_id][1]
+        if due_date:
+            bisect.insort(self._due, (due_date,) + id_key(task_id))
+        for word in new_words:
+            bisect.insort(self._words, word)
+
+    def add_many(self, items):
+        """
+        Index several (task ID, task) pairs, as add() would one by one.
+
+        A big batch is appended to the sorted lists, which are then sorted
+        once before the next lookup, so importing a million tasks in
+        batches doesn't re-sort them after every batch.
+        """
+        items = list(items)
+        if len(items) < _BULK_MIN:
+            for task_id, task in items:
+                self.add(task_id, task)
+            return
+        for task_id, _ in items:
+            self.remove(task_id)
+        for task_id, task in items:
+            self._words += self._add_entries(task_id, task)
+            due_date = self._indexed[task_id][1]
+            if due_date:
+                self._due.append((due_date,) + id_key(task_id))
+        self._unsorted = True
+
+    def _sort_pending(self):
+        """Sort entries appended by add_many."""
+        if self._unsorted:
+            self._due.sort()
+            self._words.sort()
+            self._unsorted = False
+
+    def remove(self, task_id):
+        """Remove a task from the indexes (no-op if it isn't indexed)."""
+        entry = self._indexed.pop(task_id, None)
+        if entry is None:
+            return
+        status, due_date, words = entry
+        self._sort_pending()
+
+        self._discard(self._by_status, status, task_id)
+        if due_date:
+            del self._due[bisect.bisect_left(self._due, (due_date,) + id_key(task_id))]
+        for word in words:
+            if self._discard(self._by_word, word, task_id):
+                del self._words[bisect.bisect_left(self._words, word)]
+
+    @staticmethod
+    def _discard(index, key, task_id):
+        """Remove an ID from a set in `index`; True if that emptied the set."""
+        ids = index[key]
+        ids.discard(task_id)
+        if not ids:
+            del index[key]
+            return True
+        return False
+
+    def _matching_word(self, term):
+        """IDs of tasks with a title word starting with `term`."""
+        start = bisect.bisect_left(self._words, term)
+        end = bisect.bisect_left(self._words, term + _MAX_CHAR)
+        if end - start == 1:
+            return self._by_word[self._words[start]]
+        ids = set()
+        for word in self._words[start:end]:
+            ids |= self._by_word[word]
+        return ids
+
+    def query(self, tasks, status=None, due_from=None, due_to=None, overdue=False,
+              keyword=None, sort='id', descending=False, today=None, first=None):
+        """
+        Find the tasks matching every given filter.
+
+        Parameters:
+            tasks (dict): The indexed tasks, by ID
+            status (str): Only tasks with this status
+            due_from (str): Only tasks due on or after this YYYY-MM-DD date
+            due_to (str): Only tasks due on or before this date
+            overdue (bool): Only tasks due before today that aren't complete
+            keyword (str): Only tasks with a title word starting with each
+                word of the keyword (case-insensitive)
+            sort (str): 'id', 'due_date' or 'title'; tasks without a due
+                date come last when sorting by due date
+            descending (bool): Reverse the sort order
+            today (str): Today's date, for `overdue` (defaults to the real one)
+            first (int): Only order and return this many IDs from the start;
+                much cheaper than sorting every match to show one page
+
+        Returns:
+            tuple: (task IDs in order, number of matching tasks)
+
+        Raises:
+            ValueError: If `sort` isn't one of SORT_KEYS
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        self._sort_pending()
+
+        # Each filter offers (number of candidates, candidate IDs, check)
+        filters = []
+        if status is not None:
+            ids = self._by_status.get(status, set())
+            filters.append((len(ids), lambda ids=ids: ids,
+                            lambda task_id: self._indexed[task_id][0] == status))
+        if overdue:
+            today = today or date.today().isoformat()
+            open_count = len(self._indexed) - len(self._by_status.get('complete', ()))
+
+            def is_open(task_id):
+                return self._indexed[task_id][0] != 'complete'
+
+            filters.append((open_count, lambda: filter(is_open, self._indexed), is_open))
+        if keyword:
+            for term in title_words(keyword):
+                ids = self._matching_word(term)
+                filters.append((len(ids), lambda ids=ids: ids,
+                                lambda task_id, ids=ids: task_id in ids))
+        due_filter = None
+        if due_from is not None or due_to is not None or overdue:
+            # (date,) sorts before every entry on that date, (date, inf) after them
+            lo = 0 if due_from is None else bisect.bisect_left(self._due, (due_from,))
+            hi = (len(self._due) if due_to is None
+                  else bisect.bisect_left(self._due, (due_to, float('inf'))))
+            if overdue:
+                hi = min(hi, bisect.bisect_left(self._due, (today,)))
+
+            def in_range(task_id):
+                due_date = self._indexed[task_id][1]
+                return (due_date is not None
+                        and (due_from is None or due_date >= due_from)
+                        and (due_to is None or due_date <= due_to)
+                        and (not overdue or due_date < today))
+
+            due_filter = (max(0, hi - lo),
+                          lambda: [task_id for _, _, task_id in self._due[lo:hi]], in_range)
+            filters.append(due_filter)
+
+        filters.sort(key=lambda f: f[0])
+        candidates = filters[0][1]() if filters else self._indexed
+        checks = [check for _, _, check in filters[1:]]
+        if checks:
+            ids = [task_id for task_id in candidates if all(check(task_id) for check in checks)]
+        else:
+            ids = list(candidates)
+
+        if sort == 'due_date':
+            if filters and filters[0] is due_filter:
+                # Already in (due_date, ID) order, and every task has a due date
+                ordered = ids[::-1] if descending else ids
+            else:
+                # Tasks without a due date come last either way
+                dated = [i for i in ids if self._indexed[i][1]]
+                ordered = _ordered(dated, lambda i: (self._indexed[i][1], id_key(i)),
+                                   descending, first)
+                if first is None or len(ordered) < first:
+                    undated = [i for i in ids if not self._indexed[i][1]]
+                    ordered += _ordered(undated, id_key, descending,
+                                        None if first is None else first - len(ordered))
+        elif sort == 'title':
+            ordered = _ordered(ids, lambda i: (str(tasks[i].get('title', '')).lower(), id_key(i)),
+                               descending, first)
+        else:
+            ordered = _ordered(ids, id_key, descending, first)
+        return ordered[:first], len(ids)
@@ -0,0 +1,181 @@
+"""
+Task Import and Export
+
+Reads and writes task files in CSV or NDJSON (one JSON object per line),
+a task at a time, so files of any size stream through without being held
+in memory:
+
+- CSV has a header row with the columns in FIELDS;
+- NDJSON lines look like {"id": "7", "title": "...", "due_date": "..."}.
+
+Imported tasks are validated and saved through TaskStore.commit in
+batches, one journal record per batch instead of one per task. They get
+new IDs from the store; an `id` in the file is ignored.
+"""
+import csv
+import json
+import os
+from datetime import date
+from itertools import islice
+
+FORMATS = ('csv', 'ndjson')
+FIELDS = ('id', 'title', 'description', 'due_date', 'status', 'created_date')
+STATUSES = ('incomplete', 'complete')
+BATCH_SIZE = 1000  # tasks per journal record when importing
+
+
+def guess_format(path):
+    """Return the format for a file name's extension, or None."""
+    extension = os.path.splitext(path)[1].lower()
+    return {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(extension)
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items from an iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_records(f, fmt):
+    """
+    Yield (line number, record) for each task in an open text file.
+
+    A record is a dict of strings for CSV and the raw line for NDJSON;
+    task_from_record parses and checks it.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield number, line
+
+
+def _is_date(value):
+    """Check for a YYYY-MM-DD date; date.fromisoformat is much faster than strptime."""
+    if not isinstance(value, str) or len(value) != 10 or value[4] != '-' or value[7] != '-':
+        return False
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def task_from_record(record, today=None):
+    """
+    Build a task from a record read by read_records.
+
+    Parameters:
+        record (dict or str): A CSV row or an NDJSON line
+        today (str): created_date for tasks without one (defaults to today)
+
+    Returns:
+        dict: The task, without its ID
+
+    Raises:
+        ValueError: If the record isn't a valid task
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise ValueError(f"invalid JSON: {e}")
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+
+    title = record.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("title is missing")
+    due_date = record.get('due_date')
+    if not _is_date(due_date):
+        raise ValueError(f"due_date {due_date!r} isn't a YYYY-MM-DD date")
+    status = record.get('status') or 'incomplete'
+    if status not in STATUSES:
+        raise ValueError(f"status {status!r} isn't one of {', '.join(STATUSES)}")
+    created_date = record.get('created_date') or today or date.today().isoformat()
+    if not _is_date(created_date):
+        raise ValueError(f"created_date {created_date!r} isn't a YYYY-MM-DD date")
+
+    return {
+        'title': title,
+        'description': record.get('description') or '',
+        'due_date': due_date,
+        'status': status,
+        'created_date': created_date,
+    }
+
+
+def valid_tasks(records, on_error=None):
+    """
+    Yield the tasks built from (line number, record) pairs, skipping invalid ones.
+
+    Parameters:
+        records (iterable): Pairs from read_records
+        on_error (callable): Called as on_error(line number, message) for
+            each record skipped
+    """
+    today = date.today().isoformat()
+    for number, record in records:
+        try:
+            yield task_from_record(record, today)
+        except ValueError as e:
+            if on_error is not None:
+                on_error(number, str(e))
+
+
+def import_tasks(store, f, fmt, batch_size=BATCH_SIZE, on_error=None):
+    """
+    Add every valid task in an open file to the store, a batch at a time.
+
+    Parameters:
+        store (TaskStore): The store to add to
+        f (file): The task file, opened for reading as text
+        fmt (str): 'csv' or 'ndjson'
+        batch_size (int): Tasks per commit
+        on_error (callable): See valid_tasks
+
+    Returns:
+        int: The number of tasks imported
+
+    Raises:
+        OSError: If a batch can't be saved; the batches before it stay saved
+    """
+    imported = 0
+    for batch in batched(valid_tasks(read_records(f, fmt), on_error), batch_size):
+        with store.transaction():
+            store.commit(put={store.allocate_id(): task for task in batch})
+        imported += len(batch)
+    return imported
+
+
+def export_tasks(items, f, fmt):
+    """
+    Write (task ID, task) pairs to an open file.
+
+    Parameters:
+        items (iterable): The tasks, e.g. from TaskStore.iter_tasks
+        f (file): Opened for writing as text (with newline='' for CSV)
+        fmt (str): 'csv' or 'ndjson'
+
+    Returns:
+        int: The number of tasks written
+    """
+    exported = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(f, FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for task_id, task in items:
+            writer.writerow(dict(task, id=task_id))
+            exported += 1
+    else:
+        for task_id, task in items:
+            f.write(json.dumps(dict({'id': task_id}, **task), separators=(',', ':')) + '\n')
+            exported += 1
+    return exported
@@ -0,0 +1,230 @@
+"""
+Task Scheduler
+
+Reminds about tasks as they come due. The scheduler keeps a min-heap of
+the incomplete tasks' deadlines (the start of the due date, or earlier with
+`remind_before`), sleeps until the earliest one, and fires its hooks for
+every task whose deadline has passed.
+
+The heap is built once, then kept current from the store's change
+notifications: an added or rescheduled task pushes a new entry, and a
+completed, deleted or rescheduled task's old entry is left in place and
+skipped when it reaches the top. Changes saved by other processes are
+picked up with TaskStore.refresh, which only reads the new journal
+records, at least every `poll_interval` seconds.
+
+Which tasks were already reminded about can be saved to a file (see
+reminded_path), so a restarted scheduler, or one run from cron, doesn't
+remind about them again. A task is reminded about again once its due date
+changes or it is reopened.
+
+A hook is any callable taking (task ID, task); stdout_hook and
+log_file_hook are provided.
+"""
+import heapq
+import importlib
+import json
+import os
+import sys
+import threading
+from datetime import date, datetime, time, timedelta
+
+from task_index import id_key
+
+POLL_INTERVAL = 5.0  # seconds between checks for changes saved by other processes
+
+
+def reminded_path(tasks_path):
+    """The file next to a tasks file that records the reminders already sent."""
+    return os.path.splitext(tasks_path)[0] + '.reminded'
+
+
+def stdout_hook(task_id, task):
+    """Print a reminder."""
+    print(f"Reminder: task {task_id} \"{task['title']}\" is due {task['due_date']}.", flush=True)
+
+
+def log_file_hook(path):
+    """Return a hook appending a timestamped reminder line to a file."""
+    def hook(task_id, task):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(f"{datetime.now().isoformat(timespec='seconds')} "
+                    f"task {task_id} due {task['due_date']}: {task['title']}\n")
+    return hook
+
+
+def load_hook(spec):
+    """
+    Import a hook given as "module:function".
+
+    Raises:
+        ValueError: If the spec isn't in that form or doesn't name a callable
+        ImportError: If the module can't be imported
+    """
+    module_name, _, name = spec.partition(':')
+    if not module_name or not name:
+        raise ValueError(f"hook {spec!r} should look like module:function")
+    hook = getattr(importlib.import_module(module_name), name, None)
+    if not callable(hook):
+        raise ValueError(f"{spec} isn't a function")
+    return hook
+
+
+class Scheduler:
+    """Fires reminder hooks as tasks in a TaskStore come due."""
+
+    def __init__(self, store, hooks, remind_before=timedelta(0),
+                 poll_interval=POLL_INTERVAL, clock=datetime.now, reminded_file=None):
+        """
+        Parameters:
+            store (TaskStore): The tasks to watch
+            hooks (list): Callables run as hook(task ID, task) for each reminder
+            remind_before (timedelta): How long before the due date to remind
+            poll_interval (float): Longest sleep between checks for changes
+                saved by other processes; None to only watch this process's
+            clock (callable): Returns the current datetime
+            reminded_file (str): File recording which tasks were reminded
+                about, read at start and rewritten whenever that changes; None
+                to only remember that while running
+        """
+        self.store = store
+        self.hooks = list(hooks)
+        self.remind_before = remind_before
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.reminded_file = reminded_file
+        self._heap = []       # (deadline, *id_key(ID), ID), including stale entries
+        self._deadlines = {}  # ID -> deadline of its live heap entry
+        self._reminded = {}   # ID -> due date it was reminded about
+        self._wake = threading.Event()
+        self._stopping = False
+
+        reminded = self._load_reminded()
+        for task_id, task in store.tasks.items():
+            deadline = self._deadline(task)
+            if deadline is not None and reminded.get(task_id) == task['due_date']:
+                self._reminded[task_id] = task['due_date']
+            elif deadline is not None:
+                self._deadlines[task_id] = deadline
+                self._heap.append((deadline,) + id_key(task_id) + (task_id,))
+        heapq.heapify(self._heap)
+        store.listeners.append(self._on_change)
+
+    def _load_reminded(self):
+        """Read the reminded file: ID -> due date reminded about ({} if there is none)."""
+        if self.reminded_file is None:
+            return {}
+        try:
+            with open(self.reminded_file, 'r', encoding='utf-8') as f:
+                reminded = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            # Worst case is reminding about some tasks twice
+            print(f"Ignoring {self.reminded_file}: {e}", file=sys.stderr)
+            return {}
+        return reminded if isinstance(reminded, dict) else {}
+
+    def _save_reminded(self):
+        """Rewrite the reminded file; only tasks still waiting to be done are kept."""
+        if self.reminded_file is None:
+            return
+        tmp_path = f"{self.reminded_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._reminded, f)
+            os.replace(tmp_path, self.reminded_file)
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            print(f"Can't save {self.reminded_file}: {e}", file=sys.stderr)
+
+    def _deadline(self, task):
+        """When to remind about a task, or None if it needs no reminder."""
+        if task.get('status') == 'complete':
+            return None
+        try:
+            due_date = date.fromisoformat(task.get('due_date') or '')
+        except (TypeError, ValueError):
+            return None
+        return datetime.combine(due_date, time()) - self.remind_before
+
+    def _on_change(self, put, delete):
+        """Store listener: reschedule the changed tasks."""
+        reminded = len(self._reminded)
+        for task_id in delete:
+            self._deadlines.pop(task_id, None)
+            self._reminded.pop(task_id, None)
+        for task_id, task in put.items():
+            deadline = self._deadline(task)
+            if deadline is None:
+                self._deadlines.pop(task_id, None)
+                self._reminded.pop(task_id, None)
+            elif self._reminded.get(task_id) == task['due_date']:
+                self._deadlines.pop(task_id, None)  # e.g. a new title; don't remind again
+            elif self._deadlines.get(task_id) != deadline:
+                self._reminded.pop(task_id, None)  # due on another date now
+                self._deadlines[task_id] = deadline
+                heapq.heappush(self._heap, (deadline,) + id_key(task_id) + (task_id,))
+        # Drop stale entries once they outnumber live ones, keeping the heap O(tasks)
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [entry for entry in self._heap
+                          if self._deadlines.get(entry[-1]) == entry[0]]
+            heapq.heapify(self._heap)
+        if len(self._reminded) != reminded:
+            self._save_reminded()
+        self._wake.set()
+
+    def next_deadline(self):
+        """Return the earliest pending deadline, or None if nothing is pending."""
+        while self._heap:
+            deadline, *_, task_id = self._heap[0]
+            if self._deadlines.get(task_id) == deadline:
+                return deadline
+            heapq.heappop(self._heap)  # completed, deleted or rescheduled since
+        return None
+
+    def fire_due(self):
+        """
+        Run the hooks for every task whose deadline has passed.
+
+        Returns:
+            int: The number of tasks reminded about
+        """
+        now = self.clock()
+        fired = 0
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                break
+            task_id = heapq.heappop(self._heap)[-1]
+            del self._deadlines[task_id]
+            task = self.store.tasks[task_id]
+            self._reminded[task_id] = task['due_date']
+            for hook in self.hooks:
+                try:
+                    hook(task_id, task)
+                except Exception as e:  # one broken hook mustn't stop the others
+                    print(f"Error in reminder hook {hook!r}: {e}", file=sys.stderr)
+            fired += 1
+        if fired:
+            self._save_reminded()
+        return fired
+
+    def run(self):
+        """Fire reminders until stop() is called, sleeping until the next deadline."""
+        while not self._stopping:
+            self.fire_due()
+            timeout = self.poll_interval
+            deadline = self.next_deadline()
+            if deadline is not None:
+                until = max(0.0, (deadline - self.clock()).total_seconds())
+                timeout = until if timeout is None else min(timeout, until)
+            self._wake.wait(None if timeout is None else max(0.0, timeout))
+            self._wake.clear()
+            self.store.refresh()
+
+    def stop(self):
+        """Make run() return; may be called from another thread."""
+        self._stopping = True
+        self._wake.set()
@@ -0,0 +1,456 @@
+"""
+Task Store
+
+Persistence for the task tracker. Tasks are kept in memory, and each
+change is appended to a journal next to the tasks file as it is made,
+instead of rewriting the whole file:
+
+- tasks.json is the snapshot, in the same {"<id>": {...}} format as
+  always, so an existing file is picked up as is.
+- tasks.journal holds one JSON line per commit, e.g.
+  {"next_id": 8, "put": {"7": {...}}, "delete": ["3"]}. A commit is written
+  and fsynced as a single line, so after a crash it is either there in
+  full or, if the line was torn mid-write, ignored.
+- Every COMPACT_AFTER commits the journal is folded into a new snapshot,
+  which is written to a temporary file and renamed over tasks.json.
+
+Task IDs come from a counter saved with every commit, so an ID is never
+handed out twice, even after the task that had it was deleted. For a
+tasks.json without a journal, the counter starts after the highest ID.
+
+Several processes can share the files. Every write happens while holding
+an exclusive lock on tasks.lock, after reading the journal records the
+other processes appended, so nobody writes from a stale copy: IDs come
+from the latest counter, and an update is applied to the latest version
+of the task. Each task carries a `version` stamp, raised by every change,
+which update() uses to merge changes to different fields and to refuse
+changes to a field someone else changed since it was read.
+
+The store also keeps a TaskIndex (task_index.py) current with every
+commit, for filtered and sorted listings, and tells its listeners about
+every change, including those other processes saved, once refresh() has
+picked them up.
+"""
+import json
+import os
+from contextlib import contextmanager
+
+from task_index import TaskIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Journal records written before they are folded into the snapshot
+COMPACT_AFTER = 1000
+
+
+class TaskStoreError(Exception):
+    """The task files exist but can't be read."""
+
+
+class TaskConflictError(Exception):
+    """A change clashes with one another session saved after the task was read."""
+
+    def __init__(self, task_id, fields):
+        super().__init__(f"Task {task_id} was changed by another session "
+                         f"({', '.join(fields)}) since it was read")
+        self.task_id = task_id
+        self.fields = fields
+
+
+def _write_atomic(path, data):
+    """Write bytes to a temporary file and rename it over `path` once it is on disk."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        # Make the rename itself survive a crash
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _file_id(path):
+    """Identify the file at `path`, to notice it being replaced; None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+
+def _lock(f):
+    """Block until this process holds an exclusive lock on an open file."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass  # LK_LOCK gives up after 10 seconds; keep waiting
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _apply(tasks, record):
+    tasks.update(record.get('put', {}))
+    for task_id in record.get('delete', ()):
+        tasks.pop(task_id, None)
+
+
+class TaskStore:
+    """Tasks in memory, persisted as a snapshot plus an append-only journal."""
+
+    def __init__(self, path, compact_after=COMPACT_AFTER):
+        """
+        Parameters:
+            path (str): The tasks file, e.g. tasks.json; the journal is kept
+                next to it
+            compact_after (int): Journal records to write before compacting
+
+        Raises:
+            TaskStoreError: If the tasks file or the journal is corrupted
+        """
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self.lock_path = os.path.splitext(path)[0] + '.lock'
+        self.compact_after = compact_after
+        self.tasks = {}       # task ID -> task; read it, but change it through the store
+        self.index = TaskIndex()
+        self.listeners = []   # called as listener(put, delete) after every change
+        self.next_id = 1
+        self._journal = None
+        self._lock_file = None
+        self._lock_depth = 0     # nested _locked() blocks
+        self._journal_id = None  # _file_id of the journal that was read
+        self._records = 0     # records in the journal
+        self._valid_bytes = 0  # journal bytes up to the end of the last complete record
+        self.load()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock on the task files (reentrant)."""
+        if self._lock_depth == 0:
+            self._lock_file = open(self.lock_path, 'a+b')
+            try:
+                _lock(self._lock_file)
+            except BaseException:
+                self._lock_file.close()
+                raise
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                _unlock(self._lock_file)
+                self._lock_file.close()
+                self._lock_file = None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the lock on the task files, with every change saved so far loaded.
+
+        Other processes can't write until the block ends, so what is read
+        inside it stays current: use it around allocate_id() and around
+        building tasks to commit from the current ones.
+        """
+        with self._locked():
+            self.refresh()
+            yield
+
+    def load(self):
+        """(Re)read the snapshot and replay the journal on top of it."""
+        with self._locked():
+            self._load()
+
+    def _load(self):
+        self._close_journal()
+        try:
+            with open(self.path, 'r') as f:
+                tasks = json.load(f)
+        except FileNotFoundError:
+            tasks = None
+        except ValueError as e:
+            raise TaskStoreError(f"{self.path} is corrupted: {e}")
+        if tasks is None:
+            # Safe to create: holding the lock, so nobody is compacting
+            tasks = {}
+            _write_atomic(self.path, b'{}')
+        next_id = max((int(task_id) for task_id in tasks if task_id.isdigit()), default=0) + 1
+
+        records = valid_bytes = 0
+        journal_id = None
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            lines = []
+        else:
+            with f:
+                stat = os.fstat(f.fileno())
+                journal_id = (stat.st_dev, stat.st_ino)
+                lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                record = None
+            if record is None:
+                if number == len(lines):
+                    break  # torn by a crash mid-write; cut off on the next commit
+                raise TaskStoreError(f"{self.journal_path} is corrupted at line {number}")
+            _apply(tasks, record)
+            next_id = max(next_id, record.get('next_id', 0))
+            records += 1
+            valid_bytes += len(line)
+
+        # Updated in place, so references to self.tasks stay current
+        self.tasks.clear()
+        self.tasks.update(tasks)
+        self.index = TaskIndex(self.tasks)
+        self.next_id = next_id
+        self._journal_id = journal_id
+        self._records = records
+        self._valid_bytes = valid_bytes
+
+    def refresh(self):
+        """
+        Pick up the changes other processes saved since this store last read
+        or wrote the files, and tell the listeners about them.
+
+        Only the new journal records are read, without waiting for the
+        lock: a record still being written is left for the next refresh. If
+        the journal was replaced by a compaction, everything is reloaded
+        instead.
+
+        Returns:
+            bool: True if there was anything new
+
+        Raises:
+            TaskStoreError: If the files can't be read
+        """
+        if _file_id(self.journal_path) != self._journal_id:
+            return self._reload()
+        if self._journal_id is None:
+            return False
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._valid_bytes)
+            lines = f.readlines()
+        changed = False
+        for line in lines:
+            if not line.endswith(b'\n'):
+                break  # still being written
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise TaskStoreError(f"{self.journal_path} is corrupted after byte {self._valid_bytes}")
+            self.next_id = max(self.next_id, record.get('next_id', 0))
+            self._records += 1
+            self._valid_bytes += len(line)
+            self._applied(record)
+            changed = True
+        return changed
+
+    def _reload(self):
+        """load(), telling the listeners what changed; True if anything did."""
+        old_tasks = dict(self.tasks)
+        self.load()
+        put = {task_id: task for task_id, task in self.tasks.items()
+               if old_tasks.get(task_id) != task}
+        delete = [task_id for task_id in old_tasks if task_id not in self.tasks]
+        if put or delete:
+            for listener in self.listeners:
+                listener(put, delete)
+        return bool(put or delete)
+
+    def get(self, task_id):
+        """Return the task with the given ID, or None."""
+        return self.tasks.get(task_id)
+
+    def query(self, limit=None, offset=0, **criteria):
+        """
+        Return one page of the tasks matching a filter.
+
+        Parameters:
+            limit (int): Tasks per page (all if None)
+            offset (int): Matching tasks to skip
+            **criteria: Filters and sort order, see TaskIndex.query
+
+        Returns:
+            tuple: ([(task ID, task), ...], number of matching tasks)
+        """
+        end = None if limit is None else offset + limit
+        ids, total = self.index.query(self.tasks, first=end, **criteria)
+        return [(task_id, self.tasks[task_id]) for task_id in ids[offset:]], total
+
+    def iter_tasks(self, **criteria):
+        """Yield (task ID, task) for every task matching a filter, in order (see query)."""
+        ids, _ = self.index.query(self.tasks, **criteria)
+        for task_id in ids:
+            yield task_id, self.tasks[task_id]
+
+    def allocate_id(self):
+        """
+        Reserve a new task ID; it is saved with the next commit.
+
+        Raises:
+            RuntimeError: Outside transaction(), where another process
+                could hand out the same ID
+        """
+        if self._lock_depth == 0:
+            raise RuntimeError("allocate_id() must be called inside transaction()")
+        task_id = str(self.next_id)
+        self.next_id += 1
+        return task_id
+
+    def add(self, task):
+        """Save a new task and return its ID."""
+        with self.transaction():
+            task_id = self.allocate_id()
+            self.commit(put={task_id: task})
+        return task_id
+
+    def update(self, task_id, changes, base=None):
+        """
+        Change some fields of the latest version of a task.
+
+        Parameters:
+            task_id (str): The task to change
+            changes (dict): New values by field
+            base (dict): The task as the changes were decided on. If another
+                session saved the task since, the changes are merged into
+                its version unless they touch a field it changed too.
+
+        Returns:
+            dict: The updated task
+
+        Raises:
+            KeyError: If there is no task with this ID (any more)
+            TaskConflictError: If `base` is stale and a changed field clashes
+        """
+        with self.transaction():
+            task = self.tasks[task_id]
+            if base is not None and task.get('version') != base.get('version'):
+                clashes = [field for field, value in changes.items()
+                           if task.get(field) not in (base.get(field), value)]
+                if clashes:
+                    raise TaskConflictError(task_id, clashes)
+            self.commit(put={task_id: dict(task, **changes)})
+            return self.tasks[task_id]
+
+    def delete(self, task_id):
+        """Delete a task; returns False if there was no task with this ID."""
+        with self.transaction():
+            if task_id not in self.tasks:
+                return False
+            self.commit(delete=[task_id])
+        return True
+
+    def commit(self, put=None, delete=()):
+        """
+        Save several changes at once, as a single journal record.
+
+        The tasks in `put` replace whatever is saved under their IDs, so
+        build them inside transaction() from the current tasks (as update()
+        does), or another session's changes to them may be overwritten.
+        Each is saved with its `version` one above the current task's.
+
+        Parameters:
+            put (dict): Tasks to add or replace, by ID
+            delete (iterable): IDs of tasks to delete
+
+        Raises:
+            OSError: If the journal can't be written; nothing is changed then
+        """
+        with self.transaction():
+            record = {'next_id': self.next_id}
+            if put:
+                record['put'] = {
+                    task_id: dict(task, version=self.tasks.get(task_id, {}).get('version', 0) + 1)
+                    for task_id, task in put.items()
+                }
+            delete = list(delete)
+            if delete:
+                record['delete'] = delete
+            line = (json.dumps(record) + '\n').encode('utf-8')
+
+            journal = self._open_journal()
+            try:
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+            except OSError:
+                # Reopening cuts off whatever part of the line was written
+                self._close_journal()
+                raise
+            self._valid_bytes += len(line)
+            self._records += 1
+            self._applied(record)
+
+            if self._records >= self.compact_after:
+                self.compact()
+
+    def _applied(self, record):
+        """Apply a journal record that is on disk to the tasks, index and listeners."""
+        put = record.get('put', {})
+        delete = record.get('delete', [])
+        _apply(self.tasks, record)
+        for task_id in delete:
+            self.index.remove(task_id)
+        if put:
+            self.index.add_many(put.items())
+        for listener in self.listeners:
+            listener(put, delete)
+
+    def compact(self):
+        """Write every task to the snapshot and start a new journal."""
+        with self.transaction():
+            self._close_journal()
+            _write_atomic(self.path, json.dumps(self.tasks).encode('utf-8'))
+            # Replaying the old journal over the new snapshot changes nothing, so
+            # a crash between these two renames loses nothing either
+            header = (json.dumps({'next_id': self.next_id}) + '\n').encode('utf-8')
+            _write_atomic(self.journal_path, header)
+            self._journal_id = _file_id(self.journal_path)
+            self._records = 1
+            self._valid_bytes = len(header)
+
+    def close(self):
+        self._close_journal()
+
+    def _open_journal(self):
+        """The journal, opened for appending; call it holding the lock."""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+            stat = os.fstat(self._journal.fileno())
+            self._journal_id = (stat.st_dev, stat.st_ino)
+        if os.fstat(self._journal.fileno()).st_size > self._valid_bytes:
+            # A record torn by a crash, ours or another process's
+            self._journal.truncate(self._valid_bytes)
+        return self._journal
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -4,59 +4,63 @@ Task Tracker Application
 
 A simple console application for tracking tasks.
 """
-import json
-import os
-from datetime import datetime
-import time
+import argparse
+import sys
+from datetime import datetime, timedelta
+from task_index import SORT_KEYS
+from task_io import BATCH_SIZE, FORMATS, STATUSES, export_tasks, guess_format, import_tasks
+from task_scheduler import (POLL_INTERVAL, Scheduler, load_hook, log_file_hook, reminded_path,
+                            stdout_hook)
+from task_store import TaskConflictError, TaskStore, TaskStoreError
 
 # Global variables
 TASKS_FILE = "tasks.json"
-tasks = {}
+PAGE_SIZE = 20  # tasks shown at a time by Find Tasks
+store = None
+tasks = {}  # the store's tasks by ID; change them through the store
 
-def load_tasks():
-    """Load tasks from the JSON file."""
-    global tasks
-    if os.path.exists(TASKS_FILE):
-        try:
-            with open(TASKS_FILE, "r") as f:
-                tasks = json.load(f)
-        except json.JSONDecodeError:
-            print("Warning: Tasks file is corrupted.")
-            tasks = {}
-    else:
-        # Create an empty JSON file if it doesn't exist
-        save_tasks()
-
-def save_tasks():
-    """Save tasks to the JSON file."""
-    try: 
-        with open(TASKS_FILE, "w") as f:
-            json.dump(tasks, f)
-    except IOError as e:
-        print(f"Error saving tasks: {e}")            
-
-def generate_task_id():
-    """Generate a new unique task ID."""
-    existing_ids = [int(task_id) for task_id in tasks.keys()]
-    return str(max(existing_ids) + 1 if existing_ids else 1)
+def load_tasks(path=None):
+    """Open the task store (tasks.json plus its journal, see task_store.py)."""
+    global store, tasks
+    try:
+        store = TaskStore(path or TASKS_FILE)
+    except TaskStoreError as e:
+        # Starting empty would overwrite the tasks on the next compaction
+        print(f"Error: {e}")
+        sys.exit(1)
+    tasks = store.tasks
 
-def is_valid_date(date_str):
+def is_date(date_str):
+    """Check that a string is a YYYY-MM-DD date (past dates allowed)."""
     try:
-        due_date = datetime.strptime(date_str, "%Y-%m-%d")
-        if due_date < datetime.today():
-            print("Error: Due date must be in the future.")
-            return False
+        datetime.strptime(date_str, "%Y-%m-%d")
         return True
     except ValueError:
-        print("Error: Invalid date format. Use YYYY-MM-DD.")
         return False
 
+def due_date_error(date_str):
+    """Return what is wrong with a new due date, or None if it is valid."""
+    try:
+        due_date = datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        return "Error: Invalid date format. Use YYYY-MM-DD."
+    if due_date < datetime.today():
+        return "Error: Due date must be in the future."
+    return None
+
+def is_valid_date(date_str):
+    error = due_date_error(date_str)
+    if error:
+        print(error)
+        return False
+    return True
+
 def add_task():
     """Add a new task."""
     print("\n=== Add New Task ===")
     
     title = input("Enter task title: ")
-    if not title:
+    if not title.strip():
         print("Error: Title cannot be empty.")
         return
     
@@ -67,17 +71,18 @@ def add_task():
         return    
 
     
-    task_id = str(generate_task_id())
-    tasks[task_id] = {
-        "title": title,
-        "description": description,
-        "due_date": due_date,
-        "status": "incomplete",
-        "created_date": datetime.today().strftime("%Y-%m-%d")
-    }
-    
+    try:
+        task_id = store.add({
+            "title": title,
+            "description": description,
+            "due_date": due_date,
+            "status": "incomplete",
+            "created_date": datetime.today().strftime("%Y-%m-%d")
+        })
+    except OSError as e:
+        print(f"Error saving tasks: {e}")
+        return
     
-    save_tasks()
     print(f"Task {task_id} added successfully!")
 
 def view_all_tasks():
@@ -88,10 +93,14 @@ def view_all_tasks():
         print("No tasks found.")
         return
     
+    print_task_table(tasks.items())
+
+def print_task_table(items):
+    """Print (task ID, task) pairs as a table."""
     # Set column widths
     print("{:<5} {:<25} {:<12} {:<10}".format("ID", "Title", "Due Date", "Status"))
     print("-" * 60)
-    for task_id, task in tasks.items():
+    for task_id, task in items:
         print("{:<5} {:<25} {:<12} {:<10}".format(
             task_id,
             task["title"][:24],  # Truncate long titles
@@ -99,6 +108,49 @@ def view_all_tasks():
             task["status"]
         ))
 
+def find_tasks():
+    """List the tasks matching a filter, sorted, a page at a time."""
+    print("\n=== Find Tasks ===")
+    print("Leave a field empty to skip it.")
+    
+    status = input("Status (incomplete/complete): ").strip().lower()
+    if status and status not in STATUSES:
+        print("Error: Status must be incomplete or complete.")
+        return
+    
+    due_from = input("Due on or after (YYYY-MM-DD): ").strip()
+    due_to = input("Due on or before (YYYY-MM-DD): ").strip()
+    if (due_from and not is_date(due_from)) or (due_to and not is_date(due_to)):
+        print("Error: Invalid date format. Use YYYY-MM-DD.")
+        return
+    
+    overdue = input("Only overdue tasks? (y/n): ").strip().lower() == 'y'
+    keyword = input("Title keyword: ").strip()
+    
+    sort = input("Sort by (id/due_date/title, -due_date for newest first): ").strip() or "id"
+    if sort.lstrip("-") not in SORT_KEYS:
+        print(f"Error: Sort by one of {', '.join(SORT_KEYS)}.")
+        return
+    
+    offset = 0
+    while True:
+        page, total = store.query(limit=PAGE_SIZE, offset=offset,
+                                  status=status or None, due_from=due_from or None,
+                                  due_to=due_to or None, overdue=overdue,
+                                  keyword=keyword or None, sort=sort.lstrip("-"),
+                                  descending=sort.startswith("-"))
+        if not total:
+            print("No tasks found.")
+            return
+        
+        print_task_table(page)
+        print(f"Showing {offset + 1}-{offset + len(page)} of {total}")
+        offset += len(page)
+        if offset >= total:
+            return
+        if input("Enter for the next page, q to stop: ").strip().lower() == "q":
+            return
+
 def view_task():
     """View details of a specific task."""
     print("\n=== View Task ===")
@@ -134,7 +186,7 @@ def update_task():
         print(f"Task {task_id} not found.")
         return
     
-    task = tasks[task_id]
+    task = dict(tasks[task_id])  # as shown, to merge with changes saved meanwhile
     
     print("Leave field empty to keep current value.")
     print(f"Current Title: {task['title']}")
@@ -147,16 +199,27 @@ def update_task():
     new_due_date = input("New Due Date (YYYY-MM-DD): ")
     
     # Update task with new values, keeping old values if input is empty
+    changes = {}
     if new_title:
-        task['title'] = new_title
+        changes['title'] = new_title
     if new_description:
-        task['description'] = new_description
+        changes['description'] = new_description
     if new_due_date:
         if not is_valid_date(new_due_date):
             return        
-        task['due_date'] = new_due_date
+        changes['due_date'] = new_due_date
     
-    save_tasks()
+    try:
+        store.update(task_id, changes, base=task)
+    except KeyError:
+        print(f"Task {task_id} was deleted by another session.")
+        return
+    except TaskConflictError as e:
+        print(f"Error: {e}. Nothing was changed; please try again.")
+        return
+    except OSError as e:
+        print(f"Error saving tasks: {e}")
+        return
     print(f"Task {task_id} updated successfully!")
 
 def mark_task_complete():
@@ -168,8 +231,14 @@ def mark_task_complete():
         print(f"Task {task_id} not found.")
         return
 
-    tasks[task_id]['status'] = 'complete'
-    save_tasks()
+    try:
+        store.update(task_id, {'status': 'complete'})
+    except KeyError:
+        print(f"Task {task_id} was deleted by another session.")
+        return
+    except OSError as e:
+        print(f"Error saving tasks: {e}")
+        return
     print(f"Task {task_id} marked as complete.")
 
 def delete_task():
@@ -185,8 +254,14 @@ def delete_task():
     confirm = input(f"Are you sure you want to delete task {task_id}? (y/n): ").strip().lower()
     
     if confirm == 'y':
-        del tasks[task_id]
-        save_tasks()
+        try:
+            deleted = store.delete(task_id)
+        except OSError as e:
+            print(f"Error saving tasks: {e}")
+            return
+        if not deleted:
+            print(f"Task {task_id} was already deleted by another session.")
+            return
         print(f"Task {task_id} deleted successfully!")
     else:
         print("Deletion cancelled.")
@@ -200,16 +275,16 @@ def display_menu():
     print("4. Update Task")
     print("5. Mark Task as Complete")
     print("6. Delete Task")
-    print("7. Exit")
+    print("7. Find Tasks")
+    print("8. Exit")
 
-def main():
-    """Main application function."""
-    load_tasks()
-    
+def run_menu():
+    """Run the interactive menu until the user exits."""
     while True:
+        store.refresh()  # show what other sessions saved meanwhile
         display_menu()
         
-        choice = input("Enter your choice (1-7): ")
+        choice = input("Enter your choice (1-8): ")
         
         if not choice.isdigit():
             print("Invalid input. Choice must be a number.")
@@ -228,10 +303,254 @@ def main():
         elif choice == "6":
             delete_task()
         elif choice == "7":
+            find_tasks()
+        elif choice == "8":
+            store.close()
             print("Exiting Task Tracker. Goodbye!")
             break
         else:
             print("Invalid choice. Please try again.")
 
+def date_arg(value):
+    """argparse type for a YYYY-MM-DD date."""
+    if not is_date(value):
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, use YYYY-MM-DD")
+    return value
+
+def count_arg(minimum):
+    """argparse type for a whole number of at least `minimum`."""
+    def parse(value):
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if number is None or number < minimum:
+            raise argparse.ArgumentTypeError(
+                f"invalid count {value!r}, use a whole number of {minimum} or more")
+        return number
+    return parse
+
+non_negative_int = count_arg(0)
+positive_int = count_arg(1)
+
+def seconds_arg(value):
+    """argparse type for a number of seconds above 0."""
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    # Also rules out nan and inf, which threading can't wait for
+    if number is None or not 0 < number < float("inf"):
+        raise argparse.ArgumentTypeError(f"invalid seconds {value!r}, use a number above 0")
+    return number
+
+def query_criteria(args):
+    """The TaskStore.query filters and sort order given on the command line."""
+    return {
+        "status": args.status,
+        "due_from": args.due_from,
+        "due_to": args.due_to,
+        "overdue": args.overdue,
+        "keyword": args.keyword,
+        "sort": args.sort.lstrip("-"),
+        "descending": args.sort.startswith("-"),
+    }
+
+def file_format(args):
+    """The format of an import or export file, from --format or its extension."""
+    fmt = args.format or guess_format(args.file)
+    if fmt is None:
+        print(f"Error: Can't tell the format of {args.file}; pass --format csv or ndjson.",
+              file=sys.stderr)
+    return fmt
+
+def cmd_add(args):
+    if not args.title.strip():
+        print("Error: Title cannot be empty.", file=sys.stderr)
+        return 1
+    error = due_date_error(args.due)
+    if error:
+        print(error, file=sys.stderr)
+        return 1
+    task_id = store.add({
+        "title": args.title,
+        "description": args.description,
+        "due_date": args.due,
+        "status": "incomplete",
+        "created_date": datetime.today().strftime("%Y-%m-%d")
+    })
+    print(task_id)
+    return 0
+
+def cmd_list(args):
+    page, total = store.query(limit=args.limit, offset=args.offset, **query_criteria(args))
+    if not page:
+        print(f"No tasks past the first {total}." if total else "No tasks found.")
+        return 0
+    print_task_table(page)
+    print(f"Showing {args.offset + 1}-{args.offset + len(page)} of {total}")
+    return 0
+
+def split_known(task_ids):
+    """Split IDs into those of existing tasks and the rest, reporting the rest."""
+    known = [task_id for task_id in dict.fromkeys(task_ids) if task_id in tasks]
+    missing = [task_id for task_id in task_ids if task_id not in tasks]
+    for task_id in missing:
+        print(f"Task {task_id} not found.", file=sys.stderr)
+    return known, missing
+
+def cmd_complete(args):
+    with store.transaction():
+        known, missing = split_known(args.ids)
+        if known:
+            store.commit(put={task_id: dict(tasks[task_id], status="complete")
+                              for task_id in known})
+    if known:
+        print(f"Marked {len(known)} task(s) as complete.")
+    return 1 if missing else 0
+
+def cmd_delete(args):
+    with store.transaction():
+        known, missing = split_known(args.ids)
+        if known:
+            store.commit(delete=known)
+    if known:
+        print(f"Deleted {len(known)} task(s).")
+    return 1 if missing else 0
+
+def cmd_import(args):
+    fmt = file_format(args)
+    if fmt is None:
+        return 2
+    skipped = 0
+    
+    def report(line, message):
+        nonlocal skipped
+        skipped += 1
+        print(f"{args.file}:{line}: skipped, {message}", file=sys.stderr)
+    
+    if args.file == "-":
+        imported = import_tasks(store, sys.stdin, fmt, args.batch_size, report)
+    else:
+        with open(args.file, newline="", encoding="utf-8") as f:
+            imported = import_tasks(store, f, fmt, args.batch_size, report)
+    print(f"Imported {imported} task(s), skipped {skipped}.", file=sys.stderr)
+    return 1 if skipped else 0
+
+def cmd_export(args):
+    fmt = file_format(args)
+    if fmt is None:
+        return 2
+    items = store.iter_tasks(**query_criteria(args))
+    if args.file == "-":
+        exported = export_tasks(items, sys.stdout, fmt)
+    else:
+        with open(args.file, "w", newline="", encoding="utf-8") as f:
+            exported = export_tasks(items, f, fmt)
+    print(f"Exported {exported} task(s).", file=sys.stderr)
+    return 0
+
+def cmd_remind(args):
+    hooks = [] if args.quiet else [stdout_hook]
+    if args.log:
+        hooks.append(log_file_hook(args.log))
+    try:
+        hooks += [load_hook(spec) for spec in args.hook]
+    except (ImportError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    scheduler = Scheduler(store, hooks, remind_before=timedelta(days=args.days_before),
+                          poll_interval=args.poll, reminded_file=reminded_path(store.path))
+    if args.once:
+        scheduler.fire_due()
+        return 0
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def build_parser():
+    """The command line parser; without a command the menu runs."""
+    parser = argparse.ArgumentParser(
+        description="Track tasks. Run without a command for the interactive menu.")
+    parser.add_argument("--tasks-file", default=TASKS_FILE,
+                        help=f"tasks file to use (default: {TASKS_FILE})")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    
+    # Filters shared by list and export
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("--status", choices=STATUSES)
+    filters.add_argument("--due-from", type=date_arg, help="due on or after this date")
+    filters.add_argument("--due-to", type=date_arg, help="due on or before this date")
+    filters.add_argument("--overdue", action="store_true", help="only incomplete tasks past due")
+    filters.add_argument("--keyword", help="title words starting with each word of this")
+    filters.add_argument("--sort", default="id",
+                         choices=SORT_KEYS + tuple("-" + key for key in SORT_KEYS),
+                         help="sort order; a leading - reverses it, e.g. --sort=-due_date")
+    
+    add = commands.add_parser("add", help="add a task and print its ID")
+    add.add_argument("--title", required=True)
+    add.add_argument("--description", default="")
+    add.add_argument("--due", required=True, help="due date, YYYY-MM-DD")
+    add.set_defaults(handler=cmd_add)
+    
+    list_ = commands.add_parser("list", parents=[filters], help="list tasks as a table")
+    list_.add_argument("--limit", type=positive_int, help="show at most this many tasks")
+    list_.add_argument("--offset", type=non_negative_int, default=0, help="skip this many tasks")
+    list_.set_defaults(handler=cmd_list)
+    
+    complete = commands.add_parser("complete", help="mark tasks as complete")
+    complete.add_argument("ids", nargs="+", metavar="id")
+    complete.set_defaults(handler=cmd_complete)
+    
+    delete = commands.add_parser("delete", help="delete tasks")
+    delete.add_argument("ids", nargs="+", metavar="id")
+    delete.set_defaults(handler=cmd_delete)
+    
+    import_ = commands.add_parser("import", help="add the tasks in a CSV or NDJSON file")
+    import_.add_argument("file", help="file to read, - for stdin")
+    import_.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    import_.add_argument("--batch-size", type=positive_int, default=BATCH_SIZE,
+                         help=f"tasks saved per write (default: {BATCH_SIZE})")
+    import_.set_defaults(handler=cmd_import)
+    
+    export = commands.add_parser("export", parents=[filters],
+                                 help="write tasks to a CSV or NDJSON file")
+    export.add_argument("file", help="file to write, - for stdout")
+    export.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    export.set_defaults(handler=cmd_export)
+    
+    remind = commands.add_parser("remind", help="keep running and remind about tasks as they come due")
+    remind.add_argument("--days-before", type=non_negative_int, default=0,
+                        help="remind this many days before the due date (default: 0)")
+    remind.add_argument("--log", metavar="FILE", help="also append reminders to this file")
+    remind.add_argument("--hook", action="append", default=[], metavar="MODULE:FUNCTION",
+                        help="also call function(task_id, task) for each reminder; repeatable")
+    remind.add_argument("--quiet", action="store_true", help="don't print reminders")
+    remind.add_argument("--poll", type=seconds_arg, default=POLL_INTERVAL,
+                        help=f"seconds between checks for changes made by other commands "
+                             f"(default: {POLL_INTERVAL:g})")
+    remind.add_argument("--once", action="store_true",
+                        help="remind about the tasks due now that weren't reminded about yet, "
+                             "and exit, e.g. from cron")
+    remind.set_defaults(handler=cmd_remind)
+    return parser
+
+def main(argv=None):
+    """Main application function."""
+    args = build_parser().parse_args(argv)
+    load_tasks(args.tasks_file)
+    try:
+        if args.command is None:
+            run_menu()
+            return 0
+        return args.handler(args)
+    except OSError as e:
+        print(f"Error saving tasks: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
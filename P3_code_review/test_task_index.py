@@ -0,0 +1,152 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from task_index import _BULK_MIN, TaskIndex, id_key, title_words
+from task_store import TaskStore
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'report', 'review', 'read', 'fix', 'bug']
+STATUSES = ['incomplete', 'complete', 'blocked']
+TODAY = '2026-06-10'
+QUERIES = 2000
+
+
+def random_task(rng):
+    """A task with a two-word title, any status, and a due date (or none)."""
+    due_date = rng.choice(['', f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"])
+    return {'title': ' '.join(rng.sample(WORDS, 2)).capitalize(),
+            'status': rng.choice(STATUSES), 'due_date': due_date}
+
+
+def random_criteria(rng):
+    return {'status': rng.choice([None, 'complete', 'incomplete']),
+            'due_from': rng.choice([None, '2026-03-01', '2026-06-10']),
+            'due_to': rng.choice([None, '2026-06-10', '2026-09-15']),
+            'overdue': rng.random() < 0.3,
+            'keyword': rng.choice([None, 're', 'fix', 'be al', 'REV', 'zzz']),
+            'sort': rng.choice(['id', 'due_date', 'title']),
+            'descending': rng.random() < 0.5}
+
+
+def brute_force(tasks, status=None, due_from=None, due_to=None, overdue=False,
+                keyword=None, sort='id', descending=False, today=TODAY):
+    """What TaskIndex.query should return, by checking every task."""
+    ids = []
+    for task_id, task in tasks.items():
+        due_date = task.get('due_date') or None
+        words = title_words(task['title'])
+        if status is not None and task['status'] != status:
+            continue
+        if (due_from or due_to or overdue) and due_date is None:
+            continue
+        if due_from and due_date < due_from or due_to and due_date > due_to:
+            continue
+        if overdue and (task['status'] == 'complete' or due_date >= today):
+            continue
+        if keyword and not all(any(word.startswith(term) for word in words)
+                               for term in title_words(keyword)):
+            continue
+        ids.append(task_id)
+
+    if sort == 'due_date':
+        dated = sorted((i for i in ids if tasks[i]['due_date']),
+                       key=lambda i: (tasks[i]['due_date'], id_key(i)), reverse=descending)
+        undated = sorted((i for i in ids if not tasks[i]['due_date']),
+                         key=id_key, reverse=descending)
+        return dated + undated
+    if sort == 'title':
+        return sorted(ids, key=lambda i: (tasks[i]['title'].lower(), id_key(i)),
+                      reverse=descending)
+    return sorted(ids, key=id_key, reverse=descending)
+
+
+class TestTaskIndexQuery(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1)
+        self.tasks = {str(i): random_task(self.rng) for i in range(1, 301)}
+        self.index = TaskIndex(self.tasks)
+
+    def change_tasks(self):
+        """Add, replace and remove tasks one by one and in a bulk batch."""
+        for _ in range(20):
+            task_id = str(self.rng.randint(1, 400))
+            if self.rng.random() < 0.3 and task_id in self.tasks:
+                del self.tasks[task_id]
+                self.index.remove(task_id)
+            else:
+                self.tasks[task_id] = random_task(self.rng)
+                self.index.add(task_id, self.tasks[task_id])
+        size = self.rng.choice([5, _BULK_MIN + 50])
+        batch = {str(self.rng.randint(1, 500)): random_task(self.rng) for _ in range(size)}
+        self.tasks.update(batch)
+        self.index.add_many(batch.items())
+
+    def assert_matches_brute_force(self, criteria, first=None):
+        expected = brute_force(self.tasks, **criteria)
+        ids, total = self.index.query(self.tasks, first=first, today=TODAY, **criteria)
+        self.assertEqual(ids, expected[:first], criteria)
+        self.assertEqual(total, len(expected), criteria)
+
+    def test_queries_match_brute_force(self):
+        for n in range(QUERIES):
+            if n % 50 == 0:
+                self.change_tasks()
+            first = self.rng.choice([None, 0, 1, 5, 20, 100000])
+            self.assert_matches_brute_force(random_criteria(self.rng), first)
+
+    def test_bulk_add_then_remove(self):
+        batch = {str(i): random_task(self.rng) for i in range(250, 250 + 2 * _BULK_MIN)}
+        self.tasks.update(batch)
+        self.index.add_many(batch.items())
+        # Removing before any query has sorted the bulk entries
+        for task_id in list(batch)[::3] + ['1', '2']:
+            del self.tasks[task_id]
+            self.index.remove(task_id)
+
+        self.assertEqual(self.index._due, sorted(
+            (task['due_date'],) + id_key(task_id)
+            for task_id, task in self.tasks.items() if task['due_date']))
+        self.assertEqual(self.index._words, sorted(self.index._by_word))
+        for sort in ('id', 'due_date', 'title'):
+            for descending in (False, True):
+                self.assert_matches_brute_force({'sort': sort, 'descending': descending})
+                self.assert_matches_brute_force({'sort': sort, 'descending': descending,
+                                                 'keyword': 'rev', 'due_from': '2026-04-01'}, 7)
+
+    def test_unknown_sort_key(self):
+        with self.assertRaises(ValueError):
+            self.index.query(self.tasks, sort='priority')
+
+
+class TestTaskStoreQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = TaskStore(os.path.join(self.tmp_dir, 'tasks.json'))
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.addCleanup(self.store.close)
+
+    def test_pages_match_brute_force(self):
+        rng = random.Random(2)
+        with self.store.transaction():
+            self.store.commit(put={self.store.allocate_id(): random_task(rng) for _ in range(200)})
+        for task_id in list(self.store.tasks)[::7]:
+            self.store.delete(task_id)
+
+        for _ in range(300):
+            criteria = random_criteria(rng)
+            limit = rng.choice([None, 1, 10, 50])
+            offset = rng.choice([0, 3, 40, 500])
+            expected = brute_force(self.store.tasks, **criteria)
+
+            page, total = self.store.query(limit=limit, offset=offset, today=TODAY, **criteria)
+
+            end = None if limit is None else offset + limit
+            self.assertEqual([task_id for task_id, _ in page], expected[offset:end], criteria)
+            self.assertEqual(total, len(expected))
+            self.assertTrue(all(task is self.store.tasks[task_id] for task_id, task in page))
+
+
+if __name__ == '__main__':
+    unittest.main()
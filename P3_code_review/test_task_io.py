@@ -0,0 +1,267 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+import task_tracker
+from task_io import BATCH_SIZE, export_tasks, import_tasks
+from task_store import TaskStore
+
+TASKS = [
+    {'title': 'Write report', 'description': 'Q3, with "quotes"', 'due_date': '2030-01-15',
+     'status': 'incomplete', 'created_date': '2029-12-01'},
+    {'title': 'Fix bug', 'description': '', 'due_date': '2030-02-01',
+     'status': 'complete', 'created_date': '2029-12-02'},
+    {'title': 'Read, then review', 'description': 'line one\nline two', 'due_date': '2030-03-01',
+     'status': 'incomplete', 'created_date': '2029-12-03'},
+]
+
+
+class TaskIOTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def open_store(self, name='tasks.json'):
+        store = TaskStore(os.path.join(self.tmp_dir, name))
+        self.addCleanup(store.close)
+        return store
+
+    def commits(self, store):
+        """A list that gets the IDs saved by each of the store's commits from now on."""
+        commits = []
+        store.listeners.append(lambda put, delete: commits.append(sorted(put)))
+        return commits
+
+
+class TestRoundTrip(TaskIOTestCase):
+    def round_trip(self, fmt):
+        source = self.open_store()
+        for task in TASKS:
+            source.add(task)
+        source.delete('2')
+
+        f = io.StringIO(newline='')
+        self.assertEqual(export_tasks(source.iter_tasks(), f, fmt), 2)
+        f.seek(0)
+        target = self.open_store('copy.json')
+        target.add(dict(TASKS[1]))  # so the imported tasks get new IDs
+        self.assertEqual(import_tasks(target, f, fmt), 2)
+
+        self.assertEqual(target.get('2'), dict(TASKS[0], version=1))
+        self.assertEqual(target.get('3'), dict(TASKS[2], version=1))
+        return f.getvalue()
+
+    def test_csv(self):
+        lines = self.round_trip('csv').splitlines()
+        self.assertEqual(lines[0], 'id,title,description,due_date,status,created_date')
+        self.assertTrue(lines[1].startswith('1,Write report,"Q3, with ""quotes"""'))
+
+    def test_ndjson(self):
+        lines = self.round_trip('ndjson').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1]), dict(TASKS[2], id='3', version=1))
+
+    def test_defaults_for_optional_fields(self):
+        store = self.open_store()
+        f = io.StringIO('{"title": "A", "due_date": "2030-01-01", "id": "99"}\n')
+        import_tasks(store, f, 'ndjson')
+        task = store.get('1')
+        self.assertEqual((task['status'], task['description']), ('incomplete', ''))
+        self.assertEqual(len(task['created_date']), 10)
+        self.assertIsNone(store.get('99'))
+
+
+class TestErrors(TaskIOTestCase):
+    def import_with_errors(self, text, fmt):
+        store = self.open_store()
+        errors = []
+        imported = import_tasks(store, io.StringIO(text), fmt,
+                                on_error=lambda line, message: errors.append((line, message)))
+        return store, imported, errors
+
+    def test_ndjson_errors_name_the_line(self):
+        text = ('{"title": "A", "due_date": "2030-01-01"}\n'
+                '{"title": "B", "due_date": \n'
+                '\n'
+                '["not", "an", "object"]\n'
+                '{"title": " ", "due_date": "2030-01-01"}\n'
+                '{"title": "C", "due_date": "2030-1-1"}\n'
+                '{"title": "D", "due_date": "2030-01-01", "status": "done"}\n'
+                '{"title": "E", "due_date": "2030-01-01", "created_date": "yesterday"}\n'
+                '{"title": "F", "due_date": "2030-02-30"}\n'
+                '{"title": "G", "due_date": "2030-01-01"}\n')
+        store, imported, errors = self.import_with_errors(text, 'ndjson')
+
+        self.assertEqual(imported, 2)
+        self.assertEqual([task['title'] for task in store.tasks.values()], ['A', 'G'])
+        self.assertEqual([line for line, _ in errors], [2, 4, 5, 6, 7, 8, 9])
+        self.assertTrue(errors[0][1].startswith('invalid JSON'))
+        self.assertEqual(errors[1][1], 'expected a JSON object')
+        self.assertEqual(errors[2][1], 'title is missing')
+        self.assertIn("'2030-1-1'", errors[3][1])
+        self.assertIn("'done'", errors[4][1])
+        self.assertIn("created_date 'yesterday'", errors[5][1])
+
+    def test_csv_errors_name_the_line(self):
+        text = ('title,due_date,status\n'
+                'A,2030-01-01,\n'
+                ',2030-01-01,\n'
+                'C,01/02/2030,\n'
+                'D,2030-01-01,complete\n')
+        store, imported, errors = self.import_with_errors(text, 'csv')
+
+        self.assertEqual(imported, 2)
+        self.assertEqual([(task['title'], task['status']) for task in store.tasks.values()],
+                         [('A', 'incomplete'), ('D', 'complete')])
+        self.assertEqual([line for line, _ in errors], [3, 4])
+
+
+class TestBatches(TaskIOTestCase):
+    def test_one_commit_per_batch(self):
+        store = self.open_store()
+        commits = self.commits(store)
+        text = ''.join(json.dumps({'title': str(i), 'due_date': '2030-01-01'}) + '\n'
+                       for i in range(7))
+        text += '{"title": "bad"}\n'
+
+        self.assertEqual(import_tasks(store, io.StringIO(text), 'ndjson', batch_size=3), 7)
+
+        self.assertEqual(commits, [['1', '2', '3'], ['4', '5', '6'], ['7']])
+        with open(store.journal_path, 'rb') as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_default_batch_size(self):
+        store = self.open_store()
+        commits = self.commits(store)
+        text = ''.join(json.dumps({'title': str(i), 'due_date': '2030-01-01'}) + '\n'
+                       for i in range(BATCH_SIZE + 1))
+
+        self.assertEqual(import_tasks(store, io.StringIO(text), 'ndjson'), BATCH_SIZE + 1)
+        self.assertEqual([len(ids) for ids in commits], [BATCH_SIZE, 1])
+
+
+class TestCommandLine(TaskIOTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tasks_file = os.path.join(self.tmp_dir, 'tasks.json')
+
+    def run_main(self, *argv):
+        """Run the command line; returns (exit code, stdout, stderr)."""
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                code = task_tracker.main(['--tasks-file', self.tasks_file] + list(argv))
+            except SystemExit as e:
+                code = e.code
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def write_file(self, name, text):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def add(self, title, due='2030-01-01'):
+        code, out, _ = self.run_main('add', '--title', title, '--due', due)
+        self.assertEqual(code, 0)
+        return out.strip()
+
+    def test_add_list_complete_and_delete(self):
+        ids = [self.add(title, due) for title, due in
+               [('Write report', '2030-03-01'), ('Fix bug', '2030-01-01'), ('Read', '2030-02-01')]]
+        self.assertEqual(ids, ['1', '2', '3'])
+
+        code, out, _ = self.run_main('list', '--sort=-due_date', '--limit', '2')
+        self.assertEqual(code, 0)
+        rows = out.splitlines()
+        self.assertEqual([row.split()[0] for row in rows[2:4]], ['1', '3'])
+        self.assertEqual(rows[-1], 'Showing 1-2 of 3')
+
+        self.assertEqual(self.run_main('complete', '2', '4'),
+                         (1, 'Marked 1 task(s) as complete.\n', 'Task 4 not found.\n'))
+        self.assertEqual(self.run_main('complete', '2')[0], 0)
+        code, out, _ = self.run_main('list', '--status', 'complete')
+        self.assertEqual(out.splitlines()[-1], 'Showing 1-1 of 1')
+
+        self.assertEqual(self.run_main('delete', '1')[0], 0)
+        self.assertEqual(self.run_main('delete', '1')[0], 1)
+        self.assertEqual(self.run_main('list', '--offset', '5')[1], 'No tasks past the first 2.\n')
+
+    def test_add_rejects_past_and_invalid_dates(self):
+        for due in ('2000-01-01', 'soon'):
+            code, _, err = self.run_main('add', '--title', 'A', '--due', due)
+            self.assertEqual(code, 1)
+            self.assertTrue(err.startswith('Error:'))
+
+    def test_import_and_export(self):
+        path = self.write_file('in.ndjson', '{"title": "A", "due_date": "2030-01-01"}\n'
+                                            '{"title": "B"}\n'
+                                            '{"title": "C", "due_date": "2030-01-02"}\n')
+        code, _, err = self.run_main('import', path, '--batch-size', '1')
+        self.assertEqual(code, 1)
+        self.assertEqual(err.splitlines(), [
+            f"{path}:2: skipped, due_date None isn't a YYYY-MM-DD date",
+            'Imported 2 task(s), skipped 1.',
+        ])
+
+        out_path = os.path.join(self.tmp_dir, 'out.csv')
+        code, _, err = self.run_main('export', out_path, '--keyword', 'c')
+        self.assertEqual((code, err), (0, 'Exported 1 task(s).\n'))
+        with open(out_path, newline='', encoding='utf-8') as f:
+            self.assertEqual(f.read().splitlines()[1].split(',')[:2], ['2', 'C'])
+
+        code, _, err = self.run_main('import', out_path)
+        self.assertEqual((code, err), (0, 'Imported 1 task(s), skipped 0.\n'))
+
+        code, out, _ = self.run_main('export', '-', '--format', 'ndjson')
+        self.assertEqual([json.loads(line)['id'] for line in out.splitlines()], ['1', '2', '3'])
+
+    def test_unknown_file_format(self):
+        path = self.write_file('tasks.txt', '')
+        for command in ('import', 'export'):
+            code, _, err = self.run_main(command, path)
+            self.assertEqual(code, 2)
+            self.assertIn('--format', err)
+
+    def test_invalid_arguments_exit_with_usage_error(self):
+        for argv in (['list', '--limit', '-1'], ['list', '--limit', '0'],
+                     ['list', '--offset', '-5'], ['list', '--limit', 'ten'],
+                     ['import', 'x.csv', '--batch-size', '0'],
+                     ['list', '--due-from', '2030-13-01'], ['list', '--sort', 'priority'],
+                     ['remind', '--poll', '0'], ['remind', '--poll', '-1'],
+                     ['remind', '--poll', 'nan'], ['remind', '--days-before', '-1'],
+                     ['frobnicate']):
+            code, _, err = self.run_main(*argv)
+            self.assertEqual(code, 2, argv)
+            self.assertIn('error:', err)
+        self.assertIn("invalid count '-1'", self.run_main('list', '--limit', '-1')[2])
+
+    def test_remind_once_does_not_repeat_reminders(self):
+        store = TaskStore(self.tasks_file)
+        overdue = store.add({'title': 'Overdue', 'due_date': '2000-01-01', 'status': 'incomplete'})
+        store.add({'title': 'Later', 'due_date': '2999-01-01', 'status': 'incomplete'})
+        store.close()
+
+        code, out, _ = self.run_main('remind', '--once')
+        self.assertEqual((code, out),
+                         (0, f'Reminder: task {overdue} "Overdue" is due 2000-01-01.\n'))
+        self.assertEqual(self.run_main('remind', '--once'), (0, '', ''))
+
+        self.assertEqual(self.run_main('complete', overdue)[0], 0)
+        store = TaskStore(self.tasks_file)
+        store.update(overdue, {'status': 'incomplete', 'due_date': '2000-01-02'})
+        store.close()
+        self.assertIn('is due 2000-01-02', self.run_main('remind', '--once')[1])
+
+    def test_add_rejects_a_blank_title(self):
+        for title in ('', '   '):
+            self.assertEqual(self.run_main('add', '--title', title, '--due', '2030-01-01'),
+                             (1, '', 'Error: Title cannot be empty.\n'))
+        self.assertEqual(self.run_main('list'), (0, 'No tasks found.\n', ''))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr
+from datetime import datetime, timedelta
+
+from task_scheduler import Scheduler, reminded_path
+from task_store import TaskStore
+
+
+class FakeClock:
+    """A clock for Scheduler that only moves when told to."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, text):
+        self.now = datetime.fromisoformat(text)
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'tasks.json')
+        self.store = self.open_store()
+        self.clock = FakeClock(datetime(2030, 1, 1, 9, 0))
+        self.reminded = []
+
+    def open_store(self):
+        store = TaskStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def add(self, title, due_date, status='incomplete', store=None):
+        return (store or self.store).add({'title': title, 'due_date': due_date, 'status': status})
+
+    def scheduler(self, hooks=None, **kwargs):
+        if hooks is None:
+            hooks = [lambda task_id, task: self.reminded.append((task_id, task['title']))]
+        return Scheduler(self.store, hooks, clock=self.clock, **kwargs)
+
+    def fire_at(self, scheduler, when):
+        """Move the clock and fire; returns the reminders fired."""
+        self.clock.set(when)
+        start = len(self.reminded)
+        scheduler.fire_due()
+        return self.reminded[start:]
+
+
+class TestDeadlines(SchedulerTestCase):
+    def test_reminders_fire_in_deadline_order(self):
+        for n in range(1, 11):
+            due_date = '2030-01-03' if n in (9, 10) else f"2030-01-{13 - n:02d}"
+            self.add(f"task {n}", due_date)
+        self.add('no due date', '')
+        self.add('done', '2030-01-01', status='complete')
+        scheduler = self.scheduler()
+
+        self.assertEqual(scheduler.next_deadline(), datetime(2030, 1, 3))
+        self.assertEqual(self.fire_at(scheduler, '2030-01-02T23:59'), [])
+        self.assertEqual(self.fire_at(scheduler, '2030-01-05T00:00'),
+                         [('9', 'task 9'), ('10', 'task 10'), ('8', 'task 8')])
+        self.assertEqual([task_id for task_id, _ in self.fire_at(scheduler, '2031-01-01')],
+                         ['7', '6', '5', '4', '3', '2', '1'])
+        self.assertIsNone(scheduler.next_deadline())
+
+    def test_remind_before(self):
+        self.add('A', '2030-01-05')
+        scheduler = self.scheduler(remind_before=timedelta(days=2))
+
+        self.assertEqual(scheduler.next_deadline(), datetime(2030, 1, 3))
+        self.assertEqual(self.fire_at(scheduler, '2030-01-03T00:00'), [('1', 'A')])
+
+    def test_next_deadline_skips_stale_entries(self):
+        first = self.add('A', '2030-01-02')
+        self.add('B', '2030-01-04')
+        scheduler = self.scheduler()
+
+        self.store.update(first, {'due_date': '2030-01-06'})
+        self.assertEqual(len(scheduler._heap), 3)
+        self.assertEqual(scheduler.next_deadline(), datetime(2030, 1, 4))
+        self.assertEqual(len(scheduler._heap), 2)
+
+
+class TestChanges(SchedulerTestCase):
+    def test_changes_reschedule(self):
+        moved = self.add('moved', '2030-01-02')
+        completed = self.add('completed', '2030-01-02')
+        deleted = self.add('deleted', '2030-01-02')
+        scheduler = self.scheduler()
+
+        self.store.update(moved, {'due_date': '2030-01-05'})
+        self.store.update(completed, {'status': 'complete'})
+        self.store.delete(deleted)
+        added = self.add('added', '2030-01-03')
+
+        self.assertEqual(self.fire_at(scheduler, '2030-01-04'), [(added, 'added')])
+        self.assertEqual(self.fire_at(scheduler, '2030-01-05'), [(moved, 'moved')])
+        self.assertIsNone(scheduler.next_deadline())
+
+    def test_no_second_reminder_after_a_title_edit(self):
+        task_id = self.add('A', '2030-01-02')
+        scheduler = self.scheduler()
+        self.assertEqual(self.fire_at(scheduler, '2030-01-02'), [(task_id, 'A')])
+
+        self.store.update(task_id, {'title': 'B'})
+        self.assertIsNone(scheduler.next_deadline())
+        self.assertEqual(self.fire_at(scheduler, '2030-01-03'), [])
+
+        # A new due date is worth a new reminder, and so is reopening the task
+        self.store.update(task_id, {'due_date': '2030-01-04'})
+        self.assertEqual(self.fire_at(scheduler, '2030-01-04'), [(task_id, 'B')])
+        self.store.update(task_id, {'status': 'complete'})
+        self.store.update(task_id, {'status': 'incomplete'})
+        self.assertEqual(self.fire_at(scheduler, '2030-01-04'), [(task_id, 'B')])
+
+    def test_stale_entries_are_pruned(self):
+        task_id = self.add('A', '2030-01-02')
+        self.add('B', '2030-06-01')
+        scheduler = self.scheduler()
+
+        for day in range(1000):
+            due_date = (datetime(2031, 1, 1) + timedelta(days=day)).date().isoformat()
+            self.store.update(task_id, {'due_date': due_date})
+            self.assertLessEqual(len(scheduler._heap), 2 * 2 + 64 + 1)
+
+        self.assertEqual(self.fire_at(scheduler, '2033-09-27'), [('2', 'B'), (task_id, 'A')])
+
+
+class TestRemindedFile(SchedulerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reminded_file = reminded_path(self.path)
+
+    def restart(self):
+        """A scheduler as a new process would start it, from the same files."""
+        self.store.close()
+        self.store = self.open_store()
+        return self.scheduler(reminded_file=self.reminded_file)
+
+    def test_reminders_are_not_repeated_after_a_restart(self):
+        first = self.add('A', '2030-01-01')
+        second = self.add('B', '2030-01-03')
+        scheduler = self.scheduler(reminded_file=self.reminded_file)
+        self.assertEqual(self.fire_at(scheduler, '2030-01-02'), [(first, 'A')])
+
+        scheduler = self.restart()
+        self.assertEqual(scheduler.next_deadline(), datetime(2030, 1, 3))
+        self.assertEqual(self.fire_at(scheduler, '2030-01-04'), [(second, 'B')])
+        self.assertEqual(self.fire_at(self.restart(), '2030-01-05'), [])
+
+    def test_changes_while_stopped_get_a_new_reminder(self):
+        moved = self.add('moved', '2030-01-01')
+        reopened = self.add('reopened', '2030-01-01')
+        deleted = self.add('deleted', '2030-01-01')
+        self.fire_at(self.scheduler(reminded_file=self.reminded_file), '2030-01-02')
+
+        self.store.update(moved, {'due_date': '2030-01-02'})
+        self.store.update(reopened, {'status': 'complete'})
+        self.store.update(reopened, {'status': 'incomplete'})
+        self.store.delete(deleted)
+
+        self.assertEqual(self.fire_at(self.restart(), '2030-01-03'),
+                         [(reopened, 'reopened'), (moved, 'moved')])
+
+    def test_changes_while_running_are_saved(self):
+        task_id = self.add('A', '2030-01-01')
+        scheduler = self.scheduler(reminded_file=self.reminded_file)
+        self.fire_at(scheduler, '2030-01-02')
+
+        # Reopened while this scheduler runs, then restarted before it came due again
+        self.store.update(task_id, {'status': 'complete'})
+        self.store.update(task_id, {'status': 'incomplete', 'due_date': '2030-02-01'})
+        self.assertEqual(self.restart().next_deadline(), datetime(2030, 2, 1))
+
+    def test_a_corrupted_file_is_ignored(self):
+        self.add('A', '2030-01-01')
+        with open(self.reminded_file, 'w') as f:
+            f.write('{"1": ')
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            scheduler = self.scheduler(reminded_file=self.reminded_file)
+        self.assertIn('Ignoring', stderr.getvalue())
+        self.assertEqual(self.fire_at(scheduler, '2030-01-02'), [('1', 'A')])
+
+
+class TestHooks(SchedulerTestCase):
+    def test_a_failing_hook_does_not_stop_the_others(self):
+        def broken(task_id, task):
+            raise RuntimeError('no network')
+
+        first, second = [], []
+        self.add('A', '2030-01-01')
+        self.add('B', '2030-01-01')
+        scheduler = self.scheduler([lambda i, t: first.append(i), broken,
+                                    lambda i, t: second.append(i)])
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            self.assertEqual(scheduler.fire_due(), 2)
+
+        self.assertEqual((first, second), (['1', '2'], ['1', '2']))
+        self.assertEqual(stderr.getvalue().count('no network'), 2)
+
+
+class TestRun(SchedulerTestCase):
+    def start(self, scheduler):
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(scheduler.stop)
+        return thread
+
+    def test_stop_ends_run(self):
+        scheduler = self.scheduler(poll_interval=None)
+        thread = self.start(scheduler)
+
+        scheduler.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_run_picks_up_other_processes_changes(self):
+        fired = threading.Event()
+        scheduler = self.scheduler([lambda task_id, task: fired.set()], poll_interval=0.05)
+        thread = self.start(scheduler)
+
+        other = self.open_store()
+        self.add('later', '2031-01-01', store=other)
+        task_id = self.add('now', '2030-01-01', store=other)
+        self.assertTrue(fired.wait(5))
+
+        scheduler.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(self.store.tasks), ['1', task_id])
+        self.assertEqual(scheduler.next_deadline(), datetime(2031, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,299 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from task_store import TaskConflictError, TaskStore, TaskStoreError
+
+PROCESSES = 4
+TASKS_PER_PROCESS = 150
+COMPACT_AFTER = 25  # small, so the processes compact under each other's feet
+
+
+def add_tasks(path, name, results):
+    """Add tasks, returning the IDs handed out."""
+    store = TaskStore(path, compact_after=COMPACT_AFTER)
+    ids = [store.add({'title': f"{name}-{i}", 'due_date': '2030-01-01', 'status': 'incomplete'})
+           for i in range(TASKS_PER_PROCESS)]
+    store.close()
+    results.put((name, ids))
+
+
+def mixed_workload(path, name, results):
+    """Add, update, complete and delete own tasks, and bump a shared counter."""
+    store = TaskStore(path, compact_after=COMPACT_AFTER)
+    expected = {}
+    for i in range(TASKS_PER_PROCESS):
+        task_id = store.add({'title': f"{name}-{i}", 'due_date': '2030-01-01',
+                             'status': 'incomplete'})
+        expected[task_id] = f"{name}-{i}"
+        if i % 3 == 0:
+            store.update(task_id, {'title': f"{name}-{i}-renamed"}, base=dict(store.tasks[task_id]))
+            expected[task_id] = f"{name}-{i}-renamed"
+        if i % 5 == 0:
+            store.update(task_id, {'status': 'complete'})
+        if i % 7 == 0:
+            store.delete(task_id)
+            del expected[task_id]
+        # Read-modify-write of a task every process changes
+        with store.transaction():
+            counter = store.tasks['1']
+            store.commit(put={'1': dict(counter, count=counter['count'] + 1)})
+    store.close()
+    results.put((name, expected))
+
+
+def run_processes(target, path):
+    """Run `target` in PROCESSES processes at once; returns what each put in the queue."""
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=target, args=(path, f"p{n}", results))
+                 for n in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    collected = dict(results.get(timeout=120) for _ in processes)
+    for process in processes:
+        process.join(timeout=30)
+        if process.exitcode != 0:
+            raise AssertionError(f"{process.name} exited with {process.exitcode}")
+    return collected
+
+
+class TaskStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'tasks.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def open_store(self, **kwargs):
+        store = TaskStore(self.path, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+
+class TestJournal(TaskStoreTestCase):
+    def journal_lines(self, store):
+        with open(store.journal_path, 'rb') as f:
+            return f.readlines()
+
+    def test_changes_are_journaled_and_replayed(self):
+        store = self.open_store()
+        first = store.add({'title': 'A', 'status': 'incomplete'})
+        second = store.add({'title': 'B', 'status': 'incomplete'})
+        store.update(first, {'status': 'complete'})
+        store.delete(second)
+
+        records = [json.loads(line) for line in self.journal_lines(store)]
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[-1], {'next_id': 3, 'delete': [second]})
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {})
+
+        reopened = self.open_store()
+        self.assertEqual(reopened.tasks, store.tasks)
+        self.assertEqual(reopened.get(first)['status'], 'complete')
+        self.assertEqual(reopened.query(status='complete')[1], 1)
+
+    def test_compaction_folds_the_journal_into_the_snapshot(self):
+        store = self.open_store(compact_after=3)
+        ids = [store.add({'title': str(i), 'status': 'incomplete'}) for i in range(3)]
+
+        with open(self.path) as f:
+            self.assertEqual(sorted(json.load(f)), ids)
+        self.assertEqual([json.loads(line) for line in self.journal_lines(store)],
+                         [{'next_id': 4}])
+        self.assertEqual(self.open_store().tasks, store.tasks)
+
+    def test_torn_last_line_is_ignored_and_cut_off(self):
+        store = self.open_store()
+        kept = store.add({'title': 'A', 'status': 'incomplete'})
+        store.close()
+        with open(store.journal_path, 'ab') as f:
+            f.write(b'{"next_id": 3, "put": {"2": {"tit')
+
+        reopened = self.open_store()
+        self.assertEqual(list(reopened.tasks), [kept])
+        added = reopened.add({'title': 'B', 'status': 'incomplete'})
+
+        self.assertEqual(added, '2')
+        lines = self.journal_lines(reopened)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[-1])['put'][added]['title'], 'B')
+        self.assertEqual(sorted(self.open_store().tasks), [kept, added])
+
+    def test_corrupted_middle_line_raises(self):
+        store = self.open_store()
+        store.add({'title': 'A', 'status': 'incomplete'})
+        store.close()
+        with open(store.journal_path, 'ab') as f:
+            f.write(b'not json\n{"next_id": 2}\n')
+
+        with self.assertRaises(TaskStoreError):
+            TaskStore(self.path)
+
+    def test_legacy_tasks_file_is_picked_up(self):
+        legacy = {'1': {'title': 'A', 'status': 'incomplete'},
+                  '5': {'title': 'B', 'status': 'complete'}}
+        with open(self.path, 'w') as f:
+            json.dump(legacy, f)
+
+        store = self.open_store()
+        self.assertEqual(store.tasks, legacy)
+        self.assertFalse(os.path.exists(store.journal_path))
+        self.assertEqual(store.add({'title': 'C', 'status': 'incomplete'}), '6')
+
+        task = self.open_store().get('5')
+        self.assertEqual(task, legacy['5'])
+        store.update('5', {'title': 'D'})
+        self.assertEqual(self.open_store().get('5')['version'], 1)
+
+    def test_ids_are_not_reused_across_restarts_and_deletes(self):
+        store = self.open_store()
+        ids = [store.add({'title': str(i), 'status': 'incomplete'}) for i in range(3)]
+        store.delete(ids[-1])
+        store.close()
+
+        reopened = self.open_store()
+        self.assertEqual(reopened.next_id, 4)
+        self.assertEqual(reopened.add({'title': 'D', 'status': 'incomplete'}), '4')
+        reopened.delete('4')
+        reopened.compact()
+        reopened.close()
+
+        compacted = self.open_store()
+        self.assertEqual(sorted(compacted.tasks), ids[:2])
+        self.assertEqual(compacted.add({'title': 'E', 'status': 'incomplete'}), '5')
+
+
+class TestVersionsAndMerging(TaskStoreTestCase):
+    def test_every_change_raises_the_version(self):
+        store = self.open_store()
+        task_id = store.add({'title': 'A', 'status': 'incomplete'})
+        self.assertEqual(store.get(task_id)['version'], 1)
+        store.update(task_id, {'title': 'B'})
+        self.assertEqual(store.get(task_id)['version'], 2)
+        self.assertEqual(self.open_store().get(task_id)['version'], 2)
+
+    def test_changes_to_different_fields_are_merged(self):
+        first, second = self.open_store(), self.open_store()
+        task_id = first.add({'title': 'A', 'status': 'incomplete'})
+        second.refresh()
+        seen = dict(first.get(task_id))
+
+        second.update(task_id, {'title': 'B'})
+        task = first.update(task_id, {'status': 'complete'}, base=seen)
+
+        self.assertEqual((task['title'], task['status'], task['version']), ('B', 'complete', 3))
+        self.assertEqual(self.open_store().get(task_id), task)
+
+    def test_changes_to_the_same_field_conflict(self):
+        first, second = self.open_store(), self.open_store()
+        task_id = first.add({'title': 'A', 'status': 'incomplete'})
+        second.refresh()
+        seen = dict(first.get(task_id))
+
+        second.update(task_id, {'title': 'B'})
+        with self.assertRaises(TaskConflictError) as context:
+            first.update(task_id, {'title': 'C'}, base=seen)
+
+        self.assertEqual(context.exception.fields, ['title'])
+        self.assertEqual(self.open_store().get(task_id)['title'], 'B')
+
+    def test_update_of_a_task_deleted_elsewhere_raises_key_error(self):
+        first, second = self.open_store(), self.open_store()
+        task_id = first.add({'title': 'A', 'status': 'incomplete'})
+        second.refresh()
+        second.delete(task_id)
+        with self.assertRaises(KeyError):
+            first.update(task_id, {'title': 'B'})
+        self.assertFalse(first.delete(task_id))
+
+    def test_allocate_id_requires_a_transaction(self):
+        store = self.open_store()
+        with self.assertRaises(RuntimeError):
+            store.allocate_id()
+        with store.transaction():
+            self.assertEqual(store.allocate_id(), '1')
+
+
+class TestRefresh(TaskStoreTestCase):
+    def test_refresh_reads_new_records_and_notifies_listeners(self):
+        writer = self.open_store()
+        first = writer.add({'title': 'A', 'status': 'incomplete'})
+        reader = self.open_store()
+        changes = []
+        reader.listeners.append(lambda put, delete: changes.append((sorted(put), delete)))
+
+        second = writer.add({'title': 'B', 'status': 'incomplete'})
+        writer.delete(first)
+
+        self.assertTrue(reader.refresh())
+        self.assertEqual(changes, [([second], []), ([], [first])])
+        self.assertEqual(list(reader.tasks), [second])
+        self.assertFalse(reader.refresh())
+
+    def test_refresh_after_another_process_compacted(self):
+        reader, writer = self.open_store(), self.open_store(compact_after=3)
+        changes = []
+        reader.listeners.append(lambda put, delete: changes.append((sorted(put), delete)))
+        ids = [writer.add({'title': str(i), 'status': 'incomplete'}) for i in range(4)]
+        writer.delete(ids[0])
+
+        self.assertTrue(reader.refresh())
+        self.assertEqual(sorted(reader.tasks), ids[1:])
+        self.assertEqual(reader.next_id, writer.next_id)
+        self.assertEqual(reader.query(keyword='3')[1], 1)
+        self.assertEqual(changes, [(ids[1:], [])])
+
+    def test_writes_from_a_stale_store_keep_other_changes(self):
+        first, second = self.open_store(), self.open_store()
+        first_id = first.add({'title': 'A', 'status': 'incomplete'})
+        second_id = second.add({'title': 'B', 'status': 'incomplete'})  # without refreshing first
+
+        self.assertNotEqual(first_id, second_id)
+        self.assertEqual(sorted(self.open_store().tasks), sorted([first_id, second_id]))
+
+
+class TestConcurrentProcesses(TaskStoreTestCase):
+    def test_concurrent_adds_lose_nothing_and_never_repeat_an_id(self):
+        added = run_processes(add_tasks, self.path)
+
+        ids = [task_id for process_ids in added.values() for task_id in process_ids]
+        self.assertEqual(len(ids), PROCESSES * TASKS_PER_PROCESS)
+        self.assertEqual(len(set(ids)), len(ids), "an ID was handed out twice")
+
+        store = self.open_store()
+        self.assertEqual(sorted(store.tasks), sorted(ids))
+        for name, process_ids in added.items():
+            for i, task_id in enumerate(process_ids):
+                self.assertEqual(store.get(task_id)['title'], f"{name}-{i}")
+        self.assertGreater(store.next_id, max(int(task_id) for task_id in ids))
+
+    def test_concurrent_updates_and_deletes_lose_nothing(self):
+        store = self.open_store()
+        store.add({'title': 'counter', 'status': 'incomplete', 'count': 0})
+
+        expected = run_processes(mixed_workload, self.path)
+
+        store.refresh()
+        self.assertEqual(store.get('1')['count'], PROCESSES * TASKS_PER_PROCESS,
+                         "a read-modify-write was lost")
+        titles = {'1': 'counter'}
+        for process_expected in expected.values():
+            self.assertFalse(titles.keys() & process_expected.keys(), "an ID was handed out twice")
+            titles.update(process_expected)
+        self.assertEqual({task_id: task['title'] for task_id, task in store.tasks.items()}, titles)
+        for task_id, task in store.tasks.items():
+            number = int(task['title'].split('-')[1]) if task_id != '1' else 1
+            self.assertEqual(task['status'] == 'complete', number % 5 == 0)
+
+        reloaded = TaskStore(self.path)
+        self.addCleanup(reloaded.close)
+        self.assertEqual(reloaded.tasks, store.tasks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Flask vs asyncio Benchmark
+
+Serves a generated catalog with app.py (threaded Werkzeug server) and with
+async_app.py (Hypercorn), then sends each of them bursts of concurrent
+GET /api/books/<id> requests with the simulated latency switched on, to
+compare how many slow requests one process keeps in flight.
+
+    python benchmarks/bench_async.py [--concurrency 10 100 1000] [--delay 0.2]
+
+Needs the optional quart package for the asyncio server.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bookstore_api")
+sys.path.insert(0, API_DIR)
+
+from catalog import write_catalog  # noqa: E402
+
+HOST = "127.0.0.1"
+# Listen backlog for both servers, so bursts aren't limited by the default of ~100
+BACKLOG = 4096
+
+
+def serve(kind, port):
+    """Run one of the servers in this process until it is killed."""
+    if kind == "flask":
+        from werkzeug.serving import make_server
+
+        import app as bookstore_app
+
+        bookstore_app.repository.reload()
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no per-request log lines
+        server = make_server(HOST, port, bookstore_app.app, threaded=True)
+        server.socket.listen(BACKLOG)
+        server.serve_forever()
+    else:
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+
+        import async_app
+
+        async_app.repository.reload()
+        config = Config()
+        config.bind = [f"{HOST}:{port}"]
+        config.backlog = BACKLOG
+        config.accesslog = config.errorlog = None
+        asyncio.run(hypercorn_serve(async_app.app, config))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} didn't start")
+
+
+def peak_rss_mb(pid):
+    """Peak resident memory of a process in MB (Linux only, else None)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def fetch(port, path):
+    """Send one GET over a new connection and return its status code."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+
+async def burst(port, concurrency, requests, size):
+    """Keep `concurrency` requests in flight until `requests` have completed."""
+    rng = random.Random(0)
+    paths = [f"/api/books/{rng.randint(1, size)}" for _ in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(path):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await fetch(port, path) == 200
+            except OSError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in paths))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan")
+    median = statistics.median(latencies) if latencies else float("nan")
+    return len(latencies) / elapsed, median, p99, errors
+
+
+def run(kind, data_file, size, delay, levels, rounds):
+    port = free_port()
+    env = dict(os.environ,
+               BOOKSTORE_DATA_FILE=data_file,
+               BOOKSTORE_STORAGE="json",
+               BOOKSTORE_LATENCY="fixed" if delay else "off",
+               BOOKSTORE_LATENCY_ROUTES=f"get_book={delay}")
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                               "--serve", kind, "--port", str(port)],
+                              env=env, cwd=API_DIR)
+    try:
+        wait_for_port(port)
+        for concurrency in levels:
+            rps, median, p99, errors = asyncio.run(
+                burst(port, concurrency, concurrency * rounds, size))
+            print(f"{kind:>6} {concurrency:>12} {rps:>10.0f} {median * 1000:>8.0f} "
+                  f"{p99 * 1000:>8.0f} {errors:>7}")
+        rss = peak_rss_mb(server.pid)
+        if rss is not None:
+            print(f"{kind:>6} peak memory {rss:.0f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--delay", type=float, default=0.2,
+                        help="simulated latency of GET /api/books/<id> in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rounds", type=int, default=5,
+                        help="requests per connection slot at each level")
+    parser.add_argument("--servers", nargs="+", default=["flask", "async"],
+                        choices=["flask", "async"])
+    parser.add_argument("--serve", choices=["flask", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_file = os.path.join(tmp_dir, "books.json")
+        write_catalog(data_file, args.size)
+        print(f"{args.size} books, {args.delay * 1000:.0f} ms simulated latency")
+        print(f"{'server':>6} {'concurrency':>12} {'req/s':>10} {'p50 ms':>8} "
+              f"{'p99 ms':>8} {'errors':>7}")
+        for kind in args.servers:
+            run(kind, data_file, args.size, args.delay, args.concurrency, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Response Encoding Benchmark
+
+Serves a generated catalog from app.py on a local port and fetches the
+full catalog (GET /api/books) in every body format and compression the
+API can negotiate, reporting bytes on the wire, the latency of the first
+request (which builds, encodes and compresses the body) and of cached
+repeats, and the client's time to decompress and decode. Also compares the
+catalog file written indented and compactly.
+
+MessagePack and brotli are measured when msgpack and brotli are installed.
+
+    python benchmarks/bench_encoding.py [--size 100000] [--repeat 10]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bookstore_api"))
+os.environ.setdefault("BOOKSTORE_LATENCY", "off")
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as bookstore_app  # noqa: E402
+import encoding  # noqa: E402
+from catalog import generate_books, write_catalog  # noqa: E402
+from repository import BookRepository  # noqa: E402
+from storage import JsonFileStorage  # noqa: E402
+
+
+def variants():
+    """Yield (name, Accept, Accept-Encoding) for every negotiable combination."""
+    for mimetype in encoding.BODY_MIMETYPES:
+        fmt = "msgpack" if mimetype == encoding.MSGPACK_MIMETYPE else "json"
+        yield fmt, mimetype, "identity"
+        for coding in reversed(encoding.CONTENT_CODINGS):
+            yield f"{fmt}+{coding}", mimetype, coding
+
+
+def decode(raw, content_type, content_encoding):
+    """Decompress and decode a response body the way the client would."""
+    if content_encoding == "gzip":
+        raw = gzip.decompress(raw)
+    elif content_encoding == "br":
+        raw = encoding.brotli.decompress(raw)
+    if content_type.startswith(encoding.MSGPACK_MIMETYPE):
+        return encoding.msgpack.unpackb(raw)
+    return json.loads(raw)
+
+
+def fetch(session, url, accept, accept_encoding):
+    """GET `url`, returning (raw bytes, seconds to receive them, seconds to decode)."""
+    start = time.perf_counter()
+    response = session.get(url, stream=True,
+                           headers={"Accept": accept, "Accept-Encoding": accept_encoding})
+    response.raise_for_status()
+    raw = response.raw.read(decode_content=False)
+    received = time.perf_counter()
+    decode(raw, response.headers["Content-Type"], response.headers.get("Content-Encoding"))
+    return raw, received - start, time.perf_counter() - received
+
+
+def file_sizes(size, tmp_dir):
+    """Return the size of the catalog file written indented and compactly."""
+    books = list(generate_books(size))
+    sizes = {}
+    for name, indent in (("indent=2", 2), ("compact", None)):
+        path = os.path.join(tmp_dir, f"{name}.json")
+        with open(path, "w") as f:
+            json.dump(books, f, indent=indent,
+                      separators=None if indent else (",", ":"))
+        sizes[name] = os.path.getsize(path)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "books.json")
+        write_catalog(path, args.size)
+        repository = BookRepository(JsonFileStorage(path))
+        repository.all()
+
+        with patch.object(bookstore_app, "repository", repository):
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no per-request log lines
+            server = make_server("localhost", 0, bookstore_app.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://localhost:{server.server_port}/api/books"
+
+            print(f"GET /api/books, {args.size} books")
+            print(f"{'variant':>13} {'wire KB':>9} {'first ms':>9} {'cached ms':>10} "
+                  f"{'decode ms':>10}")
+            with requests.Session() as session:
+                for name, accept, accept_encoding in variants():
+                    bookstore_app.response_cache.clear()
+                    raw, first, _ = fetch(session, url, accept, accept_encoding)
+                    repeats = [fetch(session, url, accept, accept_encoding)
+                               for _ in range(args.repeat)]
+                    cached = statistics.median(r[1] for r in repeats)
+                    decoding = statistics.median(r[2] for r in repeats)
+                    print(f"{name:>13} {len(raw) / 1024:>9.0f} {first * 1000:>9.1f} "
+                          f"{cached * 1000:>10.1f} {decoding * 1000:>10.1f}")
+            server.shutdown()
+
+        print()
+        print("books.json on disk")
+        for name, file_size in file_sizes(args.size, tmp_dir).items():
+            print(f"{name:>13} {file_size / 1024:>9.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
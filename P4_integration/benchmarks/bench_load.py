@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Load Test
+
+Drives a mixed workload of reads, searches and writes against the API at a
+fixed concurrency, for every combination of catalog size, storage backend,
+configuration and concurrency level asked for, and reports throughput,
+p50/p95/p99 latency, errors, and the server's CPU time and peak memory.
+
+Each scenario gets a fresh copy of a synthetic catalog and a fresh server,
+either a subprocess (the default, so CPU and memory are the server's own)
+or a thread in this process (--in-process, quicker to start; CPU then
+includes the load generator, and peak memory is the highest of the whole
+run so far). Workers are closed-loop: each
+sends its next request as soon as the previous one is answered, over its
+own keep-alive connection.
+
+Results can be appended to a JSON-lines file (--output), one record per
+scenario with the git commit and machine details, and compared with an
+earlier file (--baseline) to spot regressions:
+
+    python benchmarks/bench_load.py --sizes 1000 100000 --backends json sqlite \\
+        --concurrency 1 16 --config nocache:BOOKSTORE_RESPONSE_CACHE_MB=0 \\
+        --output results.jsonl --baseline results.jsonl
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bookstore_api")
+sys.path.insert(0, API_DIR)
+
+import requests  # noqa: E402
+
+from bench_async import BACKLOG, HOST, free_port, peak_rss_mb  # noqa: E402
+from catalog import FIRST_NAMES, LAST_NAMES, TITLE_WORDS, write_catalog  # noqa: E402
+from repository import REPOSITORY_BACKENDS  # noqa: E402
+
+# Share of requests per operation, unless --mix says otherwise
+DEFAULT_MIX = {"get": 60, "page": 10, "search": 10, "filter": 5, "update": 10, "create": 5}
+OPERATIONS = tuple(DEFAULT_MIX)
+
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(text):
+    """Parse "get=70,search=20,update=10" into {operation: weight}."""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight of {name} must be a number")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("at least one weight must be positive")
+    return mix
+
+
+def parse_config(text):
+    """Parse "name:VAR=value,VAR=value" into (name, {VAR: value})."""
+    name, _, settings = text.partition(":")
+    env = {}
+    for item in filter(None, settings.split(",")):
+        var, sep, value = item.partition("=")
+        if not sep or not var.startswith("BOOKSTORE_"):
+            raise argparse.ArgumentTypeError(f"expected BOOKSTORE_VAR=value, got {item!r}")
+        env[var] = value
+    return name, env
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(latencies):
+    """Summarize latencies in seconds as milliseconds."""
+    latencies = sorted(latencies)
+    summary = {f"p{p}": percentile(latencies, p) for p in PERCENTILES}
+    summary["mean"] = sum(latencies) / len(latencies) if latencies else None
+    summary["max"] = latencies[-1] if latencies else None
+    return {k: None if v is None else round(v * 1000, 3) for k, v in summary.items()}
+
+
+def cpu_seconds(pid):
+    """User + system CPU time a process has used (Linux only, else None)."""
+    if pid == os.getpid():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def own_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def server_env(data_file, backend, config_env):
+    env = {
+        "BOOKSTORE_DATA_FILE": data_file,
+        "BOOKSTORE_STORAGE": backend,
+        "BOOKSTORE_LATENCY": "off",
+    }
+    env.update(config_env)
+    return env
+
+
+def serve(port, ready=None):
+    """Run app.py on `port`, configured by the BOOKSTORE_* environment variables."""
+    from werkzeug.serving import make_server
+
+    import app as bookstore_app
+
+    bookstore_app.repository.all()  # load the catalog before accepting requests
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no per-request log lines
+    server = make_server(HOST, port, bookstore_app.app, threaded=True)
+    server.socket.listen(BACKLOG)
+    if ready is not None:
+        ready(server)
+    server.serve_forever()
+
+
+class SubprocessServer:
+    """app.py in a process of its own."""
+
+    def __init__(self, env, startup_timeout):
+        self.port = free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", str(self.port)],
+            env=dict(os.environ, **env), cwd=API_DIR)
+        self.pid = self.process.pid
+        wait_until_up(self.port, startup_timeout, self.process)
+
+    def peak_rss_mb(self):
+        return peak_rss_mb(self.pid)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class InProcessServer:
+    """app.py on a thread of this process, freshly imported with the scenario's settings."""
+
+    def __init__(self, env, startup_timeout):
+        self.port = free_port()
+        self.pid = os.getpid()
+        self._saved_env = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        # app.py reads its settings and opens the repository on import
+        sys.modules.pop("app", None)
+        self._server = None
+        started = threading.Event()
+
+        def ready(server):
+            self._server = server
+            started.set()
+
+        threading.Thread(target=serve, args=(self.port, ready), daemon=True).start()
+        if not started.wait(startup_timeout):
+            raise RuntimeError(f"Server didn't start within {startup_timeout} s")
+
+    def peak_rss_mb(self):
+        return own_peak_rss_mb()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        app = sys.modules.pop("app", None)
+        if app is not None and hasattr(app.repository, "close"):
+            app.repository.close()
+        for name, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def wait_until_up(port, timeout, process):
+    deadline = time.monotonic() + timeout
+    url = f"http://{HOST}:{port}/api/cache/stats"
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} didn't start within {timeout} s")
+
+
+class Worker:
+    """Sends requests from the mix over one keep-alive connection and records their latency."""
+
+    def __init__(self, base_url, size, mix, seed):
+        self.base_url = base_url
+        self.size = size
+        self.rng = random.Random(seed)
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.session = requests.Session()
+        self.latencies = {name: [] for name in self.operations}
+        self.errors = {name: 0 for name in self.operations}
+
+    def random_id(self):
+        return str(self.rng.randint(1, self.size))
+
+    def request(self, operation):
+        rng = self.rng
+        books = f"{self.base_url}/books"
+        if operation == "get":
+            return self.session.get(f"{books}/{self.random_id()}")
+        if operation == "page":
+            return self.session.get(books, params={"limit": 100,
+                                                   "offset": rng.randrange(max(1, self.size))})
+        if operation == "search":
+            word = rng.choice(TITLE_WORDS + LAST_NAMES)
+            return self.session.get(f"{books}/search", params={"query": word})
+        if operation == "filter":
+            return self.session.get(books, params={
+                "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "in_stock": "true", "sort": "price", "limit": 20
+            })
+        if operation == "update":
+            return self.session.put(f"{books}/{self.random_id()}",
+                                    json={"price": round(rng.uniform(3, 60), 2)})
+        return self.session.post(books, json={
+            "title": f"{rng.choice(TITLE_WORDS)} {rng.randrange(10 ** 6)}",
+            "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "price": round(rng.uniform(3, 60), 2),
+            "in_stock": True
+        })
+
+    def run(self, stop_at, record):
+        while time.perf_counter() < stop_at:
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = self.request(operation).status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            if not record:
+                continue
+            if ok:
+                self.latencies[operation].append(time.perf_counter() - start)
+            else:
+                self.errors[operation] += 1
+
+
+def drive(base_url, size, mix, concurrency, seconds, warmup):
+    """Run `concurrency` workers for `warmup` + `seconds`; return (workers, measured seconds)."""
+    workers = [Worker(base_url, size, mix, seed) for seed in range(concurrency)]
+
+    def run_all(duration, record):
+        stop_at = time.perf_counter() + duration
+        threads = [threading.Thread(target=w.run, args=(stop_at, record)) for w in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if warmup:
+        run_all(warmup, record=False)
+    start = time.perf_counter()
+    run_all(seconds, record=True)
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.session.close()
+    return workers, elapsed
+
+
+def run_scenario(args, catalogs, tmp_dir, size, backend, config, concurrency):
+    config_name, config_env = config
+    scenario_dir = tempfile.mkdtemp(dir=tmp_dir)
+    data_file = os.path.join(scenario_dir, "books.json")
+    shutil.copy(catalogs[size], data_file)
+
+    server_class = InProcessServer if args.in_process else SubprocessServer
+    server = server_class(server_env(data_file, backend, config_env), args.startup_timeout)
+    try:
+        base_url = f"http://{HOST}:{server.port}/api"
+        cpu_before = cpu_seconds(server.pid)
+        workers, elapsed = drive(base_url, size, args.mix, concurrency,
+                                 args.seconds, args.warmup)
+        cpu_after = cpu_seconds(server.pid)
+        peak_mb = server.peak_rss_mb()
+    finally:
+        server.stop()
+        shutil.rmtree(scenario_dir, ignore_errors=True)
+
+    all_latencies, ops = [], {}
+    for operation in args.mix:
+        latencies = [t for w in workers for t in w.latencies[operation]]
+        errors = sum(w.errors[operation] for w in workers)
+        all_latencies.extend(latencies)
+        ops[operation] = dict(requests=len(latencies), errors=errors,
+                              latency_ms=latency_summary(latencies))
+    cpu = None if cpu_before is None or cpu_after is None else cpu_after - cpu_before
+    return {
+        "size": size,
+        "backend": backend,
+        "config": config_name,
+        "config_env": config_env,
+        "concurrency": concurrency,
+        "server": "in-process" if args.in_process else "subprocess",
+        "mix": args.mix,
+        "seconds": round(elapsed, 3),
+        "requests": len(all_latencies),
+        "errors": sum(op["errors"] for op in ops.values()),
+        "throughput": round(len(all_latencies) / elapsed, 1),
+        "latency_ms": latency_summary(all_latencies),
+        "cpu_seconds": None if cpu is None else round(cpu, 3),
+        "cpu_percent": None if cpu is None else round(cpu / elapsed * 100, 1),
+        "peak_rss_mb": None if peak_mb is None else round(peak_mb, 1),
+        "ops": ops,
+    }
+
+
+def run_metadata():
+    """Details identifying the code and machine a run measured."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def scenario_key(result):
+    return (result["size"], result["backend"], result["config"], result["concurrency"],
+            result["server"], tuple(sorted(result["mix"].items())))
+
+
+def load_baseline(path):
+    """Return the latest result per scenario in a results file."""
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                baseline[scenario_key(result)] = result
+    return baseline
+
+
+def change(new, old):
+    if new is None or not old:
+        return ""
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+def print_result(result, baseline):
+    latency = result["latency_ms"]
+    cpu = result["cpu_percent"]
+    peak = result["peak_rss_mb"]
+    print(f"{result['size']:>8} {result['backend']:>8} {result['config']:>10} "
+          f"{result['concurrency']:>5} {result['throughput']:>9.0f} "
+          f"{latency['p50'] or 0:>8.1f} {latency['p95'] or 0:>8.1f} {latency['p99'] or 0:>8.1f} "
+          f"{result['errors']:>7} {'-' if cpu is None else f'{cpu:.0f}':>6} "
+          f"{'-' if peak is None else f'{peak:.0f}':>8}")
+    old = baseline.get(scenario_key(result))
+    if old:
+        print(f"{'vs ' + str(old.get('commit') or old.get('timestamp')):>43} "
+              f"{change(result['throughput'], old['throughput']):>9} "
+              + " ".join(f"{change(latency[p], old['latency_ms'][p]):>8}"
+                         for p in ("p50", "p95", "p99")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000],
+                        help="catalog sizes, e.g. 1000 100000 1000000")
+    parser.add_argument("--backends", nargs="+", default=["json"], choices=REPOSITORY_BACKENDS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--config", type=parse_config, action="append", default=[],
+                        metavar="NAME:VAR=VALUE,...",
+                        help="extra server configuration to compare (repeatable); "
+                             "the default configuration always runs")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="operation weights, e.g. get=70,search=20,update=10 "
+                             f"(operations: {', '.join(OPERATIONS)})")
+    parser.add_argument("--seconds", type=float, default=10, help="measured time per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured time first")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run the server on a thread of this process")
+    parser.add_argument("--startup-timeout", type=float, default=600,
+                        help="seconds to wait for the server to load the catalog")
+    parser.add_argument("--output", help="append results to this JSON-lines file")
+    parser.add_argument("--baseline", help="compare with the latest matching results in this file")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    # Read before this run appends to the same file
+    baseline = load_baseline(args.baseline) if args.baseline and os.path.exists(args.baseline) else {}
+    metadata = run_metadata()
+    configs = [("default", {})] + args.config
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        catalogs = {}
+        for size in args.sizes:
+            catalogs[size] = os.path.join(tmp_dir, f"catalog-{size}.json")
+            write_catalog(catalogs[size], size)
+
+        print(f"{'books':>8} {'backend':>8} {'config':>10} {'conc':>5} {'req/s':>9} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'cpu %':>6} "
+              f"{'peak MB':>8}")
+        for size in args.sizes:
+            for backend in args.backends:
+                for config in configs:
+                    for concurrency in args.concurrency:
+                        result = run_scenario(args, catalogs, tmp_dir, size, backend,
+                                              config, concurrency)
+                        print_result(result, baseline)
+                        if args.output:
+                            with open(args.output, "a") as f:
+                                f.write(json.dumps(dict(metadata, **result)) + "\n")
+
+
+if __name__ == "__main__":
+    main()
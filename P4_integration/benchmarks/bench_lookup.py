@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+ID Lookup Benchmark
+
+Measures per-request latency of GET/PUT/DELETE /api/books/<id> at
+several catalog sizes, comparing the ID index against the linear scan
+the handlers used to do.
+
+    python benchmarks/bench_lookup.py [--sizes 1000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bookstore_api"))
+os.environ.setdefault("BOOKSTORE_LATENCY", "off")
+
+import app as bookstore_app  # noqa: E402
+from catalog import write_catalog  # noqa: E402
+from repository import BookRepository  # noqa: E402
+from storage import JsonFileStorage  # noqa: E402
+
+
+def time_per_call(func, args_list):
+    """Return the mean latency of `func` in microseconds."""
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def run(size, requests_per_op):
+    rng = random.Random(size)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "books.json")
+        write_catalog(path, size)
+        repository = BookRepository(JsonFileStorage(path))
+        repository.all()
+
+        # Persisting rewrites the whole file and would swamp the lookup
+        # cost being measured here, so writes stay in memory.
+        with patch.object(bookstore_app, "repository", repository), \
+                patch.object(repository, "_persist"):
+            client = bookstore_app.app.test_client()
+            books = repository.all()
+            ids = [str(rng.randint(1, size)) for _ in range(requests_per_op)]
+
+            linear = time_per_call(
+                lambda book_id: next(b for b in books if b["id"] == book_id),
+                [(i,) for i in ids])
+            indexed = time_per_call(repository.get, [(i,) for i in ids])
+            get_request = time_per_call(
+                lambda book_id: client.get(f"/api/books/{book_id}"),
+                [(i,) for i in ids])
+            put_request = time_per_call(
+                lambda book_id: client.put(f"/api/books/{book_id}", json={"price": 9.99}),
+                [(i,) for i in ids])
+            delete_ids = rng.sample(range(1, size + 1), min(size, requests_per_op))
+            delete_request = time_per_call(
+                lambda book_id: client.delete(f"/api/books/{book_id}"),
+                [(str(i),) for i in delete_ids])
+
+    return {
+        "size": size,
+        "linear_scan_us": linear,
+        "index_lookup_us": indexed,
+        "get_request_us": get_request,
+        "put_request_us": put_request,
+        "delete_request_us": delete_request,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'books':>10} {'scan µs':>10} {'index µs':>10} "
+          f"{'GET µs':>10} {'PUT µs':>10} {'DELETE µs':>10}")
+    for size in args.sizes:
+        r = run(size, args.requests)
+        print(f"{r['size']:>10} {r['linear_scan_us']:>10.1f} {r['index_lookup_us']:>10.2f} "
+              f"{r['get_request_us']:>10.1f} {r['put_request_us']:>10.1f} "
+              f"{r['delete_request_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
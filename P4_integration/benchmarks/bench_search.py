@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Search Benchmark
+
+Compares the search index against the substring scan that
+/api/books/search used to do, for a mix of selective and broad queries.
+
+    python benchmarks/bench_search.py [--size 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bookstore_api"))
+
+from catalog import generate_books  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+QUERIES = [
+    ("substring", "mimondorra"),
+    ("substring", "ndorr"),
+    ("substring", "le guin"),
+    ("substring", "shadow"),
+    ("prefix", "wynfen sec"),
+    ("all", "ocean mary tolstoy"),
+]
+
+
+def linear_scan(books, query):
+    query = query.lower()
+    return [b for b in books
+            if query in b["title"].lower() or query in b["author"].lower()]
+
+
+def best_of(func, repeat=5):
+    """Return the fastest of `repeat` runs in milliseconds, and the result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=1000000)
+    args = parser.parse_args()
+
+    books = list(generate_books(args.size))
+    index = SearchIndex()
+    start = time.perf_counter()
+    for book in books:
+        index.add(book)
+    print(f"Indexed {args.size} books in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'mode':>10} {'query':>22} {'hits':>8} {'index ms':>10} {'scan ms':>10}")
+    for mode, query in QUERIES:
+        index_ms, hits = best_of(lambda: index.search(query, mode))
+        scan = f"{best_of(lambda: linear_scan(books, query), 1)[0]:>10.1f}" \
+            if mode == "substring" else f"{'-':>10}"
+        print(f"{mode:>10} {query:>22} {len(hits):>8} {index_ms:>10.3f} {scan}")
+
+    update_ms, _ = best_of(lambda: index.add(dict(books[0], title="Renamed Book")))
+    print(f"Incremental re-index of one book: {update_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
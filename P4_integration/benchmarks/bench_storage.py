@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Storage Backend Benchmark
+
+Compares request throughput of the json, journal and sqlite backends for
+reads, searches and writes through the Flask test client.
+
+    python benchmarks/bench_storage.py [--size 100000] [--seconds 2]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bookstore_api"))
+os.environ.setdefault("BOOKSTORE_LATENCY", "off")
+
+import app as bookstore_app  # noqa: E402
+from catalog import write_catalog  # noqa: E402
+from repository import REPOSITORY_BACKENDS, create_repository  # noqa: E402
+
+
+def throughput(func, seconds):
+    """Call `func` repeatedly for `seconds` and return calls per second."""
+    calls = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        func()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def run(backend, size, seconds):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_file = os.path.join(tmp_dir, "books.json")
+        write_catalog(data_file, size)
+
+        start = time.perf_counter()
+        repository = create_repository(backend, data_file)
+        repository.all()
+        startup = time.perf_counter() - start
+
+        with patch.object(bookstore_app, "repository", repository):
+            client = bookstore_app.app.test_client()
+
+            def random_id():
+                return str(rng.randint(1, size))
+
+            results = {
+                "backend": backend,
+                "startup_s": startup,
+                "get_per_s": throughput(
+                    lambda: client.get(f"/api/books/{random_id()}"), seconds),
+                "search_per_s": throughput(
+                    lambda: client.get("/api/books/search", query_string={
+                        "query": rng.choice(["mimondorra", "wynfen", "belka"])}), seconds),
+                "update_per_s": throughput(
+                    lambda: client.put(f"/api/books/{random_id()}",
+                                       json={"price": rng.uniform(1, 50)}), seconds),
+            }
+        if hasattr(repository, "close"):
+            repository.close()
+        elif hasattr(repository, "storage"):
+            repository.storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--backends", nargs="+", default=list(REPOSITORY_BACKENDS))
+    args = parser.parse_args()
+
+    print(f"{args.size} books")
+    print(f"{'backend':>8} {'startup s':>10} {'GET/s':>8} {'search/s':>9} {'PUT/s':>8}")
+    for backend in args.backends:
+        r = run(backend, args.size, args.seconds)
+        print(f"{r['backend']:>8} {r['startup_s']:>10.2f} {r['get_per_s']:>8.0f} "
+              f"{r['search_per_s']:>9.0f} {r['update_per_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
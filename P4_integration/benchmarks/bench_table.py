@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Table Rendering Benchmark
+
+Renders a generated catalog as the client's book table, once with
+format_book_table (tabulate over the whole list) and once with the
+streaming iter_book_table, reading the books from an NDJSON file the way
+the client reads GET /api/books?format=ndjson. Each renderer runs in a
+process of its own, so peak memory can be compared.
+
+    python benchmarks/bench_table.py [--size 100000]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bookstore_client"))
+
+from catalog import generate_books  # noqa: E402
+
+RENDERERS = ("tabulate", "stream")
+
+
+def read_ndjson(path):
+    """Yield the books in an NDJSON file one at a time."""
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def render(renderer, path):
+    """Render the table to /dev/null and report timings and memory as JSON."""
+    from client import format_book_table, iter_book_table
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    first_row = None
+    with open(os.devnull, "w") as out:
+        if renderer == "tabulate":
+            table = format_book_table(list(read_ndjson(path)))
+            first_row = time.perf_counter() - start
+            out.write(table)
+        else:
+            for i, line in enumerate(iter_book_table(read_ndjson(path))):
+                out.write(line + "\n")
+                if i == 3:  # border, header, separator, then the first book
+                    first_row = time.perf_counter() - start
+    total = time.perf_counter() - start
+    print(json.dumps({"first_row": first_row, "total": total,
+                      "peak_mb": peak_rss_mb(), "baseline_mb": baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--render", choices=RENDERERS, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        render(args.render, args.path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "books.ndjson")
+        with open(path, "w") as f:
+            for book in generate_books(args.size):
+                f.write(json.dumps(book) + "\n")
+
+        print(f"{args.size} books")
+        print(f"{'renderer':>9} {'first row ms':>13} {'total ms':>9} {'peak MB':>8} "
+              f"{'over baseline MB':>17}")
+        for renderer in RENDERERS:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--render", renderer, "--path", path],
+                check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            print(f"{renderer:>9} {result['first_row'] * 1000:>13.1f} "
+                  f"{result['total'] * 1000:>9.0f} {result['peak_mb']:>8.1f} "
+                  f"{result['peak_mb'] - result['baseline_mb']:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Synthetic Catalog
+
+Generates reproducible book catalogs of any size for the benchmarks.
+"""
+import json
+import random
+
+TITLE_WORDS = [
+    "Shadow", "River", "Empire", "Garden", "Winter", "Silent", "Golden",
+    "Night", "Ocean", "Stone", "Memory", "Fire", "Glass", "Island", "Crown",
+    "Forest", "Mirror", "Storm", "Letter", "Journey", "House", "Secret",
+]
+FIRST_NAMES = [
+    "Harper", "George", "Jane", "Mary", "Leo", "Toni", "Ursula", "Kazuo",
+    "Chinua", "Virginia", "Gabriel", "Octavia", "Haruki", "Zadie", "Italo",
+]
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "then", "dor", "vel", "sha", "qu", "ist", "orn",
+    "bel", "tar", "wyn", "ael", "gri", "mon", "zu", "fen", "ly", "cor", "as",
+]
+LAST_NAMES = [
+    "Lee", "Orwell", "Austen", "Shelley", "Tolstoy", "Morrison", "Le Guin",
+    "Ishiguro", "Achebe", "Woolf", "Marquez", "Butler", "Murakami", "Smith",
+]
+
+
+def generate_books(count, seed=42):
+    """
+    Yield `count` synthetic books with sequential IDs.
+
+    The same seed always produces the same catalog, so benchmark runs
+    can be compared with each other.
+    """
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        # A made-up name gives the catalog a realistically large vocabulary
+        name = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize()
+        words = rng.sample(TITLE_WORDS, rng.randint(1, 3))
+        words.insert(rng.randint(0, len(words)), name)
+        yield {
+            "id": str(i),
+            "title": " ".join(words),
+            "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "price": round(rng.uniform(3, 60), 2),
+            "in_stock": rng.random() < 0.7,
+        }
+
+
+def write_catalog(path, count, seed=42):
+    """Write a synthetic catalog to `path` in the books.json format."""
+    with open(path, "w") as f:
+        json.dump(list(generate_books(count, seed)), f)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic books.json")
+    parser.add_argument("count", type=int, help="number of books")
+    parser.add_argument("path", help="output file")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    write_catalog(args.path, args.count, args.seed)
@@ -0,0 +1,595 @@
+"""
+Shared API Configuration and Helpers
+
+The settings, request parsing, validators and response encoding used by
+both app.py (Flask) and async_app.py (Quart). Importing this module has no
+side effects: each app builds its own repository, latency simulator and
+response cache from the settings here.
+
+Helpers that read the request take it as a parameter; both frameworks'
+request objects are werkzeug requests, so the same code serves either.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import math
+import os
+import uuid
+from datetime import datetime, timezone
+
+from werkzeug.exceptions import abort
+
+from encoding import (CONTENT_CODINGS, JSON_MIMETYPE, compress, encode_body, negotiate_coding,
+                      negotiate_mimetype)
+from filter_index import SORT_KEYS, facet_counts
+from search_index import SEARCH_MODES
+
+# Data file to persist books
+DATA_FILE = os.environ.get('BOOKSTORE_DATA_FILE',
+                           os.path.join(os.path.dirname(__file__), 'books.json'))
+
+# Storage backend: 'json' rewrites DATA_FILE on every change, 'journal'
+# appends changes to a journal next to it (see storage.py), and 'sqlite'
+# keeps the catalog in a database next to it (see sqlite_repository.py)
+STORAGE_BACKEND = os.environ.get('BOOKSTORE_STORAGE', 'json')
+
+# Initialize with some sample books if the file doesn't exist
+SAMPLE_BOOKS = [
+    {
+        "id": "1",
+        "title": "To Kill a Mockingbird",
+        "author": "Harper Lee",
+        "price": 12.99,
+        "in_stock": True
+    },
+    {
+        "id": "2",
+        "title": "1984",
+        "author": "George Orwell",
+        "price": 10.99,
+        "in_stock": True
+    },
+    {
+        "id": "3",
+        "title": "The Great Gatsby",
+        "author": "F. Scott Fitzgerald",
+        "price": 11.50,
+        "in_stock": False
+    }
+]
+
+# Simulated network delay per endpoint, in seconds. BOOKSTORE_LATENCY=off
+# turns it off (production, benchmarks); see latency.py for the other modes.
+ROUTE_DELAYS = {
+    'get_books': 0.2,
+    'get_book': 0.2,
+    'add_book': 0.5,
+    'update_book': 0.5,
+    'delete_book': 0.5,
+    'bulk_books': 0.5,
+    'search_books': 0.3,
+    'book_changes': 0.2,
+}
+
+# Encoded GET responses are cached up to this many megabytes (0 disables
+# the cache); bodies of at least COMPRESS_MIN_BYTES are also kept gzip- or
+# brotli-compressed for clients that accept it (see encoding.py).
+RESPONSE_CACHE_MB = float(os.environ.get('BOOKSTORE_RESPONSE_CACHE_MB', 64))
+COMPRESS_MIN_BYTES = 1024
+
+# Pagination limits for GET /api/books
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Query parameters that turn GET /api/books into a filtered query
+FILTER_PARAMS = ('in_stock', 'author', 'min_price', 'max_price', 'sort')
+
+# Books fetched from the repository per chunk of a streamed response
+STREAM_BATCH_SIZE = 1000
+
+# Operations accepted by one POST /api/books/_bulk request
+MAX_BULK_OPERATIONS = 10000
+
+# Change feed: changes per GET /api/books/changes response, the longest a
+# request may wait for one (long polling), and how often it looks meanwhile
+MAX_CHANGES = 1000
+MAX_CHANGES_WAIT = 30
+CHANGES_POLL_INTERVAL = 0.25
+
+
+def query_int(args, name, default, minimum, maximum):
+    """Read an integer query parameter, aborting with 400 if it is invalid."""
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400, description=f"{name} must be an integer")
+    if not minimum <= value <= maximum:
+        abort(400, description=f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+def encode_cursor(book_id):
+    """Turn the ID of the last book on a page into an opaque cursor."""
+    if book_id is None:
+        return None
+    return base64.urlsafe_b64encode(book_id.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Recover the book ID from a cursor, aborting with 400 if it is invalid."""
+    try:
+        return base64.b64decode(cursor, altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeError, ValueError):
+        abort(400, description="Invalid cursor")
+
+
+def project(books, fields):
+    """Reduce each book to the requested fields (all fields if None)."""
+    if fields is None:
+        return books
+    return [{k: book[k] for k in fields if k in book} for book in books]
+
+
+def ndjson_batches(books, fields, batch_size):
+    """Yield books as newline-delimited JSON, `batch_size` books per chunk."""
+    for start in range(0, len(books), batch_size):
+        batch = project(books[start:start + batch_size], fields)
+        yield ''.join(json.dumps(book) + '\n' for book in batch)
+
+
+def parse_price(value):
+    """Convert a price to a float, raising ValueError if it isn't a finite number."""
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("Price must be a number") from None
+    if not math.isfinite(price):
+        # NaN and infinity can't be written as JSON
+        raise ValueError("Price must be a finite number")
+    return price
+
+
+def filter_criteria(args):
+    """
+    Read the filter and sort query parameters, aborting with 400 if one is invalid.
+
+    Returns:
+        dict: Keyword arguments for the repository's filter()
+    """
+    criteria = {}
+    if 'in_stock' in args:
+        value = args['in_stock'].strip().lower()
+        if value not in ('true', 'false', '1', '0', 'yes', 'no'):
+            abort(400, description="in_stock must be true or false")
+        criteria['in_stock'] = value in ('true', '1', 'yes')
+    if args.get('author', '').strip():
+        criteria['author'] = args['author']
+    for name in ('min_price', 'max_price'):
+        if name in args:
+            try:
+                criteria[name] = parse_price(args[name])
+            except ValueError:
+                abort(400, description=f"{name} must be a number")
+    sort = args.get('sort', 'id')
+    if sort.lstrip('-') not in SORT_KEYS:
+        abort(400, description=f"sort must be one of: {', '.join(SORT_KEYS)} "
+                               "(prefix with - for descending order)")
+    criteria['sort'] = sort.lstrip('-')
+    criteria['descending'] = sort.startswith('-')
+    return criteria
+
+
+def filtered_page(store, criteria, limit, offset, fields):
+    """Build the response body for a filtered query: one page of books plus facets."""
+    books = store.filter(**criteria)
+    end = offset + limit
+    return {
+        'books': project(books[offset:end], fields),
+        'total': len(books),
+        'facets': facet_counts(books),
+        'next_offset': end if end < len(books) else None
+    }
+
+
+def listing_params(args):
+    """
+    Read the GET /api/books parameters shared by every kind of response.
+
+    Returns:
+        tuple: (fields, criteria); fields is None for all fields, and
+        criteria is None unless the request is a filtered query
+    """
+    fields = args.get('fields')
+    if fields is not None:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        if not fields:
+            abort(400, description="fields must name at least one field")
+    criteria = None
+    if any(k in args for k in FILTER_PARAMS):
+        criteria = filter_criteria(args)
+    return fields, criteria
+
+
+def wants_ndjson(request):
+    """Return True if a GET /api/books request asks for a streamed NDJSON response."""
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+
+def listing_builder(store, args, fields, criteria):
+    """
+    Validate the paging parameters of GET /api/books and return a builder for the body.
+
+    The builder reads the catalog, so each app decides where it runs (and
+    the response cache skips it altogether on a hit).
+
+    Returns:
+        callable: Takes no arguments and returns the response data
+    """
+    if criteria is not None:
+        limit = query_int(args, 'limit', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        offset = query_int(args, 'offset', 0, 0, 2 ** 31)
+        return lambda: filtered_page(store, criteria, limit, offset, fields)
+
+    if not any(k in args for k in ('limit', 'cursor', 'offset')):
+        return lambda: project(store.all(), fields)
+
+    limit = query_int(args, 'limit', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    offset = query_int(args, 'offset', 0, 0, 2 ** 31)
+    cursor = args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+
+    def build():
+        books, last_id = store.page(limit, after=after, offset=offset)
+        return {
+            'books': project(books, fields),
+            'next_cursor': encode_cursor(last_id)
+        }
+    return build
+
+
+def book_builder(store, book_id):
+    """Return a builder for GET /api/books/<id> that aborts with 404 if the book is gone."""
+    def build():
+        book = store.get(book_id)
+        if not book:
+            abort(404, description="Book not found")
+        return book
+    return build
+
+
+def search_params(args):
+    """Read the search query and mode, aborting with 400 if either is invalid."""
+    query = args.get('query', '').lower()
+    mode = args.get('mode', 'substring')
+
+    if not query:
+        abort(400, description="Search query is required")
+
+    if mode not in SEARCH_MODES:
+        abort(400, description=f"Search mode must be one of: {', '.join(SEARCH_MODES)}")
+    return query, mode
+
+
+def catalog_etag(state, full_path):
+    """
+    Return (ETag, modified time) for a response built from the catalog.
+
+    The ETag combines the catalog version (a repository's state()) with the
+    request path and query string, since those decide what the response
+    contains.
+    """
+    epoch, version, modified = state
+    digest = hashlib.sha1(full_path.encode('utf-8')).hexdigest()[:10]
+    return f"{epoch}-{version}-{digest}", modified
+
+
+def representation_etag(etag, mimetype, coding):
+    """
+    Return the ETag for one encoding of some content.
+
+    Each body format and content coding gets its own ETag, so that caches
+    and conditional requests never take one for another: the content's
+    ETag plus e.g. "+msgpack" or "+gzip". JSON sent uncompressed keeps the
+    content's ETag.
+    """
+    if mimetype != JSON_MIMETYPE:
+        etag += '+' + mimetype.rpartition('/')[2]
+    if coding:
+        etag += '+' + coding
+    return etag
+
+
+def content_etag(etag):
+    """Strip the body format and content coding from a representation's ETag."""
+    return etag.partition('+')[0]
+
+
+def unchanged_etag(request, etag, modified):
+    """
+    Check whether a conditional GET's cached copy is still current.
+
+    Parameters:
+        request: The request being answered
+        etag (str): Validator for the current content
+        modified (float): Time the content last changed
+
+    Returns:
+        str: The representation ETag to send with a 304 response, or None
+        if the client's copy is out of date
+    """
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    if request.if_none_match:
+        for coding in (None,) + CONTENT_CODINGS:
+            candidate = representation_etag(etag, mimetype, coding)
+            if request.if_none_match.contains_weak(candidate):
+                return candidate
+        return None
+    if request.if_modified_since and int(modified) <= request.if_modified_since.timestamp():
+        # The body isn't built to answer a 304, so its size is unknown;
+        # assume it is big enough to compress
+        coding = request.accept_encodings.best_match(CONTENT_CODINGS)
+        return representation_etag(etag, mimetype, coding)
+    return None
+
+
+def with_validators(response, etag, modified):
+    """Attach ETag and Last-Modified, and ask clients to revalidate before reuse."""
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(int(modified), tz=timezone.utc)
+    response.cache_control.no_cache = True
+    return response
+
+
+def if_match_revisions(request):
+    """
+    Parse the If-Match header into the book revisions a write may apply to.
+
+    Returns:
+        set: (epoch, version) pairs, or None if there is no condition
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    revisions = set()
+    for etag in request.if_match.as_set():
+        # Any representation of a revision will do
+        epoch, _, version = content_etag(etag).rpartition('-')
+        if version.isdigit():
+            revisions.add((epoch, int(version)))
+    return revisions
+
+
+def cached_body(request, cache, etag, tags, build, min_bytes):
+    """
+    Fetch or encode the body of a GET response through the response cache.
+
+    The body is JSON or MessagePack and may be compressed, whichever the
+    request's Accept and Accept-Encoding headers prefer (see encoding.py).
+    This may build, encode and compress the body, so the asyncio app calls
+    it on a worker thread.
+
+    Parameters:
+        request: The request being answered
+        cache (ResponseCache): Cache of encoded bodies
+        etag (str): Validator for the current content
+        tags (iterable): Invalidation tags for the cached entry
+        build (callable): Returns the response data on a cache miss
+        min_bytes (int): Smaller bodies are sent uncompressed
+
+    Returns:
+        tuple: (body, mimetype, content coding or None, 'HIT' or 'MISS')
+    """
+    mimetype = negotiate_mimetype(request.accept_mimetypes)
+    key = (mimetype, request.full_path)
+    entry = cache.get(key, etag)
+    if entry is None:
+        body = encode_body(build(), mimetype)
+        # None if the body is too big to cache
+        entry = cache.put(key, etag, body, tags)
+        cache_status = 'MISS'
+    else:
+        body = entry.body
+        cache_status = 'HIT'
+
+    coding = negotiate_coding(request.accept_encodings, len(body), min_bytes)
+    if coding:
+        body = cache.compressed(entry, coding) if entry else compress(body, coding)
+    return body, mimetype, coding, cache_status
+
+
+def finish_cached(response, coding, cache_status, etag, modified):
+    """Add the headers of a response made from cached_body, `etag` being the content's."""
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Cache'] = cache_status
+    return with_validators(response, representation_etag(etag, response.mimetype, coding),
+                           modified)
+
+
+def new_book_from(data):
+    """
+    Build a new book from request data.
+
+    Raises:
+        ValueError: If the data is missing required fields or is invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Book must be a JSON object")
+
+    # Validate required fields
+    if not all(k in data for k in ('title', 'author', 'price')):
+        raise ValueError("Missing required fields: title, author, price")
+
+    return {
+        'id': str(uuid.uuid4())[:8],  # Generate a short unique ID
+        'title': data['title'],
+        'author': data['author'],
+        'price': parse_price(data['price']),
+        'in_stock': data.get('in_stock', True)
+    }
+
+
+def book_changes_from(data):
+    """
+    Pick the book fields to update out of request data.
+
+    Raises:
+        ValueError: If the data is invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Book must be a JSON object")
+
+    changes = {k: data[k] for k in ('title', 'author', 'price', 'in_stock') if k in data}
+    if 'price' in changes:
+        changes['price'] = parse_price(changes['price'])
+    return changes
+
+
+def parse_bulk_line(line):
+    """
+    Turn one NDJSON line of a bulk request into a repository mutation.
+
+    Raises:
+        ValueError: If the line is not a valid operation
+    """
+    try:
+        item = json.loads(line)
+    except ValueError:
+        raise ValueError("Line is not valid JSON") from None
+    if not isinstance(item, dict):
+        raise ValueError("Line must be a JSON object")
+
+    op = item.get('op')
+    if op == 'create':
+        return ('create', new_book_from(item.get('book')))
+    if op not in ('update', 'delete'):
+        raise ValueError("op must be one of: create, update, delete")
+    if not isinstance(item.get('id'), str) or not item['id']:
+        raise ValueError(f"{op} requires an id")
+    if op == 'update':
+        return ('update', item['id'], book_changes_from(item.get('book')))
+    return ('delete', item['id'])
+
+
+def bulk_lines(text):
+    """
+    Split a POST /api/books/_bulk body into operations, aborting with 400 if
+    there are none or too many.
+
+    Returns:
+        list: (line number, text) pairs for the non-blank lines, as apply_bulk takes
+    """
+    lines = [(number, line) for number, line in enumerate(text.splitlines(), 1) if line.strip()]
+    if not lines:
+        abort(400, description="Request body must contain NDJSON operations")
+    if len(lines) > MAX_BULK_OPERATIONS:
+        abort(400, description=f"At most {MAX_BULK_OPERATIONS} operations per request")
+    return lines
+
+
+def apply_bulk(store, lines):
+    """
+    Parse the NDJSON lines of a bulk request and apply the valid operations.
+
+    Each result has the operation's `index` among the operations and the
+    `line` of the request body it came from (from 1; blank lines are
+    skipped but counted).
+
+    Parameters:
+        store: Repository to apply them to
+        lines (list): (line number, text) for each non-blank request line
+
+    Returns:
+        tuple: (response body, IDs of the books that changed)
+    """
+    results = [None] * len(lines)
+    mutations, positions = [], []
+    for i, (_, line) in enumerate(lines):
+        try:
+            mutations.append(parse_bulk_line(line))
+            positions.append(i)
+        except ValueError as e:
+            results[i] = {'status': 400, 'error': str(e)}
+
+    outcomes = store.bulk(mutations)
+    changed = [o['id'] if m[0] == 'create' else m[1] for m, o in zip(mutations, outcomes) if o]
+
+    for i, mutation, outcome in zip(positions, mutations, outcomes):
+        op = mutation[0]
+        if op == 'create':
+            results[i] = {'status': 201, 'id': outcome['id'], 'book': outcome}
+        elif not outcome:
+            results[i] = {'status': 404, 'id': mutation[1], 'error': "Book not found"}
+        elif op == 'update':
+            results[i] = {'status': 200, 'id': mutation[1], 'book': outcome}
+        else:
+            results[i] = {'status': 200, 'id': mutation[1]}
+
+    for i, (result, (number, _)) in enumerate(zip(results, lines)):
+        result['index'] = i
+        result['line'] = number
+    failed = sum(1 for r in results if r['status'] >= 400)
+    body = {
+        'results': results,
+        'succeeded': len(results) - failed,
+        'failed': failed
+    }
+    return body, changed
+
+
+def parse_change_cursor(cursor):
+    """Split a change feed cursor into (epoch, version), aborting with 400 if it is invalid."""
+    epoch, _, version = cursor.rpartition('-')
+    if not epoch or not version.isdigit():
+        abort(400, description="Invalid since cursor")
+    return epoch, int(version)
+
+
+def change_feed_params(args):
+    """
+    Read the GET /api/books/changes parameters, aborting with 400 if one is invalid.
+
+    Returns:
+        tuple: (since, limit, wait) for read_changes and the long poll
+    """
+    since = args.get('since')
+    since = parse_change_cursor(since) if since else None
+    limit = query_int(args, 'limit', MAX_CHANGES, 1, MAX_CHANGES)
+    wait = query_int(args, 'wait', 0, 0, MAX_CHANGES_WAIT)
+    return since, limit, wait
+
+
+def read_changes(store, since, limit):
+    """
+    Build a change feed response body.
+
+    Parameters:
+        store: Repository to read the changes from
+        since (tuple): (epoch, version) the caller is up to date with, or None
+        limit (int): Maximum number of changes to include
+
+    Returns:
+        dict: {"cursor", "reset", "more", "changes"}; see book_changes in app.py
+    """
+    epoch, version = since or (None, 0)
+    epoch, current, changes = store.changes(epoch, version, limit)
+    if changes is None:
+        return {'cursor': f"{epoch}-{current}", 'reset': True, 'more': False, 'changes': []}
+
+    cursor = changes[-1][0] if len(changes) == limit else current
+    return {
+        'cursor': f"{epoch}-{cursor}",
+        'reset': False,
+        'more': cursor < current,
+        'changes': [
+            {'seq': seq, 'op': 'put', 'id': book_id, 'book': book} if book is not None
+            else {'seq': seq, 'op': 'delete', 'id': book_id}
+            for seq, book_id, book in changes
+        ]
+    }
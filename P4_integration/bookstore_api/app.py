@@ -4,114 +4,143 @@ Bookstore API
 
 A RESTful Flask application that provides endpoints to manage books.
 """
-from flask import Flask, jsonify, request, abort
+from flask import Flask, Response, jsonify, request, abort
 from flask_cors import CORS
 import json
 import os
 import time
-import uuid
+
+from api_common import (CHANGES_POLL_INTERVAL, COMPRESS_MIN_BYTES, DATA_FILE, RESPONSE_CACHE_MB,
+                        ROUTE_DELAYS, SAMPLE_BOOKS, STORAGE_BACKEND, STREAM_BATCH_SIZE, apply_bulk,
+                        book_builder, book_changes_from, bulk_lines, cached_body, catalog_etag,
+                        change_feed_params, finish_cached, if_match_revisions, listing_builder,
+                        listing_params, ndjson_batches, new_book_from, project, read_changes,
+                        search_params, unchanged_etag, wants_ndjson, with_validators)
+from concurrency import PreconditionFailed
+from latency import LatencySimulator
+from repository import create_repository
+from response_cache import ResponseCache
 
 app = Flask(__name__)
 CORS(app)  # Enable Cross-Origin Resource Sharing
 
-# Data file to persist books
-DATA_FILE = os.path.join(os.path.dirname(__file__), 'books.json')
-
-# Initialize with some sample books if the file doesn't exist
-SAMPLE_BOOKS = [
-    {
-        "id": "1",
-        "title": "To Kill a Mockingbird",
-        "author": "Harper Lee",
-        "price": 12.99,
-        "in_stock": True
-    },
-    {
-        "id": "2",
-        "title": "1984",
-        "author": "George Orwell",
-        "price": 10.99,
-        "in_stock": True
-    },
-    {
-        "id": "3",
-        "title": "The Great Gatsby",
-        "author": "F. Scott Fitzgerald",
-        "price": 11.50,
-        "in_stock": False
-    }
-]
-
-
-def load_books():
-    """Load books from the data file."""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    else:
-        # Initialize with sample books if file doesn't exist
-        save_books(SAMPLE_BOOKS)
-        return SAMPLE_BOOKS
-
-
-def save_books(books):
-    """Save books to the data file."""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(books, f, indent=2)
+# Settings and request helpers shared with async_app.py are in api_common.py.
+
+# With the json and journal backends the catalog is loaded once and served
+# from memory; changes are written through to storage, and edits made to
+# DATA_FILE by hand are picked up.
+repository = create_repository(STORAGE_BACKEND, DATA_FILE, seed=SAMPLE_BOOKS)
+latency = LatencySimulator.from_env(os.environ, ROUTE_DELAYS)
+response_cache = ResponseCache(max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024))
+
+
+def stream_ndjson(fields):
+    """Yield the whole catalog as newline-delimited JSON, one batch at a time."""
+    after = None
+    while True:
+        books, after = repository.page(STREAM_BATCH_SIZE, after=after)
+        if books:
+            yield ''.join(json.dumps(book) + '\n' for book in project(books, fields))
+        if after is None:
+            return
+
+
+def catalog_validators():
+    """Return (ETag, modified time) for a response built from the catalog."""
+    return catalog_etag(repository.state(), request.full_path)
+
+
+def cached_json(etag, modified, tags, build):
+    """
+    Serve a GET response through the response cache (see api_common.cached_body).
+
+    Parameters:
+        etag (str): Validator for the current content
+        modified (float): Time the content last changed
+        tags (iterable): Invalidation tags for the cached entry
+        build (callable): Returns the response data on a cache miss
+
+    Returns:
+        Response: 304 if the client's copy is current, else the cached or
+        freshly encoded body
+    """
+    current = unchanged_etag(request, etag, modified)
+    if current:
+        return with_validators(Response(status=304), current, modified)
+    
+    body, mimetype, coding, cache_status = cached_body(
+        request, response_cache, etag, tags, build, COMPRESS_MIN_BYTES)
+    return finish_cached(Response(body, mimetype=mimetype), coding, cache_status, etag, modified)
+
+
+def invalidate_books(book_ids):
+    """Drop cached responses made stale by changes to these books."""
+    response_cache.invalidate(['catalog'] + [f"book:{book_id}" for book_id in book_ids])
+
+
+@app.before_request
+def simulate_latency():
+    """Delay each request to behave like a remote service (see latency.py)."""
+    latency.sleep(request.endpoint)
 
 
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    """Get all books endpoint."""
-    # Simulate network delay for realistic API behavior
-    time.sleep(0.2)
+    """
+    Get all books endpoint.
+
+    Optional query parameters:
+        limit, cursor, offset: Return one page of books in ID order, wrapped
+            as {"books": [...], "next_cursor": ...}
+        fields: Comma-separated fields to include for each book
+        format=ndjson: Stream the catalog as newline-delimited JSON
+        in_stock, author, min_price, max_price: Only return matching books
+        sort: id, price or title (-price etc. for descending order)
+
+    Filtered or sorted requests return {"books": [...], "total": ...,
+    "facets": {...}, "next_offset": ...}, one page at a time (limit and
+    offset), with facet counts for all the matching books.
+    """
+    fields, criteria = listing_params(request.args)
+    if wants_ndjson(request):
+        if criteria is not None:
+            books = repository.filter(**criteria)
+            return Response(ndjson_batches(books, fields, STREAM_BATCH_SIZE),
+                            mimetype='application/x-ndjson')
+        return Response(stream_ndjson(fields), mimetype='application/x-ndjson')
+    
+    build = listing_builder(repository, request.args, fields, criteria)
     
-    books = load_books()
-    return jsonify(books)
+    # Conditional and repeated requests are answered without touching the catalog
+    etag, modified = catalog_validators()
+    return cached_json(etag, modified, ['catalog'], build)
 
 
 @app.route('/api/books/<book_id>', methods=['GET'])
 def get_book(book_id):
     """Get a specific book by ID."""
-    # Simulate network delay
-    time.sleep(0.2)
-    
-    books = load_books()
-    book = next((b for b in books if b['id'] == book_id), None)
-    
-    if book:
-        return jsonify(book)
-    else:
+    revision = repository.revision(book_id)
+    if not revision:
         abort(404, description="Book not found")
+    
+    epoch, version, modified = revision
+    return cached_json(f"{epoch}-{version}", modified, [f"book:{book_id}"],
+                       book_builder(repository, book_id))
 
 
 @app.route('/api/books', methods=['POST'])
 def add_book():
     """Add a new book."""
-    # Simulate network delay
-    time.sleep(0.5)
-    
     if not request.json:
         abort(400, description="Request must be JSON")
     
-    data = request.json
+    try:
+        new_book = new_book_from(request.json)
+    except ValueError as e:
+        abort(400, description=str(e))
     
-    # Validate required fields
-    if not all(k in data for k in ('title', 'author', 'price')):
-        abort(400, description="Missing required fields: title, author, price")
-    
-    # Create new book
-    new_book = {
-        'id': str(uuid.uuid4())[:8],  # Generate a short unique ID
-        'title': data['title'],
-        'author': data['author'],
-        'price': float(data['price']),
-        'in_stock': data.get('in_stock', True)
-    }
-    
-    books = load_books()
-    books.append(new_book)
-    save_books(books)
+    repository.add(new_book)
+    invalidate_books([new_book['id']])
     
     return jsonify(new_book), 201
 
@@ -119,27 +148,23 @@ def add_book():
 @app.route('/api/books/<book_id>', methods=['PUT'])
 def update_book(book_id):
     """Update an existing book."""
-    # Simulate network delay
-    time.sleep(0.5)
-    
     if not request.json:
         abort(400, description="Request must be JSON")
     
-    books = load_books()
-    book = next((b for b in books if b['id'] == book_id), None)
+    try:
+        changes = book_changes_from(request.json)
+    except ValueError as e:
+        abort(400, description=str(e))
+    
+    # Update book fields if provided, unless it changed since the client read it
+    try:
+        book = repository.update(book_id, changes, if_match=if_match_revisions(request))
+    except PreconditionFailed as e:
+        abort(412, description=str(e))
     
     if not book:
         abort(404, description="Book not found")
-    
-    data = request.json
-    
-    # Update book fields if provided
-    book['title'] = data.get('title', book['title'])
-    book['author'] = data.get('author', book['author'])
-    book['price'] = float(data.get('price', book['price']))
-    book['in_stock'] = data.get('in_stock', book['in_stock'])
-    
-    save_books(books)
+    invalidate_books([book_id])
     
     return jsonify(book)
 
@@ -147,39 +172,88 @@ def update_book(book_id):
 @app.route('/api/books/<book_id>', methods=['DELETE'])
 def delete_book(book_id):
     """Delete a book."""
-    # Simulate network delay
-    time.sleep(0.5)
-    
-    books = load_books()
-    book = next((b for b in books if b['id'] == book_id), None)
+    try:
+        deleted = repository.delete(book_id, if_match=if_match_revisions(request))
+    except PreconditionFailed as e:
+        abort(412, description=str(e))
     
-    if not book:
+    if not deleted:
         abort(404, description="Book not found")
-    
-    books = [b for b in books if b['id'] != book_id]
-    save_books(books)
+    invalidate_books([book_id])
     
     return jsonify({'message': f"Book with ID {book_id} deleted successfully"})
 
 
+@app.route('/api/books/_bulk', methods=['POST'])
+def bulk_books():
+    """
+    Apply many creates, updates and deletes in one request.
+
+    The body is newline-delimited JSON with one operation per line:
+
+        {"op": "create", "book": {"title": ..., "author": ..., "price": ...}}
+        {"op": "update", "id": "...", "book": {"price": ...}}
+        {"op": "delete", "id": "..."}
+
+    Valid operations are applied together with a single write to storage.
+    The response has a result for every operation, in order, with its
+    `index` among the operations and the body `line` it was on; blank
+    lines are skipped, so the two differ after one.
+    """
+    lines = bulk_lines(request.get_data(as_text=True))
+    body, changed = apply_bulk(repository, lines)
+    invalidate_books(changed)
+    return jsonify(body)
+
+
 @app.route('/api/books/search', methods=['GET'])
 def search_books():
-    """Search for books by title or author."""
-    # Simulate network delay
-    time.sleep(0.3)
-    
-    query = request.args.get('query', '').lower()
-    
-    if not query:
-        abort(400, description="Search query is required")
-    
-    books = load_books()
-    results = [
-        book for book in books
-        if query in book['title'].lower() or query in book['author'].lower()
-    ]
+    """
+    Search for books by title or author.
+
+    The optional `mode` parameter selects substring (default), prefix or
+    all (every term must match) semantics.
+    """
+    query, mode = search_params(request.args)
+    etag, modified = catalog_validators()
+    return cached_json(etag, modified, ['catalog'], lambda: repository.search(query, mode))
+
+
+@app.route('/api/books/changes', methods=['GET'])
+def book_changes():
+    """
+    Get what changed in the catalog since an earlier response.
+
+    Optional query parameters:
+        since: Cursor from an earlier response; without it the response
+            only carries a starting cursor
+        limit: Maximum number of changes to return
+        wait: Seconds to hold the request open while nothing has changed
+            (long polling)
+
+    The response is {"cursor", "reset", "more", "changes"}. Changes are in
+    order, one per book: {"seq", "op": "put", "id", "book"} for created and
+    updated books, and a tombstone {"seq", "op": "delete", "id"} for
+    deleted ones. "more" means further changes can be fetched right away.
+    "reset" means the cursor can't be caught up from (the catalog was
+    reloaded, or the changes are too old to have been kept): fetch the
+    whole catalog again and continue from the new cursor.
+    """
+    since, limit, wait = change_feed_params(request.args)
     
-    return jsonify(results)
+    # Looking for changes is cheap, so long polls just look again until the deadline
+    deadline = time.monotonic() + wait
+    while True:
+        body = read_changes(repository, since, limit)
+        if body['changes'] or body['reset'] or time.monotonic() >= deadline:
+            return jsonify(body)
+        time.sleep(CHANGES_POLL_INTERVAL)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Report response cache hits, misses and memory use."""
+    return jsonify(response_cache.stats())
 
 
 @app.errorhandler(400)
@@ -194,6 +268,12 @@ def not_found(error):
     return jsonify({'error': 'Not Found', 'message': error.description}), 404
 
 
+@app.errorhandler(412)
+def precondition_failed(error):
+    """Handle writes whose If-Match no longer matches."""
+    return jsonify({'error': 'Precondition Failed', 'message': error.description}), 412
+
+
 @app.errorhandler(500)
 def server_error(error):
     """Handle internal server errors."""
@@ -205,8 +285,7 @@ if __name__ == '__main__':
         os.makedirs(os.path.dirname(DATA_FILE))
     
     # Ensure we have the books.json file
-    if not os.path.exists(DATA_FILE):
-        save_books(SAMPLE_BOOKS)
+    repository.reload()
     
     print("Bookstore API running on http://localhost:5000")
     app.run(debug=True) 
\ No newline at end of file
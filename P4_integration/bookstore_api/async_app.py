@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Bookstore API (asyncio)
+
+The routes, responses and error handlers of app.py, served by Quart on an
+asyncio event loop. Handlers never block the loop: simulated latency uses
+asyncio.sleep, and repository calls, JSON encoding and compression run on
+worker threads. One process can keep thousands of slow requests in flight
+instead of tying up a thread for each.
+
+Quart is an optional dependency, and needs newer Flask and Werkzeug
+releases than requirements.txt pins:
+
+    pip install -r ../requirements-async.txt
+    hypercorn async_app:app --bind localhost:5000
+
+The same BOOKSTORE_* environment variables configure it as app.py.
+"""
+import asyncio
+import json
+import os
+import time
+
+from quart import Quart, Response, abort, jsonify, request
+
+from api_common import (CHANGES_POLL_INTERVAL, COMPRESS_MIN_BYTES, DATA_FILE, RESPONSE_CACHE_MB,
+                        ROUTE_DELAYS, SAMPLE_BOOKS, STORAGE_BACKEND, STREAM_BATCH_SIZE, apply_bulk,
+                        book_builder, book_changes_from, bulk_lines, cached_body, catalog_etag,
+                        change_feed_params, finish_cached, if_match_revisions, listing_builder,
+                        listing_params, ndjson_batches, new_book_from, project, read_changes,
+                        search_params, unchanged_etag, wants_ndjson, with_validators)
+from concurrency import PreconditionFailed
+from latency import LatencySimulator
+from repository import create_repository
+from response_cache import ResponseCache
+
+app = Quart(__name__)
+
+repository = create_repository(STORAGE_BACKEND, DATA_FILE, seed=SAMPLE_BOOKS)
+latency = LatencySimulator.from_env(os.environ, ROUTE_DELAYS)
+response_cache = ResponseCache(max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024))
+
+
+async def stream_ndjson(fields):
+    """Yield the whole catalog as newline-delimited JSON, one batch at a time."""
+    after = None
+    while True:
+        books, after = await asyncio.to_thread(repository.page, STREAM_BATCH_SIZE, after=after)
+        if books:
+            yield ''.join(json.dumps(book) + '\n' for book in project(books, fields)).encode()
+        if after is None:
+            return
+
+
+async def stream_filtered_ndjson(criteria, fields):
+    """Yield the books matching a filtered query as NDJSON, one batch at a time."""
+    books = await asyncio.to_thread(repository.filter, **criteria)
+    for chunk in ndjson_batches(books, fields, STREAM_BATCH_SIZE):
+        yield chunk.encode()
+
+
+async def catalog_validators():
+    """Return (ETag, modified time) for a response built from the catalog."""
+    state = await asyncio.to_thread(repository.state)
+    return catalog_etag(state, request.full_path)
+
+
+async def cached_json(etag, modified, tags, build):
+    """
+    Serve a GET response through the response cache, as app.py does.
+
+    Building, encoding and compressing the body all happen on a worker
+    thread (see api_common.cached_body).
+    """
+    current = unchanged_etag(request, etag, modified)
+    if current:
+        return with_validators(Response(b'', status=304), current, modified)
+    
+    body, mimetype, coding, cache_status = await asyncio.to_thread(
+        cached_body, request._get_current_object(), response_cache, etag, tags, build,
+        COMPRESS_MIN_BYTES)
+    return finish_cached(Response(body, mimetype=mimetype), coding, cache_status, etag, modified)
+
+
+def invalidate_books(book_ids):
+    """Drop cached responses made stale by changes to these books."""
+    response_cache.invalidate(['catalog'] + [f"book:{book_id}" for book_id in book_ids])
+
+
+@app.before_request
+async def simulate_latency():
+    """Delay each request without holding up the others (see latency.py)."""
+    await latency.sleep_async(request.endpoint)
+
+
+@app.after_request
+async def allow_cross_origin(response):
+    """Allow requests from any origin, as flask_cors does for app.py."""
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    if request.method == 'OPTIONS':
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = request.headers.get(
+            'Access-Control-Request-Headers', '*')
+    return response
+
+
+@app.route('/api/books', methods=['GET'])
+async def get_books():
+    """Get all books endpoint; takes the same query parameters as app.py."""
+    fields, criteria = listing_params(request.args)
+    if wants_ndjson(request):
+        if criteria is not None:
+            return Response(stream_filtered_ndjson(criteria, fields),
+                            mimetype='application/x-ndjson')
+        return Response(stream_ndjson(fields), mimetype='application/x-ndjson')
+    
+    build = listing_builder(repository, request.args, fields, criteria)
+    etag, modified = await catalog_validators()
+    return await cached_json(etag, modified, ['catalog'], build)
+
+
+@app.route('/api/books/<book_id>', methods=['GET'])
+async def get_book(book_id):
+    """Get a specific book by ID."""
+    revision = await asyncio.to_thread(repository.revision, book_id)
+    if not revision:
+        abort(404, description="Book not found")
+    
+    epoch, version, modified = revision
+    return await cached_json(f"{epoch}-{version}", modified, [f"book:{book_id}"],
+                             book_builder(repository, book_id))
+
+
+@app.route('/api/books', methods=['POST'])
+async def add_book():
+    """Add a new book."""
+    data = await request.get_json(silent=True)
+    if not data:
+        abort(400, description="Request must be JSON")
+    
+    try:
+        new_book = new_book_from(data)
+    except ValueError as e:
+        abort(400, description=str(e))
+    
+    await asyncio.to_thread(repository.add, new_book)
+    invalidate_books([new_book['id']])
+    
+    return jsonify(new_book), 201
+
+
+@app.route('/api/books/<book_id>', methods=['PUT'])
+async def update_book(book_id):
+    """Update an existing book."""
+    data = await request.get_json(silent=True)
+    if not data:
+        abort(400, description="Request must be JSON")
+    
+    try:
+        changes = book_changes_from(data)
+    except ValueError as e:
+        abort(400, description=str(e))
+    
+    try:
+        book = await asyncio.to_thread(repository.update, book_id, changes,
+                                       if_match=if_match_revisions(request))
+    except PreconditionFailed as e:
+        abort(412, description=str(e))
+    
+    if not book:
+        abort(404, description="Book not found")
+    invalidate_books([book_id])
+    
+    return jsonify(book)
+
+
+@app.route('/api/books/<book_id>', methods=['DELETE'])
+async def delete_book(book_id):
+    """Delete a book."""
+    try:
+        deleted = await asyncio.to_thread(repository.delete, book_id,
+                                          if_match=if_match_revisions(request))
+    except PreconditionFailed as e:
+        abort(412, description=str(e))
+    
+    if not deleted:
+        abort(404, description="Book not found")
+    invalidate_books([book_id])
+    
+    return jsonify({'message': f"Book with ID {book_id} deleted successfully"})
+
+
+@app.route('/api/books/_bulk', methods=['POST'])
+async def bulk_books():
+    """Apply many creates, updates and deletes in one request; see app.py."""
+    lines = bulk_lines(await request.get_data(as_text=True))
+    body, changed = await asyncio.to_thread(apply_bulk, repository, lines)
+    invalidate_books(changed)
+    return jsonify(body)
+
+
+@app.route('/api/books/search', methods=['GET'])
+async def search_books():
+    """Search for books by title or author."""
+    query, mode = search_params(request.args)
+    etag, modified = await catalog_validators()
+    return await cached_json(etag, modified, ['catalog'], lambda: repository.search(query, mode))
+
+
+@app.route('/api/books/changes', methods=['GET'])
+async def book_changes():
+    """Get what changed in the catalog since an earlier response; see app.py."""
+    since, limit, wait = change_feed_params(request.args)
+    
+    # A long poll waits on the event loop, not on a thread
+    deadline = time.monotonic() + wait
+    while True:
+        body = await asyncio.to_thread(read_changes, repository, since, limit)
+        if body['changes'] or body['reset'] or time.monotonic() >= deadline:
+            return jsonify(body)
+        await asyncio.sleep(CHANGES_POLL_INTERVAL)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+async def cache_stats():
+    """Report response cache hits, misses and memory use."""
+    return jsonify(response_cache.stats())
+
+
+@app.errorhandler(400)
+async def bad_request(error):
+    """Handle bad request errors."""
+    return jsonify({'error': 'Bad Request', 'message': error.description}), 400
+
+
+@app.errorhandler(404)
+async def not_found(error):
+    """Handle not found errors."""
+    return jsonify({'error': 'Not Found', 'message': error.description}), 404
+
+
+@app.errorhandler(412)
+async def precondition_failed(error):
+    """Handle writes whose If-Match no longer matches."""
+    return jsonify({'error': 'Precondition Failed', 'message': error.description}), 412
+
+
+@app.errorhandler(500)
+async def server_error(error):
+    """Handle internal server errors."""
+    return jsonify({'error': 'Internal Server Error', 'message': str(error)}), 500
+
+
+if __name__ == '__main__':
+    repository.reload()
+    
+    print("Bookstore API (asyncio) running on http://localhost:5000")
+    app.run(port=5000)
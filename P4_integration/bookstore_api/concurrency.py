@@ -0,0 +1,111 @@
+"""
+Concurrency Control
+
+Locks used to keep the catalog consistent when the API is served by many
+threads or by several worker processes sharing the same data files.
+
+- RWLock lets any number of requests read the in-memory catalog at once
+  while writes get it to themselves.
+- FileLock serializes writers across processes with flock() on a lock
+  file next to the data. On platforms without fcntl it only serializes
+  threads within one process.
+"""
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class PreconditionFailed(Exception):
+    """A conditional write found that the book changed since the client read it."""
+
+    def __init__(self, book_id):
+        super().__init__(f"Book {book_id} has been modified")
+        self.book_id = book_id
+
+
+class RWLock:
+    """
+    Readers-writer lock.
+
+    Waiting writers block new readers, so a steady stream of reads can't
+    starve writes. Not reentrant: don't take it again while holding it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class FileLock:
+    """
+    Exclusive lock shared by every process that opens the same lock file.
+
+    Reentrant within a thread, like threading.RLock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, 'a')
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def close(self):
+        with self._thread_lock:
+            if self._file is not None and self._depth == 0:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,72 @@
+"""
+Response Encoding
+
+Body formats and compression the API can negotiate with a client:
+
+- JSON, or MessagePack for clients that send Accept: application/msgpack.
+  It is smaller than JSON and quicker to decode, and needs
+  `pip install msgpack`.
+- gzip, or brotli for clients that send Accept-Encoding: br. Brotli
+  compresses the catalog noticeably better than gzip, and needs
+  `pip install brotli`.
+
+Both packages are optional; without them the API offers JSON and gzip only.
+JSON is written without spaces after separators.
+"""
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# In order of preference when a client accepts several equally
+BODY_MIMETYPES = (JSON_MIMETYPE,) + ((MSGPACK_MIMETYPE,) if msgpack else ())
+CONTENT_CODINGS = (('br',) if brotli else ()) + ('gzip',)
+
+GZIP_LEVEL = 6
+# Brotli's default quality (11) is many times slower on a catalog-sized
+# body for only a few percent smaller output
+BROTLI_QUALITY = 5
+
+
+def negotiate_mimetype(accept_mimetypes):
+    """Return the body format to send for a request's Accept header."""
+    return accept_mimetypes.best_match(BODY_MIMETYPES, default=JSON_MIMETYPE)
+
+
+def negotiate_coding(accept_encodings, size, min_bytes):
+    """
+    Return the content coding for a body of `size` bytes, or None to send it as is.
+
+    Parameters:
+        accept_encodings: The request's parsed Accept-Encoding header
+        size (int): Length of the uncompressed body
+        min_bytes (int): Smaller bodies aren't worth compressing
+    """
+    if size < min_bytes:
+        return None
+    return accept_encodings.best_match(CONTENT_CODINGS)
+
+
+def encode_body(data, mimetype=JSON_MIMETYPE):
+    """Encode response data as JSON or MessagePack bytes."""
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def compress(body, coding):
+    """Compress a body with 'gzip' or 'br'."""
+    if coding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
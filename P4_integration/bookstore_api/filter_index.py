@@ -0,0 +1,218 @@
+"""
+Filter Index
+
+Secondary indexes for filtering the catalog by stock, author and price,
+updated incrementally as books are added, changed and removed:
+
+- the IDs of in-stock and of out-of-stock books, as two sets;
+- a hash from lowercase author name to the IDs of their books;
+- a sorted list of (price, ID), so a price range is found by bisection.
+
+A query reads the smallest candidate set its filters select and checks
+the remaining filters book by book, so it costs about as much as that
+set is large rather than the whole catalog. Results sorted by price come
+straight out of the price list when the price range was the smallest set.
+"""
+import bisect
+import math
+from collections import Counter
+
+SORT_KEYS = ('id', 'price', 'title')
+
+# Upper bounds of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKETS = (10, 20, 50)
+
+# Authors listed in the author facet, most books first
+AUTHOR_FACET_SIZE = 10
+
+_MAX_ID = chr(0x10FFFF)  # sorts after every book ID
+
+
+def stock_flag(value):
+    """Interpret an in_stock value; true, 1, "yes", "y" and "true" mean in stock."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('yes', 'y', 'true', '1')
+    return bool(value)
+
+
+def price_of(book):
+    """Return a book's price as a float, or None if it has no finite numeric price."""
+    price = book.get('price')
+    if isinstance(price, bool):
+        return None
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return None
+    # NaN compares false with everything, which breaks the sorted price list
+    return price if math.isfinite(price) else None
+
+
+def author_key(book):
+    return str(book.get('author', '')).strip().lower()
+
+
+def facet_counts(books):
+    """
+    Count books by stock, author and price range.
+
+    Returns:
+        dict: {"in_stock": {"true": n, "false": n},
+               "author": [{"value", "count"}, ...] (most common first),
+               "price": [{"min", "max", "count"}, ...] (max is None for the last range)}
+    """
+    stock = Counter()
+    authors = Counter()  # lowercase author -> count, like the author filter
+    names = {}           # lowercase author -> spelling seen first
+    prices = Counter()
+    for book in books:
+        stock[stock_flag(book.get('in_stock'))] += 1
+        key = author_key(book)
+        authors[key] += 1
+        names.setdefault(key, book.get('author'))
+        price = price_of(book)
+        if price is not None:
+            prices[bisect.bisect_right(PRICE_BUCKETS, price)] += 1
+
+    bounds = (0,) + PRICE_BUCKETS + (None,)
+    return {
+        'in_stock': {'true': stock[True], 'false': stock[False]},
+        'author': [{'value': names[key], 'count': count}
+                   for key, count in authors.most_common(AUTHOR_FACET_SIZE)],
+        'price': [{'min': bounds[i], 'max': bounds[i + 1], 'count': prices[i]}
+                  for i in range(len(bounds) - 1)]
+    }
+
+
+class FilterIndex:
+    """Stock, author and price indexes supporting filtered, sorted queries."""
+
+    def __init__(self, books=()):
+        """
+        Parameters:
+            books (iterable): Books to index; building the index from a whole
+                catalog at once sorts the price list once instead of per book
+        """
+        self._books = {}          # book ID -> book
+        self._in_stock = set()
+        self._out_of_stock = set()
+        self._by_author = {}      # lowercase author -> set of book IDs
+        self._prices = []         # sorted (price, book ID) of books with a price
+
+        for book in books:
+            self._books[book['id']] = book
+        for book_id, book in self._books.items():
+            self._add_to_sets(book)
+            price = price_of(book)
+            if price is not None:
+                self._prices.append((price, book_id))
+        self._prices.sort()
+
+    def __len__(self):
+        return len(self._books)
+
+    def add(self, book):
+        """Index a book, replacing any previous entry with the same ID."""
+        self.remove(book['id'])
+        self._books[book['id']] = book
+        self._add_to_sets(book)
+        price = price_of(book)
+        if price is not None:
+            bisect.insort(self._prices, (price, book['id']))
+
+    def _add_to_sets(self, book):
+        book_id = book['id']
+        if stock_flag(book.get('in_stock')):
+            self._in_stock.add(book_id)
+        else:
+            self._out_of_stock.add(book_id)
+        self._by_author.setdefault(author_key(book), set()).add(book_id)
+
+    def remove(self, book_id):
+        """Remove a book from the indexes (no-op if it isn't indexed)."""
+        book = self._books.pop(book_id, None)
+        if book is None:
+            return
+
+        self._in_stock.discard(book_id)
+        self._out_of_stock.discard(book_id)
+        key = author_key(book)
+        ids = self._by_author[key]
+        ids.discard(book_id)
+        if not ids:
+            del self._by_author[key]
+        price = price_of(book)
+        if price is not None:
+            del self._prices[bisect.bisect_left(self._prices, (price, book_id))]
+
+    def query(self, in_stock=None, author=None, min_price=None, max_price=None,
+              sort='id', descending=False):
+        """
+        Return the books matching every given filter.
+
+        Parameters:
+            in_stock (bool): Only books that are (True) or aren't (False) in stock
+            author (str): Only books by this author (case-insensitive)
+            min_price (float): Only books costing at least this much
+            max_price (float): Only books costing at most this much
+            sort (str): 'id', 'price' or 'title'; books without a price
+                come last when sorting by price
+            descending (bool): Reverse the sort order
+
+        Returns:
+            list: The matching books, in order
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+
+        # Each filter offers (number of candidates, candidate IDs, check)
+        filters = []
+        if in_stock is not None:
+            ids = self._in_stock if in_stock else self._out_of_stock
+            filters.append((len(ids), lambda ids=ids: ids,
+                            lambda book: stock_flag(book.get('in_stock')) == in_stock))
+        if author is not None:
+            key = author.strip().lower()
+            ids = self._by_author.get(key, set())
+            filters.append((len(ids), lambda ids=ids: ids,
+                            lambda book: author_key(book) == key))
+        price_filter = None
+        if min_price is not None or max_price is not None:
+            lo = 0 if min_price is None else bisect.bisect_left(self._prices, (min_price, ''))
+            hi = (len(self._prices) if max_price is None
+                  else bisect.bisect_right(self._prices, (max_price, _MAX_ID)))
+
+            def in_range(book):
+                price = price_of(book)
+                return (price is not None
+                        and (min_price is None or price >= min_price)
+                        and (max_price is None or price <= max_price))
+
+            price_filter = (max(0, hi - lo),
+                            lambda: [book_id for _, book_id in self._prices[lo:hi]], in_range)
+            filters.append(price_filter)
+
+        filters.sort(key=lambda f: f[0])
+        candidates = filters[0][1]() if filters else self._books
+        books = [self._books[book_id] for book_id in candidates]
+        checks = [check for _, _, check in filters[1:]]
+        if checks:
+            books = [book for book in books if all(check(book) for check in checks)]
+
+        if sort == 'price':
+            if filters and filters[0] is price_filter:
+                # Already in (price, ID) order, and every book has a price
+                priced, unpriced = books, []
+            else:
+                priced = sorted((b for b in books if price_of(b) is not None),
+                                key=lambda b: (price_of(b), b['id']))
+                unpriced = sorted((b for b in books if price_of(b) is None),
+                                  key=lambda b: b['id'])
+            # Books without a price come last either way
+            if descending:
+                return priced[::-1] + unpriced[::-1]
+            return priced + unpriced
+        if sort == 'title':
+            return sorted(books, key=lambda b: (str(b.get('title', '')).lower(), b['id']),
+                          reverse=descending)
+        return sorted(books, key=lambda b: b['id'], reverse=descending)
@@ -0,0 +1,107 @@
+"""
+Latency Simulation
+
+Adds an artificial delay before each request so the API behaves like a
+remote service during development. The delay is configured per route and
+can be turned off entirely for production and benchmark runs. sleep()
+blocks the calling thread; sleep_async() only suspends the current task.
+
+Modes:
+    off     no delay
+    fixed   each route waits its configured delay
+    normal  delays are drawn from a normal distribution around the route's
+            delay (standard deviation = delay * jitter)
+    p99     the route's delay, except 1% of requests take `tail` times longer
+
+Environment variables read by LatencySimulator.from_env:
+    BOOKSTORE_LATENCY         mode (default: fixed)
+    BOOKSTORE_LATENCY_ROUTES  per-route overrides, e.g. "get_book=0.05,search_books=2"
+    BOOKSTORE_LATENCY_JITTER  standard deviation as a fraction of the delay (default: 0.25)
+    BOOKSTORE_LATENCY_TAIL    slow-request multiplier in p99 mode (default: 10)
+"""
+import asyncio
+import random
+import time
+
+LATENCY_MODES = ('off', 'fixed', 'normal', 'p99')
+
+# Probability of a slow request in p99 mode
+TAIL_PROBABILITY = 0.01
+
+
+def parse_route_delays(text):
+    """
+    Parse "route=seconds,route=seconds" into a dict.
+
+    Raises:
+        ValueError: If an entry is malformed or a delay is negative
+    """
+    delays = {}
+    for entry in filter(None, (e.strip() for e in text.split(','))):
+        route, sep, seconds = entry.partition('=')
+        if not sep or not route.strip():
+            raise ValueError(f"Expected route=seconds, got: {entry}")
+        delays[route.strip()] = float(seconds)
+        if delays[route.strip()] < 0:
+            raise ValueError(f"Delay for {route.strip()} cannot be negative")
+    return delays
+
+
+class LatencySimulator:
+    """Sleep before requests according to a per-route latency profile."""
+
+    def __init__(self, mode='fixed', route_delays=None, jitter=0.25, tail=10.0,
+                 seed=None, sleep=time.sleep):
+        """
+        Parameters:
+            mode (str): One of LATENCY_MODES
+            route_delays (dict): Endpoint name -> delay in seconds
+            jitter (float): Standard deviation in normal mode, as a fraction of the delay
+            tail (float): Delay multiplier for slow requests in p99 mode
+            seed (int): Seed for the random delays, for reproducible runs
+            sleep (callable): Function used to wait
+        """
+        if mode not in LATENCY_MODES:
+            raise ValueError(f"Unknown latency mode: {mode} "
+                             f"(expected one of: {', '.join(LATENCY_MODES)})")
+        self.mode = mode
+        self.route_delays = dict(route_delays or {})
+        self.jitter = jitter
+        self.tail = tail
+        self._random = random.Random(seed)
+        self._sleep = sleep
+
+    @classmethod
+    def from_env(cls, environ, route_delays):
+        """Build a simulator from BOOKSTORE_LATENCY* variables on top of default delays."""
+        delays = dict(route_delays)
+        delays.update(parse_route_delays(environ.get('BOOKSTORE_LATENCY_ROUTES', '')))
+        return cls(
+            mode=environ.get('BOOKSTORE_LATENCY', 'fixed'),
+            route_delays=delays,
+            jitter=float(environ.get('BOOKSTORE_LATENCY_JITTER', 0.25)),
+            tail=float(environ.get('BOOKSTORE_LATENCY_TAIL', 10)),
+        )
+
+    def delay_for(self, endpoint):
+        """Return how long a request to `endpoint` should wait, in seconds."""
+        base = self.route_delays.get(endpoint, 0.0)
+        if self.mode == 'off' or base <= 0:
+            return 0.0
+        if self.mode == 'normal':
+            return max(0.0, self._random.gauss(base, base * self.jitter))
+        if self.mode == 'p99' and self._random.random() < TAIL_PROBABILITY:
+            return base * self.tail
+        return base
+
+    def sleep(self, endpoint):
+        """Wait the delay for `endpoint`, if there is one."""
+        delay = self.delay_for(endpoint)
+        if delay > 0:
+            self._sleep(delay)
+
+    async def sleep_async(self, endpoint):
+        """Wait the delay for `endpoint` without blocking the event loop."""
+        delay = self.delay_for(endpoint)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,407 @@
+"""
+Book Repository
+
+Keeps the book catalog in memory and writes every change through to a
+storage backend (see storage.py), so reads never have to re-open and
+re-parse the data file. Books are indexed by ID, so lookups, updates and
+deletes don't scan the catalog, by title/author words for search, in
+sorted ID order for paging through the catalog, and by stock, author and
+price for filtering (see filter_index.py).
+
+Every mutation bumps a catalog version. Together with an epoch that
+changes whenever the catalog is (re)loaded, versions give HTTP caching
+validators that are never reused for different content, and a change feed:
+books are kept in the order of their last change, and deleted books leave
+a tombstone, so the changes since a version are found without scanning
+the catalog.
+
+Reads share a readers-writer lock; writes take it exclusively, plus the
+storage's inter-process lock, and catch up with changes other processes
+made before applying their own. Books are never modified in place, so a
+book handed to a reader stays consistent while it is being serialized.
+"""
+import bisect
+import copy
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from concurrency import PreconditionFailed, RWLock
+from filter_index import FilterIndex
+from search_index import SearchIndex
+from sqlite_repository import SqliteBookRepository
+from storage import STORAGE_BACKENDS, create_storage
+
+REPOSITORY_BACKENDS = STORAGE_BACKENDS + ('sqlite',)
+
+# Tombstones kept for the change feed; callers further behind than the
+# oldest one have to start over
+MAX_TOMBSTONES = 10000
+
+
+class BookRepository:
+    """In-memory book catalog with write-through persistence to a storage backend."""
+
+    def __init__(self, storage, seed=None):
+        """
+        Create a repository on top of a storage backend.
+
+        Parameters:
+            storage: Backend that persists the catalog (see storage.py)
+            seed (list): Books used to initialize empty storage
+        """
+        self.storage = storage
+        self.seed = seed or []
+        self._books = {}  # book ID -> book, in insertion order
+        self._sorted_ids = []
+        self._search_index = SearchIndex()
+        self._filter_index = FilterIndex()
+        self._loaded = False
+        self._lock = RWLock()
+
+        self._epoch = None
+        self._version = 0
+        self._loaded_at = None
+        self._modified = None
+        self._revisions = {}  # book ID -> (version, time) of its last change, oldest first
+        self._tombstones = {}  # deleted book ID -> version of the delete, oldest first
+        self._tombstone_floor = 0  # changes up to this version may be forgotten
+
+    def _load(self):
+        """Read the catalog from storage, seeding the storage first if it is empty."""
+        books = self.storage.load()
+        if books is None:
+            with self.storage.lock():
+                # Another process may have seeded it meanwhile
+                books = self.storage.load()
+                if books is None:
+                    books = copy.deepcopy(self.seed)
+                    self.storage.save_all(books)
+
+        self._books = {}
+        self._sorted_ids = []
+        self._search_index = SearchIndex()
+        for book in books:
+            self._index(book, filter_index=False)
+        # Built in one go: sorting all prices once beats inserting them one by one
+        self._filter_index = FilterIndex(self._books.values())
+        self._loaded = True
+
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+        self._loaded_at = self._modified = time.time()
+        self._revisions = {}
+        self._tombstones = {}
+        self._tombstone_floor = 0
+
+    def _record_change(self, book_id, deleted=False):
+        """Bump the catalog version for a change to one book."""
+        self._version += 1
+        self._modified = time.time()
+        # Re-insert, so both dicts stay in version order
+        self._revisions.pop(book_id, None)
+        self._tombstones.pop(book_id, None)
+        if deleted:
+            self._tombstones[book_id] = self._version
+            if len(self._tombstones) > MAX_TOMBSTONES:
+                oldest = next(iter(self._tombstones))
+                self._tombstone_floor = self._tombstones.pop(oldest)
+        else:
+            self._revisions[book_id] = (self._version, self._modified)
+
+    def _index(self, book, filter_index=True):
+        """Add or re-index a book in memory (see _load for `filter_index`)."""
+        if book['id'] not in self._books:
+            bisect.insort(self._sorted_ids, book['id'])
+        self._books[book['id']] = book
+        self._search_index.add(book)
+        if filter_index:
+            self._filter_index.add(book)
+
+    def _unindex(self, book_id):
+        """Remove a book from memory; returns False if it wasn't there."""
+        if self._books.pop(book_id, None) is None:
+            return False
+        del self._sorted_ids[bisect.bisect_left(self._sorted_ids, book_id)]
+        self._search_index.remove(book_id)
+        self._filter_index.remove(book_id)
+        return True
+
+    def _persist(self, changes, pending):
+        """
+        Record a list of ('put', book) / ('delete', book_id) changes in storage.
+
+        `pending` maps each changed book ID to its new book, or None if it
+        was deleted; memory isn't changed yet, so a failed write leaves it
+        matching what is stored.
+        """
+        def catalog():
+            # Only read by backends that rewrite the whole catalog
+            for book_id, book in self._books.items():
+                book = pending.get(book_id, book)
+                if book is not None:
+                    yield book
+            for book_id, book in pending.items():
+                if book is not None and book_id not in self._books:
+                    yield book
+
+        self.storage.commit(changes, catalog())
+
+    def _apply(self, changes):
+        """Apply changes that are already stored to memory, bumping the version for each."""
+        for op, value in changes:
+            if op == 'put':
+                self._index(value)
+                self._record_change(value['id'])
+            elif self._unindex(value):
+                self._record_change(value, deleted=True)
+
+    def _refresh(self):
+        """Apply changes made to the stored data outside this process."""
+        if not self._loaded:
+            self._load()
+            return
+        changes = self.storage.catch_up()
+        if changes is None:
+            self._load()
+            return
+        self._apply(changes)
+
+    @contextmanager
+    def _reading(self):
+        """Hold the read lock, after catching up with changes made elsewhere."""
+        if not self._loaded or self.storage.changed():
+            with self._lock.write():
+                self._refresh()
+        with self._lock.read():
+            yield
+
+    @contextmanager
+    def _writing(self):
+        """Hold the write lock and the storage lock, caught up with changes made elsewhere."""
+        with self._lock.write(), self.storage.lock():
+            self._refresh()
+            yield
+
+    def reload(self):
+        """Force the catalog to be re-read from storage."""
+        with self._lock.write():
+            self._load()
+
+    def close(self):
+        """Flush and release the storage backend."""
+        self.storage.close()
+
+    def all(self):
+        """Return a list of every book in the catalog."""
+        with self._reading():
+            return list(self._books.values())
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None if it doesn't exist."""
+        with self._reading():
+            return self._books.get(book_id)
+
+    def state(self):
+        """
+        Return the current (epoch, version, last modified time) of the catalog.
+
+        The epoch changes whenever the catalog is loaded from storage, and the
+        version increases with every mutation.
+        """
+        with self._reading():
+            return (self._epoch, self._version, self._modified)
+
+    def revision(self, book_id):
+        """
+        Return (epoch, version, modified time) of a book's last change, or None.
+
+        Books that haven't changed since the catalog was loaded report
+        version 0 and the load time.
+        """
+        with self._reading():
+            if book_id not in self._books:
+                return None
+            version, modified = self._revisions.get(book_id, (0, self._loaded_at))
+            return (self._epoch, version, modified)
+
+    def changes(self, epoch, since, limit):
+        """
+        Return the changes made to the catalog after one of its versions.
+
+        Only the latest change to each book is reported.
+
+        Parameters:
+            epoch (str): Epoch the version belongs to
+            since (int): Version the caller is up to date with
+            limit (int): Maximum number of changes to return
+
+        Returns:
+            tuple: (epoch, version, changes), where changes is a list of
+            (version, book ID, book or None if it was deleted) in version
+            order, or None if the caller has to start over from the whole
+            catalog (a different epoch, or changes no longer kept)
+        """
+        with self._reading():
+            if epoch != self._epoch or not self._tombstone_floor <= since <= self._version:
+                return (self._epoch, self._version, None)
+
+            changes = []
+            for book_id in reversed(self._revisions):
+                version = self._revisions[book_id][0]
+                if version <= since:
+                    break
+                changes.append((version, book_id, self._books[book_id]))
+            for book_id in reversed(self._tombstones):
+                version = self._tombstones[book_id]
+                if version <= since:
+                    break
+                changes.append((version, book_id, None))
+            changes.sort(key=lambda change: change[0])
+            return (self._epoch, self._version, changes[:limit])
+
+    def page(self, limit, after=None, offset=0):
+        """
+        Return one page of books in ID order.
+
+        Parameters:
+            limit (int): Maximum number of books to return
+            after (str): Only return books whose ID sorts after this one
+            offset (int): Number of books to skip first
+
+        Returns:
+            tuple: (books, ID of the last book or None if this is the last page)
+        """
+        with self._reading():
+            start = offset
+            if after is not None:
+                start += bisect.bisect_right(self._sorted_ids, after)
+            ids = self._sorted_ids[start:start + limit]
+            more = start + limit < len(self._sorted_ids)
+            return [self._books[i] for i in ids], (ids[-1] if ids and more else None)
+
+    def filter(self, in_stock=None, author=None, min_price=None, max_price=None,
+               sort='id', descending=False):
+        """
+        Return the books matching every given filter, in order.
+
+        See FilterIndex.query for the parameters.
+        """
+        with self._reading():
+            return self._filter_index.query(in_stock, author, min_price, max_price,
+                                            sort, descending)
+
+    def add(self, book):
+        """Add a new book (replacing any book with the same ID) and persist the catalog."""
+        return self.bulk([('create', book)])[0]
+
+    def update(self, book_id, changes, if_match=None):
+        """
+        Apply field changes to an existing book and persist the catalog.
+
+        Parameters:
+            if_match (set): Only update the book if its (epoch, version)
+                revision is one of these
+
+        Returns:
+            dict: The updated book, or None if it doesn't exist
+
+        Raises:
+            PreconditionFailed: If the book's revision isn't in `if_match`
+        """
+        return self.bulk([('update', book_id, changes)], if_match={book_id: if_match})[0]
+
+    def delete(self, book_id, if_match=None):
+        """
+        Remove a book and persist the catalog.
+
+        Returns:
+            bool: True if the book existed and was removed
+
+        Raises:
+            PreconditionFailed: If the book's revision isn't in `if_match`
+        """
+        return self.bulk([('delete', book_id)], if_match={book_id: if_match})[0]
+
+    def bulk(self, mutations, if_match=None):
+        """
+        Apply many mutations with a single write to storage.
+
+        Parameters:
+            mutations (list): Tuples of ('create', book),
+                ('update', book_id, changes) or ('delete', book_id)
+            if_match (dict): Book ID -> set of acceptable (epoch, version)
+                revisions, checked before anything is applied. Books that
+                don't exist and IDs mapped to None aren't checked.
+
+        Returns:
+            list: One result per mutation, as add/update/delete would return it
+
+        Raises:
+            PreconditionFailed: If a book's revision doesn't match
+        """
+        with self._writing():
+            for book_id, revisions in (if_match or {}).items():
+                if revisions is not None and book_id in self._books:
+                    version = self._revisions.get(book_id, (0, None))[0]
+                    if (self._epoch, version) not in revisions:
+                        raise PreconditionFailed(book_id)
+
+            # Worked out first and applied once they are stored, so a failed
+            # write doesn't leave memory ahead of storage
+            results, changes = [], []
+            pending = {}  # book ID -> book after the changes so far, or None if deleted
+
+            def current(book_id):
+                return pending[book_id] if book_id in pending else self._books.get(book_id)
+
+            for op, *args in mutations:
+                if op == 'create':
+                    book = args[0]
+                    pending[book['id']] = book
+                    results.append(book)
+                    changes.append(('put', book))
+                elif op == 'update':
+                    book_id, fields = args
+                    book = current(book_id)
+                    if book is not None:
+                        # A new dict, so readers holding the old one aren't affected
+                        book = pending[book_id] = {**book, **fields}
+                        changes.append(('put', book))
+                    results.append(book)
+                elif op == 'delete':
+                    removed = current(args[0]) is not None
+                    if removed:
+                        pending[args[0]] = None
+                        changes.append(('delete', args[0]))
+                    results.append(removed)
+                else:
+                    raise ValueError(f"Unknown mutation: {op}")
+            if changes:
+                self._persist(changes, pending)
+                self._apply(changes)
+            return results
+
+    def search(self, query, mode='substring'):
+        """
+        Return books matching the query in their title or author.
+
+        See SearchIndex.search for the supported modes.
+        """
+        with self._reading():
+            return self._search_index.search(query, mode)
+
+
+def create_repository(backend, data_file, seed=None):
+    """
+    Build the repository for a configured backend.
+
+    'json' and 'journal' keep the catalog in memory on top of the matching
+    storage backend; 'sqlite' queries a database stored next to `data_file`
+    (imported from it the first time).
+    """
+    if backend == 'sqlite':
+        root, _ = os.path.splitext(data_file)
+        return SqliteBookRepository(f"{root}.db", import_path=data_file, seed=seed)
+    return BookRepository(create_storage(backend, data_file), seed=seed)
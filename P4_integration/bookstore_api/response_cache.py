@@ -0,0 +1,138 @@
+"""
+Response Cache
+
+Keeps the encoded bytes of recent GET responses so an unchanged catalog
+isn't re-serialized on every request.
+
+Entries are stored with the ETag they were built for and only served
+while that ETag is still current, so a stale entry can never be returned
+even if an invalidation is missed (for example, a change made by another
+process sharing a SQLite database). Invalidation by tag frees the memory
+of entries a mutation made obsolete without touching unrelated ones.
+"""
+import threading
+from collections import OrderedDict
+
+from encoding import compress
+
+
+class CachedResponse:
+    """Encoded response body, plus compressed copies created on first use."""
+
+    __slots__ = ('key', 'body', 'etag', 'tags', '_compressed')
+
+    def __init__(self, key, body, etag, tags):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.tags = tags
+        self._compressed = {}  # content coding -> compressed body
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(body) for body in self._compressed.values())
+
+
+class ResponseCache:
+    """LRU cache of encoded responses with a memory budget and tag invalidation."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_fraction=0.25):
+        """
+        Parameters:
+            max_bytes (int): Total size of cached bodies; 0 disables the cache
+            max_entry_fraction (float): Bodies bigger than this share of the
+                budget are never cached, so one response can't flush the rest
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = int(max_bytes * max_entry_fraction)
+        self._entries = OrderedDict()  # key -> CachedResponse, least recent first
+        self._by_tag = {}              # tag -> keys of entries carrying it
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, etag):
+        """Return the entry for `key` if it was built for `etag`, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, etag, body, tags=()):
+        """
+        Cache an encoded body under `key`.
+
+        Returns:
+            CachedResponse: The new entry, or None if the body is too big to cache
+        """
+        if len(body) > self.max_entry_bytes:
+            return None
+        entry = CachedResponse(key, body, etag, frozenset(tags))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for tag in entry.tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            self._evict()
+        return entry
+
+    def compressed(self, entry, coding='gzip'):
+        """Return an entry's body compressed with `coding`, compressing it the first time."""
+        body = entry._compressed.get(coding)
+        if body is None:
+            body = compress(entry.body, coding)
+            with self._lock:
+                if coding not in entry._compressed:
+                    entry._compressed[coding] = body
+                    if self._entries.get(entry.key) is entry:
+                        self._bytes += len(body)
+                        self._evict()
+                body = entry._compressed[coding]
+        return body
+
+    def invalidate(self, tags):
+        """Drop every entry carrying any of `tags`."""
+        with self._lock:
+            for tag in tags:
+                for key in self._by_tag.pop(tag, ()):
+                    if self._remove(key):
+                        self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tag.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current usage."""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats,
+                        hit_rate=self._stats['hits'] / lookups if lookups else 0.0,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        max_bytes=self.max_bytes)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+        return True
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self._stats['evictions'] += 1
@@ -0,0 +1,173 @@
+"""
+Search Index
+
+An inverted index over book titles and authors that is updated
+incrementally as books are added, changed and removed.
+
+Titles and authors are split into lowercase words. Each word maps to the
+set of books containing it, and the vocabulary itself is indexed by
+trigram, so a substring query only has to look at the handful of words
+that could contain it instead of every book in the catalog.
+"""
+import bisect
+
+SEARCH_MODES = ('substring', 'prefix', 'all')
+
+
+def _trigrams(text):
+    """Return the set of three-character slices of `text`."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Word and trigram index supporting substring, prefix and AND queries."""
+
+    def __init__(self):
+        self._next_seq = 0
+        self._seq_by_id = {}       # book ID -> insertion sequence number
+        self._books = {}           # sequence number -> book
+        self._book_words = {}      # sequence number -> words indexed for it
+        self._book_text = {}       # sequence number -> lowercase (title, author)
+        self._postings = {}        # word -> set of sequence numbers
+        self._vocabulary = []      # every indexed word, sorted (for prefixes)
+        self._word_grams = {}      # trigram -> set of words containing it
+
+    def __len__(self):
+        return len(self._books)
+
+    @staticmethod
+    def _fields(book):
+        return (book['title'].lower(), book['author'].lower())
+
+    def add(self, book):
+        """Index a book, replacing any previous entry with the same ID."""
+        seq = self._seq_by_id.get(book['id'])
+        if seq is None:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seq_by_id[book['id']] = seq
+        else:
+            self._unindex(seq)
+
+        fields = self._fields(book)
+        words = set()
+        for field in fields:
+            words.update(field.split())
+        self._books[seq] = book
+        self._book_words[seq] = words
+        self._book_text[seq] = fields
+
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                bisect.insort(self._vocabulary, word)
+                for gram in _trigrams(word):
+                    self._word_grams.setdefault(gram, set()).add(word)
+            postings.add(seq)
+
+    def remove(self, book_id):
+        """Drop a book from the index; unknown IDs are ignored."""
+        seq = self._seq_by_id.pop(book_id, None)
+        if seq is not None:
+            self._unindex(seq)
+            del self._books[seq]
+            del self._book_text[seq]
+
+    def _unindex(self, seq):
+        for word in self._book_words.pop(seq, ()):
+            postings = self._postings[word]
+            postings.discard(seq)
+            if postings:
+                continue
+            del self._postings[word]
+            del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+            for gram in _trigrams(word):
+                words = self._word_grams[gram]
+                words.discard(word)
+                if not words:
+                    del self._word_grams[gram]
+
+    def _words_containing(self, fragment):
+        """Return the indexed words that contain `fragment`."""
+        if len(fragment) < 3:
+            return [w for w in self._vocabulary if fragment in w]
+
+        grams = sorted((self._word_grams.get(g, set()) for g in _trigrams(fragment)), key=len)
+        candidates = set.intersection(*grams) if grams[0] else set()
+        return [w for w in candidates if fragment in w]
+
+    def _words_starting_with(self, prefix):
+        """Return the indexed words that start with `prefix`."""
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + '\uffff')
+        return self._vocabulary[start:end]
+
+    def _intersect(self, terms, find_words):
+        """Return the sequence numbers of books where every term finds a word."""
+        # Start from the most selective term; once the candidates are far
+        # fewer than a term's postings, filter them instead of building the union.
+        plans = []
+        for term in terms:
+            words = set(find_words(term))
+            plans.append((sum(len(self._postings[w]) for w in words), words))
+        plans.sort(key=lambda plan: plan[0])
+
+        matches = None
+        for cost, words in plans:
+            if matches is None:
+                matches = set()
+                for word in words:
+                    matches |= self._postings[word]
+            elif cost > 8 * len(matches):
+                matches = {seq for seq in matches if not words.isdisjoint(self._book_words[seq])}
+            else:
+                found = set()
+                for word in words:
+                    found |= self._postings[word]
+                matches &= found
+            if not matches:
+                return set()
+        return matches or set()
+
+    def _substring(self, query):
+        parts = query.split()
+        if not parts:
+            # Whitespace-only queries can't use the word index
+            return {seq for seq, (title, author) in self._book_text.items()
+                    if query in title or query in author}
+
+        # Every word of the query must appear inside some word of the book;
+        # that narrows the candidates, which are then checked for the exact
+        # substring (unless the query is a single word, which needs no check).
+        candidates = self._intersect(parts, self._words_containing)
+        if len(parts) == 1 and parts[0] == query:
+            return candidates
+        text = self._book_text
+        return {seq for seq in candidates if query in text[seq][0] or query in text[seq][1]}
+
+    def search(self, query, mode='substring'):
+        """
+        Return the books matching a query, in the order they were indexed.
+
+        Parameters:
+            query (str): Text to look for (case-insensitive)
+            mode (str): 'substring' matches the query anywhere in the title or
+                author, 'prefix' requires every term to start a word, and
+                'all' requires every term to appear somewhere in the book
+
+        Returns:
+            list: The matching books
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        query = query.lower()
+        if mode == 'substring':
+            matches = self._substring(query)
+        elif mode == 'prefix':
+            matches = self._intersect(query.split(), self._words_starting_with)
+        else:
+            matches = self._intersect(query.split(), self._words_containing)
+
+        return [self._books[seq] for seq in sorted(matches)]
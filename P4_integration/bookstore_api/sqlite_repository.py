@@ -0,0 +1,357 @@
+"""
+SQLite Book Repository
+
+A drop-in alternative to BookRepository that keeps the catalog in a SQLite
+database and answers every request with an indexed query instead of
+holding the catalog in memory.
+
+- id is the primary key; author and title have case-insensitive indexes,
+  and price an index for range filters and sorting by price.
+- Search uses two FTS5 tables kept in sync by triggers: one with the
+  trigram tokenizer for substring matches, one with word tokens for
+  prefix matches.
+- The database runs in WAL mode, so readers never wait for a writer.
+- The catalog version used for HTTP caching is stored in the database, so
+  every process serving it agrees on it. Each book records the version of
+  its last change, and deleted books leave a row in deleted_books, so the
+  change feed is an indexed query on version. Tombstones are never pruned.
+- Writes run in BEGIN IMMEDIATE transactions, which SQLite serializes
+  across threads and processes, so concurrent writers never lose updates.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from concurrency import PreconditionFailed
+from filter_index import SORT_KEYS
+from search_index import SEARCH_MODES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    price REAL,
+    in_stock,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    modified REAL
+);
+CREATE TABLE IF NOT EXISTS catalog (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deleted_books (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_title ON books (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_author ON books (author COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_version ON books (version);
+CREATE INDEX IF NOT EXISTS books_price ON books (price);
+CREATE INDEX IF NOT EXISTS deleted_books_version ON deleted_books (version);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, content='books', content_rowid='rowid', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_words USING fts5(
+    title, author, content='books', content_rowid='rowid', prefix='1 2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+    INSERT INTO books_words (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author)
+        VALUES ('delete', old.rowid, old.title, old.author);
+    INSERT INTO books_words (books_words, rowid, title, author)
+        VALUES ('delete', old.rowid, old.title, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author)
+        VALUES ('delete', old.rowid, old.title, old.author);
+    INSERT INTO books_words (books_words, rowid, title, author)
+        VALUES ('delete', old.rowid, old.title, old.author);
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+    INSERT INTO books_words (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+END;
+"""
+
+# Same meaning as filter_index.stock_flag
+IN_STOCK = """
+CASE WHEN typeof(in_stock) = 'text' THEN lower(trim(in_stock)) IN ('yes', 'y', 'true', '1')
+     ELSE coalesce(in_stock, 0) != 0 END
+"""
+
+ORDER_BY = {
+    'id': "id {direction}",
+    'price': "price IS NULL, price {direction}, id {direction}",
+    'title': "lower(title) {direction}, id {direction}",
+}
+
+UPSERT = """
+INSERT INTO books (id, title, author, price, in_stock, data, version, modified)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    title = excluded.title, author = excluded.author, price = excluded.price,
+    in_stock = excluded.in_stock, data = excluded.data,
+    version = excluded.version, modified = excluded.modified
+"""
+
+
+def _fts_phrase(text):
+    """Quote text as a single FTS5 phrase."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _like_pattern(text):
+    """Escape text for use inside a LIKE pattern."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SqliteBookRepository:
+    """Book catalog stored in a SQLite database."""
+
+    def __init__(self, path, import_path=None, seed=None):
+        """
+        Parameters:
+            path (str): Location of the SQLite database
+            import_path (str): books.json file to import when the database is new
+            seed (list): Books used to initialize a new database otherwise
+        """
+        self.path = path
+        self.import_path = import_path
+        self.seed = seed or []
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def _db(self):
+        """Return this thread's connection, opening (and initializing) it if needed."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            self._local.db = db
+            with self._init_lock:
+                if not self._initialized:
+                    self._initialize(db)
+                    self._initialized = True
+        return db
+
+    def _initialize(self, db):
+        columns = {row[1] for row in db.execute("PRAGMA table_info(books)")}
+        if columns and 'version' not in columns:
+            # Databases created before books carried a version
+            db.execute("ALTER TABLE books ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            db.execute("ALTER TABLE books ADD COLUMN modified REAL")
+        db.executescript(SCHEMA)
+        db.execute("INSERT OR IGNORE INTO catalog VALUES (1, ?, 0, ?)",
+                   (uuid.uuid4().hex[:8], time.time()))
+        if db.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+            return
+        if db.execute("PRAGMA user_version").fetchone()[0]:
+            # Initialized before and emptied since
+            return
+
+        if self.import_path and os.path.exists(self.import_path):
+            with open(self.import_path, 'r') as f:
+                books = json.load(f)
+        else:
+            books = self.seed
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(UPSERT, [self._row(book) for book in books])
+            db.execute("PRAGMA user_version = 1")
+
+    @staticmethod
+    def _row(book, version=0, modified=None):
+        return (book['id'], book['title'], book['author'], book.get('price'),
+                book.get('in_stock'), json.dumps(book), version, modified)
+
+    def _select(self, where='', params=()):
+        rows = self._db.execute(f"SELECT data FROM books {where} ORDER BY rowid", params)
+        return [json.loads(data) for (data,) in rows]
+
+    def reload(self):
+        """Open the database; nothing is cached in memory, so there is nothing to re-read."""
+        self._db  # noqa: B018 - connecting initializes the schema
+
+    def all(self):
+        """Return a list of every book in the catalog."""
+        return self._select()
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None if it doesn't exist."""
+        row = self._db.execute("SELECT data FROM books WHERE id = ?", (book_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def state(self):
+        """Return the current (epoch, version, last modified time) of the catalog."""
+        return self._db.execute("SELECT epoch, version, modified FROM catalog").fetchone()
+
+    def revision(self, book_id):
+        """Return (epoch, version, modified time) of a book's last change, or None."""
+        return self._db.execute(
+            "SELECT catalog.epoch, books.version, COALESCE(books.modified, catalog.modified) "
+            "FROM books, catalog WHERE books.id = ?", (book_id,)).fetchone()
+
+    def changes(self, epoch, since, limit):
+        """Return the changes made after a catalog version; see BookRepository.changes."""
+        db = self._db
+        with db:
+            # One read transaction, so the version and the changes agree
+            db.execute("BEGIN")
+            current_epoch, version = db.execute("SELECT epoch, version FROM catalog").fetchone()
+            if epoch != current_epoch or not 0 <= since <= version:
+                return (current_epoch, version, None)
+            rows = db.execute(
+                "SELECT version, id, data FROM books WHERE version > ? "
+                "UNION ALL SELECT version, id, NULL FROM deleted_books WHERE version > ? "
+                "ORDER BY version LIMIT ?", (since, since, limit)).fetchall()
+        return (current_epoch, version,
+                [(v, book_id, json.loads(data) if data is not None else None)
+                 for v, book_id, data in rows])
+
+    def page(self, limit, after=None, offset=0):
+        """Return one page of books in ID order; see BookRepository.page."""
+        where, params = ("WHERE id > ?", [after]) if after is not None else ("", [])
+        rows = self._db.execute(f"SELECT data FROM books {where} ORDER BY id LIMIT ? OFFSET ?",
+                                params + [limit + 1, offset]).fetchall()
+        books = [json.loads(data) for (data,) in rows[:limit]]
+        return books, (books[-1]['id'] if len(rows) > limit else None)
+
+    def filter(self, in_stock=None, author=None, min_price=None, max_price=None,
+               sort='id', descending=False):
+        """Return the books matching every given filter; see FilterIndex.query."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+
+        conditions, params = [], []
+        if in_stock is not None:
+            conditions.append(f"({IN_STOCK}) = ?")
+            params.append(1 if in_stock else 0)
+        if author is not None:
+            conditions.append("author = ? COLLATE NOCASE")
+            params.append(author.strip())
+        if min_price is not None:
+            conditions.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            conditions.append("price <= ?")
+            params.append(max_price)
+
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        order = ORDER_BY[sort].format(direction="DESC" if descending else "ASC")
+        rows = self._db.execute(f"SELECT data FROM books {where} ORDER BY {order}", params)
+        return [json.loads(data) for (data,) in rows]
+
+    def add(self, book):
+        """Add a new book (replacing any book with the same ID)."""
+        return self.bulk([('create', book)])[0]
+
+    def update(self, book_id, changes, if_match=None):
+        """
+        Apply field changes to an existing book.
+
+        Returns:
+            dict: The updated book, or None if it doesn't exist
+        """
+        return self.bulk([('update', book_id, changes)], if_match={book_id: if_match})[0]
+
+    def delete(self, book_id, if_match=None):
+        """
+        Remove a book.
+
+        Returns:
+            bool: True if the book existed and was removed
+        """
+        return self.bulk([('delete', book_id)], if_match={book_id: if_match})[0]
+
+    def bulk(self, mutations, if_match=None):
+        """Apply many mutations in one transaction; see BookRepository.bulk."""
+        db = self._db
+        results = []
+        now = time.time()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            for book_id, revisions in (if_match or {}).items():
+                revision = self.revision(book_id)
+                if revisions is not None and revision and revision[:2] not in revisions:
+                    raise PreconditionFailed(book_id)
+            version = db.execute("SELECT version FROM catalog").fetchone()[0]
+            start_version = version
+            for op, *args in mutations:
+                if op == 'create':
+                    version += 1
+                    db.execute(UPSERT, self._row(args[0], version, now))
+                    db.execute("DELETE FROM deleted_books WHERE id = ?", (args[0]['id'],))
+                    results.append(args[0])
+                elif op == 'update':
+                    book_id, fields = args
+                    book = self.get(book_id)
+                    if book is not None:
+                        version += 1
+                        book.update(fields)
+                        db.execute(UPSERT, self._row(book, version, now))
+                    results.append(book)
+                elif op == 'delete':
+                    deleted = db.execute("DELETE FROM books WHERE id = ?", (args[0],)).rowcount
+                    if deleted:
+                        version += 1
+                        db.execute("INSERT OR REPLACE INTO deleted_books VALUES (?, ?)",
+                                   (args[0], version))
+                    results.append(deleted > 0)
+                else:
+                    raise ValueError(f"Unknown mutation: {op}")
+            if version != start_version:
+                db.execute("UPDATE catalog SET version = ?, modified = ?", (version, now))
+        return results
+
+    def search(self, query, mode='substring'):
+        """
+        Return books matching the query in their title or author.
+
+        Supports the same modes as SearchIndex.search.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        query = query.lower()
+        terms = [query] if mode == 'substring' else query.split()
+        if not terms:
+            return []
+
+        if mode == 'prefix':
+            match = ' AND '.join(_fts_phrase(t) + '*' for t in terms)
+            return self._select("WHERE rowid IN (SELECT rowid FROM books_words "
+                                "WHERE books_words MATCH ?)", (match,))
+
+        # The trigram index can't match anything shorter than three
+        # characters; those terms are checked with LIKE instead.
+        conditions, params = [], []
+        fts_terms = [t for t in terms if len(t.strip()) >= 3]
+        if fts_terms:
+            conditions.append("rowid IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)")
+            params.append(' AND '.join(_fts_phrase(t) for t in fts_terms))
+        for term in terms:
+            if len(term.strip()) < 3:
+                pattern = f"%{_like_pattern(term)}%"
+                conditions.append("(title LIKE ? ESCAPE '\\' OR author LIKE ? ESCAPE '\\')")
+                params.extend([pattern, pattern])
+        return self._select("WHERE " + " AND ".join(conditions), params)
+
+    def close(self):
+        """Close this thread's connection."""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
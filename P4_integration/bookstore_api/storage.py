@@ -0,0 +1,665 @@
+"""
+Book Storage
+
+Persistence backends for the BookRepository. A backend only has to know
+how to load the catalog and how to record changes to it:
+
+    load()                  -> list of books, or None if nothing is stored yet
+    save_all(books)         replace everything that is stored
+    commit(changes, books)  record a list of ('put', book) / ('delete', book_id)
+                            changes; `books` is the full catalog afterwards
+    changed()               True if the data was modified by someone else
+    catch_up()              -> changes made by someone else since the last
+                            load/catch_up, or None if a full load is needed
+    lock()                  context manager that excludes writers in other
+                            processes; hold it around catch_up() + commit()
+    close()                 flush anything pending
+
+Files are always replaced by writing a temporary file and renaming it, so a
+reader never sees a half-written catalog.
+
+Two backends are available:
+
+- JsonFileStorage rewrites a single books.json file on every change. It is
+  the default and the simplest to inspect. Like every file written here, it
+  is compact JSON without whitespace, about a quarter smaller than
+  indented JSON; `python -m json.tool books.json` pretty-prints it.
+- JournalStorage appends each change to a JSON-lines journal, fsyncs in
+  batches and compacts the journal into a snapshot in the background, so
+  the cost of a write doesn't grow with the size of the catalog.
+"""
+import json
+import os
+import threading
+
+from concurrency import FileLock
+
+# json.dump separators without the spaces after commas and colons
+COMPACT_SEPARATORS = (',', ':')
+
+
+def _stamp(stat):
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _file_stamp(path):
+    """Return the (inode, mtime, size) of a file, or None if it is missing."""
+    try:
+        return _stamp(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+
+def _write_json_atomic(path, data, indent=None):
+    """
+    Write JSON to a temporary file and move it over `path` once it is on disk.
+
+    Without `indent` the JSON is written compactly, with no whitespace.
+    """
+    # Unique per writer, so processes replacing the same file can't collide
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=indent, separators=None if indent else COMPACT_SEPARATORS)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JsonFileStorage:
+    """Store the whole catalog in one JSON file, rewritten on every change."""
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._file_lock = FileLock(f"{path}.lock")
+
+    def load(self):
+        try:
+            f = open(self.path, 'r')
+        except FileNotFoundError:
+            return None
+        with f:
+            # Stamp the file that was actually read, in case it is replaced meanwhile
+            self._stamp = _stamp(os.fstat(f.fileno()))
+            return json.load(f)
+
+    def save_all(self, books):
+        _write_json_atomic(self.path, list(books))
+        self._stamp = _file_stamp(self.path)
+
+    def commit(self, changes, books):
+        self.save_all(books)
+
+    def changed(self):
+        return self._stamp is None or _file_stamp(self.path) != self._stamp
+
+    def catch_up(self):
+        # The file only ever changes as a whole
+        return None if self.changed() else []
+
+    def lock(self):
+        return self._file_lock
+
+    def close(self):
+        self._file_lock.close()
+
+
+class _Compaction:
+    """A rotated journal being folded into a new snapshot on a worker thread."""
+
+    def __init__(self, storage, generation):
+        self.storage = storage
+        self.generation = generation
+        self.built = threading.Event()
+        self.new_snapshot = None
+        self.failed = False
+        self.installed = False
+        self.thread = threading.Thread(target=self._run, name='journal-compact')
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.new_snapshot = self.storage._fold(self.generation)
+        except BaseException:
+            # The rotated journal stays, and the next rotation folds it in
+            self.failed = True
+            raise
+        finally:
+            self.built.set()
+        with self.storage.lock():
+            self.install()
+
+    def install(self):
+        """
+        Swap the new snapshot in once it is built; call it under lock().
+
+        The worker thread does this itself, but a thread that holds the lock
+        and needs the compaction finished does it instead of waiting for the
+        worker to get the lock.
+        """
+        self.built.wait()
+        if not self.installed and not self.failed:
+            self.installed = True
+            self.storage._install(self.generation, self.new_snapshot)
+
+
+class JournalStorage:
+    """
+    Append-only journal of changes on top of a periodic snapshot.
+
+    The on-disk layout, given a base path such as ``books.json``:
+
+        books.snapshot.json   the catalog as of the last compaction
+        books.journal.old     a journal being compacted (only during compaction)
+        books.journal         changes since the snapshot, one JSON object per line
+
+    Loading reads the snapshot and replays the journals over it. Replaying a
+    change twice has no effect, so a crash at any point during compaction
+    leaves a state that loads correctly.
+
+    Each journal starts with a header record holding its generation, one
+    more than the journal before it, and the snapshot records the
+    generation of the last journal folded into it. A load only accepts
+    files that follow on from each other, and a journal of another
+    generation than the one a process has read is a different journal,
+    whatever its inode, so that process loads from scratch.
+
+    Several processes can share the files. Writers append under lock(), and
+    readers pick up what other processes appended by reading the journal
+    from where they left off (catch_up). Rotating the journal and swapping a
+    compacted snapshot in also happen under lock(); building the snapshot
+    happens in the background, serialized across processes by a second lock
+    file.
+    """
+
+    def __init__(self, base_path, import_path=None, sync_interval=0.05,
+                 compact_bytes=16 * 1024 * 1024):
+        """
+        Parameters:
+            base_path (str): Path the snapshot and journal file names derive from
+            import_path (str): books.json file to import when no snapshot exists
+            sync_interval (float): Seconds between batched fsyncs of the journal
+            compact_bytes (int): Journal size that triggers a background compaction
+        """
+        root, _ = os.path.splitext(base_path)
+        self.snapshot_path = f"{root}.snapshot.json"
+        self.journal_path = f"{root}.journal"
+        self.old_journal_path = f"{self.journal_path}.old"
+        self.import_path = import_path
+        self.sync_interval = sync_interval
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{root}.lock")
+        self._compact_lock = FileLock(f"{root}.compact.lock")
+        self._journal = None
+        # The generation of the journal this process has read (None if there
+        # was none) and how far, the generation of the journal that would
+        # carry on from there (None to force a full load), and the journal's
+        # (inode, mtime) as of the last read, for changed()
+        self._generation = None
+        self._next_generation = None
+        self._offset = 0
+        self._journal_stamp = None
+        self._dirty = False
+        self._compacting = None
+        self._stop = threading.Event()
+        self._syncer = None
+
+    # Reading
+
+    @staticmethod
+    def _read_header(f):
+        """
+        Read the header record of an open journal file.
+
+        Returns:
+            tuple: (generation, header size in bytes); (0, 0) for a journal
+            written before journals had headers, leaving `f` at its start
+        """
+        line = f.readline()
+        try:
+            entry = json.loads(line) if line.endswith(b'\n') else None
+        except ValueError:
+            entry = None
+        if isinstance(entry, dict) and entry.get('op') == 'start':
+            return entry['generation'], len(line)
+        f.seek(0)
+        return 0, 0
+
+    @classmethod
+    def _journal_generation(cls, path):
+        """Return the generation of a journal file, or None if there is none."""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            return cls._read_header(f)[0]
+
+    @staticmethod
+    def _read_changes(f):
+        """
+        Read ('put', book) / ('delete', book_id) changes from a journal file.
+
+        Returns:
+            tuple: (changes, number of bytes they took up)
+        """
+        changes, valid_bytes = [], 0
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("incomplete line")
+                entry = json.loads(line)
+            except ValueError:
+                # Still being written by another process, or torn by a crash
+                # mid-append. Either way nothing after it is complete yet.
+                break
+            valid_bytes += len(line)
+            if entry['op'] == 'put':
+                changes.append(('put', entry['book']))
+            else:
+                changes.append(('delete', entry['id']))
+        return changes, valid_bytes
+
+    @classmethod
+    def _replay(cls, books, path, generation):
+        """
+        Apply the changes in a journal file to a dict of books, if it is of
+        the given generation or has no header.
+
+        Returns:
+            tuple: (the journal's generation, bytes read, its (inode, mtime)),
+            or None if there is no such file
+        """
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            found, header_bytes = cls._read_header(f)
+            stat = os.fstat(f.fileno())
+            if found not in (generation, 0):
+                return found, 0, None
+            changes, valid_bytes = cls._read_changes(f)
+        for op, value in changes:
+            if op == 'put':
+                books[value['id']] = value
+            else:
+                books.pop(value, None)
+        return found, header_bytes + valid_bytes, (stat.st_ino, stat.st_mtime_ns)
+
+    def _read_snapshot(self):
+        """
+        Return (generation, dict of books) from the snapshot, or (0, None) if
+        there is none. A snapshot written before generations were recorded
+        is a plain list of books, and counts as generation 0.
+        """
+        try:
+            f = open(self.snapshot_path, 'r')
+        except FileNotFoundError:
+            return 0, None
+        with f:
+            data = json.load(f)
+        if isinstance(data, list):
+            return 0, {b['id']: b for b in data}
+        return data['generation'], {b['id']: b for b in data['books']}
+
+    @staticmethod
+    def _write_snapshot(path, generation, books):
+        _write_json_atomic(path, {'generation': generation, 'books': list(books)})
+
+    def _read_state(self):
+        """
+        Read the stored catalog.
+
+        Another process may compact or rotate meanwhile, so the files are
+        read again until they follow on from each other.
+
+        Returns:
+            tuple: (dict of books, or None if nothing is stored; generation of
+            the journal read, or None; generation of the journal to carry on
+            with; bytes of the journal read; its (inode, mtime); whether a
+            journal has no header)
+        """
+        last_mismatch = None
+        while True:
+            generation, books = self._read_snapshot()
+            stored = books is not None
+            books = books or {}
+            expected = generation + 1
+            legacy = False
+            journal = (None, 0, None)
+            found = []
+            for path in (self.old_journal_path, self.journal_path):
+                replayed = self._replay(books, path, expected)
+                if replayed is None:
+                    found.append(None)
+                    continue
+                stored = True
+                found.append(replayed[0])
+                if replayed[0] == 0:
+                    legacy = True
+                elif replayed[0] < expected:
+                    # Already in the snapshot: left by a crash mid-swap
+                    continue
+                elif replayed[0] > expected:
+                    break
+                if path == self.journal_path:
+                    journal = (expected,) + replayed[1:]
+                expected += 1
+            else:
+                return (books if stored else None, journal[0], expected) + journal[1:] + (legacy,)
+
+            # A compaction swapped the snapshot between the reads; the same
+            # mismatch twice in a row means a file has gone missing
+            mismatch = (generation, *found)
+            if mismatch == last_mismatch:
+                raise RuntimeError(f"{self.journal_path} doesn't follow on from "
+                                   f"{self.snapshot_path} (generations {mismatch})")
+            last_mismatch = mismatch
+
+    def load(self):
+        with self._lock:
+            self._close_journal()
+            (books, self._generation, self._next_generation, self._offset,
+             self._journal_stamp, legacy) = self._read_state()
+            if books is not None and not legacy:
+                return list(books.values())
+
+        if legacy:
+            self._upgrade()
+            return self.load()
+        if self.import_path and os.path.exists(self.import_path):
+            self.import_json(self.import_path)
+            return self.load()
+        return None
+
+    def _upgrade(self):
+        """Rewrite files from before journals had headers as a snapshot and a new journal."""
+        with self._file_lock:
+            books, *_, legacy = self._read_state()
+            if legacy:
+                self.save_all(books.values())
+
+    # Writing
+
+    def _create_journal(self, generation):
+        """Start an empty journal of the given generation, replacing any; call it under lock()."""
+        header = (json.dumps({'op': 'start', 'generation': generation},
+                             separators=COMPACT_SEPARATORS) + '\n').encode('utf-8')
+        tmp_path = f"{self.journal_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.flush()
+            os.fsync(f.fileno())
+            stat = os.fstat(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._generation, self._next_generation = generation, generation + 1
+        self._offset = len(header)
+        self._journal_stamp = (stat.st_ino, stat.st_mtime_ns)
+
+    def _open_journal(self):
+        if self._journal is None:
+            if self._generation is None:
+                # Caught up under lock(), so any journal there is one left
+                # over by a crash, older than the state this process read
+                self._create_journal(self._next_generation)
+            self._journal = open(self.journal_path, 'ab')
+            if self._syncer is None:
+                self._syncer = threading.Thread(target=self._sync_loop, daemon=True,
+                                                name='journal-sync')
+                self._syncer.start()
+        return self._journal
+
+    def save_all(self, books):
+        with self._file_lock, self._lock:
+            self._wait_for_compaction()
+            with self._compact_lock:
+                self._close_journal()
+                # Newer than any generation a process may have read, so they all load again
+                newest = max([self._read_snapshot()[0]] +
+                             [self._journal_generation(path) or 0
+                              for path in (self.old_journal_path, self.journal_path)])
+                self._write_snapshot(self.snapshot_path, newest + 1, books)
+                self._create_journal(newest + 2)
+                if os.path.exists(self.old_journal_path):
+                    os.remove(self.old_journal_path)
+
+    def commit(self, changes, books=None):
+        """
+        Append changes to the journal.
+
+        Must be called under lock(), caught up with every change other
+        processes have made.
+        """
+        lines = []
+        for op, value in changes:
+            record = {'op': 'put', 'book': value} if op == 'put' else {'op': 'delete', 'id': value}
+            lines.append(json.dumps(record, separators=COMPACT_SEPARATORS))
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+
+        with self._lock:
+            journal = self._open_journal()
+            if os.fstat(journal.fileno()).st_size > self._offset:
+                # Everything complete has been read, so what's left is a torn
+                # line from a crash mid-append. Cut it off before appending.
+                journal.truncate(self._offset)
+            journal.write(data)
+            journal.flush()
+            stat = os.fstat(journal.fileno())
+            self._offset += len(data)
+            self._journal_stamp = (stat.st_ino, stat.st_mtime_ns)
+            self._dirty = True
+            building = self._compacting is not None and not self._compacting.built.is_set()
+            if not building and self._offset >= self.compact_bytes:
+                self._wait_for_compaction()
+                self._start_compaction()
+
+    def changed(self):
+        # Only a quick look; catch_up goes by the journal's generation
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return self._journal_stamp is not None
+        return ((stat.st_ino, stat.st_mtime_ns) != self._journal_stamp
+                or stat.st_size != self._offset)
+
+    def catch_up(self):
+        with self._lock:
+            if self._next_generation is None:
+                return None
+            try:
+                f = open(self.journal_path, 'rb')
+            except FileNotFoundError:
+                # Rotated away, if this process had read one
+                return [] if self._generation is None else None
+            with f:
+                generation, header_bytes = self._read_header(f)
+                if generation == self._generation:
+                    offset = self._offset
+                elif self._generation is None and generation == self._next_generation:
+                    # Started on top of what this process read, so it only holds newer changes
+                    offset = header_bytes
+                else:
+                    return None
+                f.seek(offset)
+                changes, valid_bytes = self._read_changes(f)
+                stat = os.fstat(f.fileno())
+            self._generation, self._next_generation = generation, generation + 1
+            self._offset = offset + valid_bytes
+            self._journal_stamp = (stat.st_ino, stat.st_mtime_ns)
+            return changes
+
+    def lock(self):
+        return self._file_lock
+
+    # Background work
+
+    def _sync_loop(self):
+        """fsync the journal every sync_interval seconds while there are unsynced writes."""
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """Force buffered journal writes to disk."""
+        with self._lock:
+            if self._dirty and self._journal is not None:
+                os.fsync(self._journal.fileno())
+                self._dirty = False
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._journal = None
+            self._dirty = False
+
+    def _start_compaction(self):
+        """
+        Rotate the journal and fold it into a new snapshot on a worker thread.
+
+        Call it under lock(), with this process's last compaction finished.
+        """
+        self._close_journal()
+        # Left over from a compaction that crashed, or one another process
+        # hasn't swapped in yet (it can't while this process holds the lock)
+        left_over = self._journal_generation(self.old_journal_path)
+        if left_over is not None:
+            self._install(left_over, self._fold(left_over))
+
+        with open(self.journal_path, 'rb') as f:
+            generation, _ = self._read_header(f)
+            size = os.fstat(f.fileno()).st_size
+        read = (self._generation, self._next_generation, self._offset, self._journal_stamp)
+        os.replace(self.journal_path, self.old_journal_path)
+        self._create_journal(generation + 1)
+        if read[::2] != (generation, size):
+            # compact() by a process that isn't caught up: it still has to
+            # read the rest, and will find a journal it doesn't know
+            self._generation, self._next_generation, self._offset, self._journal_stamp = read
+        self._compacting = _Compaction(self, generation)
+
+    def _fold(self, generation):
+        """
+        Build a snapshot with the rotated journal of the given generation folded in.
+
+        Returns:
+            str: Path of the new snapshot, written beside the current one, or
+            None if there is nothing to add (the journal is gone, or already
+            in the snapshot)
+        """
+        with self._compact_lock:
+            if self._journal_generation(self.old_journal_path) != generation:
+                return None
+            snapshot_generation, books = self._read_snapshot()
+            if generation <= snapshot_generation:
+                return None
+            books = books or {}
+            self._replay(books, self.old_journal_path, generation)
+            new_snapshot = f"{self.snapshot_path}.{os.getpid()}-{generation}.new"
+            self._write_snapshot(new_snapshot, generation, books.values())
+            return new_snapshot
+
+    def _install(self, generation, new_snapshot):
+        """
+        Swap in a snapshot from _fold and remove the journal folded into it.
+
+        Call it under lock(), so that no process rotates meanwhile. If the
+        rotated journal has changed since the fold (another process folded
+        it in), the new snapshot is thrown away.
+        """
+        if self._journal_generation(self.old_journal_path) == generation:
+            if new_snapshot:
+                os.replace(new_snapshot, self.snapshot_path)
+            os.remove(self.old_journal_path)
+        elif new_snapshot:
+            os.remove(new_snapshot)
+
+    def _wait_for_compaction(self):
+        """Finish this process's compaction, if there is one."""
+        if self._compacting is not None:
+            with self._file_lock:
+                self._compacting.install()
+            self._compacting = None
+
+    def compact(self):
+        """Fold the journal into the snapshot and wait for it to finish."""
+        self._upgrade()
+        with self._file_lock, self._lock:
+            self._wait_for_compaction()
+            if os.path.exists(self.journal_path):
+                self._close_journal()
+                self._start_compaction()
+            self._wait_for_compaction()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._close_journal()
+            compacting, self._compacting = self._compacting, None
+        if compacting is not None:
+            with self._file_lock:
+                compacting.install()
+            compacting.thread.join()
+        self._file_lock.close()
+        self._compact_lock.close()
+
+    # Interchange with books.json
+
+    def import_json(self, path):
+        """Replace the stored catalog with the books in a books.json file."""
+        with open(path, 'r') as f:
+            books = json.load(f)
+        self.save_all(books)
+
+    def export_json(self, path):
+        """Write the stored catalog to a books.json file."""
+        self.sync()
+        with self._lock:
+            books = self._read_state()[0] or {}
+        _write_json_atomic(path, list(books.values()), indent=2)
+
+
+STORAGE_BACKENDS = ('json', 'journal')
+
+
+def create_storage(kind, data_file):
+    """
+    Build the storage backend named by `kind` for the given books.json path.
+
+    The journal backend keeps its files next to `data_file` and imports it
+    the first time it runs.
+    """
+    if kind == 'json':
+        return JsonFileStorage(data_file)
+    if kind == 'journal':
+        return JournalStorage(data_file, import_path=data_file)
+    raise ValueError(f"Unknown storage backend: {kind} "
+                     f"(expected one of: {', '.join(STORAGE_BACKENDS)})")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move a catalog between books.json "
+                                                 "and the journal backend.")
+    parser.add_argument('action', choices=('import', 'export', 'compact'))
+    parser.add_argument('base_path', help="books.json path the journal files live beside")
+    parser.add_argument('json_file', nargs='?', help="books.json file to import or export")
+    args = parser.parse_args()
+
+    storage = JournalStorage(args.base_path)
+    if args.action == 'import':
+        storage.import_json(args.json_file or args.base_path)
+    elif args.action == 'export':
+        storage.export_json(args.json_file or args.base_path)
+    else:
+        storage.compact()
+    storage.close()
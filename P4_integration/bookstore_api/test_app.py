@@ -0,0 +1,926 @@
+#!/usr/bin/env python3
+"""
+Test script for the Bookstore API
+"""
+import glob
+import gzip
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import api_common
+import app as bookstore_app
+import encoding
+from concurrency import PreconditionFailed
+from latency import LatencySimulator, parse_route_delays
+from repository import BookRepository, create_repository
+from response_cache import ResponseCache
+from sqlite_repository import SqliteBookRepository
+from storage import JournalStorage, JsonFileStorage
+
+
+def write_concurrently(backend, data_file, worker, count):
+    """
+    Add `count` books, and add 1 to book 1's price `count` times, from a
+    repository of its own; run in several processes at once.
+    """
+    repository = create_repository(backend, data_file, seed=bookstore_app.SAMPLE_BOOKS)
+    for i in range(count):
+        repository.add({'id': f"w{worker}-{i}", 'title': f"Book {i}",
+                        'author': f"Worker {worker}", 'price': 1.0, 'in_stock': True})
+        while True:
+            epoch, version, _ = repository.revision('1')
+            price = repository.get('1')['price']
+            try:
+                repository.update('1', {'price': price + 1}, if_match={(epoch, version)})
+                break
+            except PreconditionFailed:
+                continue
+    repository.close()
+
+
+def increment_while_compacting(data_file, count, compact_bytes):
+    """
+    Add 1 to book 1's price `count` times with If-Match retries, from a
+    journal small enough to be compacted over and over; run in several
+    processes at once.
+    """
+    storage = JournalStorage(data_file, import_path=data_file, compact_bytes=compact_bytes)
+    repository = BookRepository(storage)
+    for _ in range(count):
+        while True:
+            epoch, version, _ = repository.revision('1')
+            price = repository.get('1')['price']
+            try:
+                repository.update('1', {'price': price + 1}, if_match={(epoch, version)})
+                break
+            except PreconditionFailed:
+                continue
+    repository.close()
+
+class BookstoreApiTestCase(unittest.TestCase):
+    """Run each test against a fresh copy of the sample catalog."""
+
+    backend = 'json'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, 'books.json')
+        self.repository = self.make_repository()
+
+        repository_patch = patch.object(bookstore_app, 'repository', self.repository)
+        latency_patch = patch.object(bookstore_app, 'latency', LatencySimulator('off'))
+        cache_patch = patch.object(bookstore_app, 'response_cache', ResponseCache())
+        for p in (repository_patch, latency_patch, cache_patch):
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+        self.client = bookstore_app.app.test_client()
+
+    def make_repository(self):
+        return BookRepository(JsonFileStorage(self.data_file), seed=bookstore_app.SAMPLE_BOOKS)
+
+    def stored_books(self):
+        """Return the catalog as a freshly opened repository sees it."""
+        repository = self.make_repository()
+        books = repository.all()
+        if hasattr(repository, 'close'):
+            repository.close()
+        return books
+
+    def read_data_file(self):
+        with open(self.data_file) as f:
+            return json.load(f)
+
+
+class TestBookstoreApi(BookstoreApiTestCase):
+    def test_get_books(self):
+        response = self.client.get('/api/books')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['id'] for b in response.get_json()], ['1', '2', '3'])
+
+    def test_get_books_paginated(self):
+        response = self.client.get('/api/books', query_string={'limit': 2})
+        page = response.get_json()
+        self.assertEqual([b['id'] for b in page['books']], ['1', '2'])
+
+        response = self.client.get('/api/books', query_string={
+            'limit': 2, 'cursor': page['next_cursor']
+        })
+        page = response.get_json()
+        self.assertEqual([b['id'] for b in page['books']], ['3'])
+        self.assertIsNone(page['next_cursor'])
+
+    def test_get_books_offset_and_fields(self):
+        response = self.client.get('/api/books', query_string={
+            'offset': 1, 'limit': 1, 'fields': 'id,title'
+        })
+        self.assertEqual(response.get_json()['books'], [{'id': '2', 'title': '1984'}])
+
+    def test_get_books_invalid_page(self):
+        for params in ({'limit': 0}, {'limit': 'ten'}, {'cursor': '!!'}, {'fields': ','}):
+            self.assertEqual(self.client.get('/api/books', query_string=params).status_code,
+                             400, params)
+
+    def test_get_books_ndjson(self):
+        with patch.object(bookstore_app, 'STREAM_BATCH_SIZE', 2):
+            response = self.client.get('/api/books', query_string={
+                'format': 'ndjson', 'fields': 'id'
+            })
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+    def test_get_books_conditional(self):
+        response = self.client.get('/api/books')
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        with patch.object(self.repository, 'all') as mock_all:
+            response = self.client.get('/api/books', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        mock_all.assert_not_called()
+
+        other = self.client.get('/api/books', query_string={'fields': 'id'})
+        self.assertNotEqual(other.headers['ETag'], etag)
+
+        self.client.put('/api/books/1', json={'price': 1})
+        response = self.client.get('/api/books', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_book_conditional(self):
+        etag = self.client.get('/api/books/1').headers['ETag']
+        self.assertEqual(
+            self.client.get('/api/books/1', headers={'If-None-Match': etag}).status_code, 304)
+
+        # Changing another book leaves this one's ETag alone
+        self.client.put('/api/books/2', json={'price': 1})
+        self.assertEqual(
+            self.client.get('/api/books/1', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.client.put('/api/books/1', json={'price': 1})
+        self.assertEqual(
+            self.client.get('/api/books/1', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get('/api/books/1').headers['Last-Modified']
+        response = self.client.get('/api/books/1', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_search_conditional(self):
+        response = self.client.get('/api/books/search', query_string={'query': 'lee'})
+        response = self.client.get('/api/books/search', query_string={'query': 'lee'},
+                                   headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_book(self):
+        response = self.client.get('/api/books/2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['title'], '1984')
+
+    def test_get_book_not_found(self):
+        response = self.client.get('/api/books/999')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['error'], 'Not Found')
+
+    def test_add_book(self):
+        response = self.client.post('/api/books', json={
+            'title': 'Dune', 'author': 'Frank Herbert', 'price': '9.99'
+        })
+        self.assertEqual(response.status_code, 201)
+        new_book = response.get_json()
+        self.assertEqual(new_book['price'], 9.99)
+        self.assertIn(new_book['id'], [b['id'] for b in self.stored_books()])
+
+    def test_add_book_missing_fields(self):
+        response = self.client.post('/api/books', json={'title': 'Dune'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_book_invalid_price(self):
+        response = self.client.post('/api/books', json={
+            'title': 'Dune', 'author': 'Frank Herbert', 'price': 'cheap'
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_book_non_finite_price(self):
+        for price in ('nan', 'inf', '-Infinity'):
+            response = self.client.post('/api/books', json={
+                'title': 'Dune', 'author': 'Frank Herbert', 'price': price
+            })
+            self.assertEqual(response.status_code, 400, price)
+        response = self.client.put('/api/books/1', json={'price': 'nan'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/books', query_string={'min_price': 'inf'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(all(math.isfinite(book['price']) for book in self.stored_books()))
+
+    def test_bulk_books(self):
+        lines = [
+            {'op': 'create', 'book': {'title': 'Dune', 'author': 'Frank Herbert', 'price': 9}},
+            {'op': 'update', 'id': '1', 'book': {'price': 5}},
+            {'op': 'delete', 'id': '2'},
+            {'op': 'delete', 'id': '999'},
+            {'op': 'create', 'book': {'title': 'No price'}},
+            {'op': 'rename', 'id': '3'},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n\n  \nnot json\n'
+        with patch.object(self.repository, 'bulk', wraps=self.repository.bulk) as mock_bulk:
+            response = self.client.post('/api/books/_bulk', data=body,
+                                        content_type='application/x-ndjson')
+        mock_bulk.assert_called_once()
+
+        summary = response.get_json()
+        self.assertEqual([r['status'] for r in summary['results']],
+                         [201, 200, 200, 404, 400, 400, 400])
+        self.assertEqual([r['index'] for r in summary['results']], list(range(7)))
+        self.assertEqual([r['line'] for r in summary['results']], [1, 2, 3, 4, 5, 6, 9])
+        self.assertEqual((summary['succeeded'], summary['failed']), (3, 4))
+
+        stored = {b['id']: b for b in self.stored_books()}
+        self.assertIn(summary['results'][0]['id'], stored)
+        self.assertEqual(stored['1']['price'], 5.0)
+        self.assertNotIn('2', stored)
+
+    def test_bulk_books_empty(self):
+        self.assertEqual(self.client.post('/api/books/_bulk', data='').status_code, 400)
+
+    def test_update_book(self):
+        response = self.client.put('/api/books/1', json={'price': 15})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['price'], 15.0)
+        self.assertEqual(self.stored_books()[0]['price'], 15.0)
+
+    def test_delete_book(self):
+        response = self.client.delete('/api/books/3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/books/3').status_code, 404)
+        self.assertNotIn('3', [b['id'] for b in self.stored_books()])
+
+    def test_delete_book_not_found(self):
+        self.assertEqual(self.client.delete('/api/books/999').status_code, 404)
+
+    def test_if_match(self):
+        etag = self.client.get('/api/books/1').headers['ETag']
+        self.client.put('/api/books/1', json={'price': 20})
+
+        response = self.client.put('/api/books/1', json={'price': 30}, headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.client.delete('/api/books/1', headers={'If-Match': etag}).status_code,
+                         412)
+        self.assertEqual(self.stored_books()[0]['price'], 20.0)
+
+        etag = self.client.get('/api/books/1').headers['ETag']
+        response = self.client.put('/api/books/1', json={'price': 30}, headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.put('/api/books/1', json={'price': 40},
+                                         headers={'If-Match': '*'}).status_code, 200)
+
+    def test_concurrent_writes_from_threads(self):
+        threads, count = 8, 10
+
+        def work(worker):
+            client = bookstore_app.app.test_client()
+            for i in range(count):
+                client.post('/api/books', json={'title': f"Book {i}",
+                                                'author': f"Worker {worker}", 'price': 1})
+                # Read-modify-write, retried whenever another thread got there first
+                while True:
+                    response = client.get('/api/books/1')
+                    price = response.get_json()['price']
+                    response = client.put('/api/books/1', json={'price': price + 1},
+                                          headers={'If-Match': response.headers['ETag']})
+                    if response.status_code != 412:
+                        break
+
+        workers = [threading.Thread(target=work, args=(w,)) for w in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        books = self.stored_books()
+        self.assertEqual(len(books), 3 + threads * count)
+        self.assertAlmostEqual(books[0]['price'],
+                               bookstore_app.SAMPLE_BOOKS[0]['price'] + threads * count)
+
+    def test_concurrent_writes_from_processes(self):
+        processes, count = 3, 10
+        self.repository.all()  # Create the stored catalog first
+
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=write_concurrently,
+                                   args=(self.backend, self.data_file, w, count))
+                   for w in range(processes)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+        self.assertEqual([p.exitcode for p in workers], [0] * processes)
+
+        books = self.stored_books()
+        self.assertEqual(len(books), 3 + processes * count)
+        self.assertAlmostEqual(books[0]['price'],
+                               bookstore_app.SAMPLE_BOOKS[0]['price'] + processes * count)
+        # This process's repository catches up with what the others wrote
+        self.assertEqual(len(self.repository.all()), 3 + processes * count)
+
+    def test_search_books(self):
+        response = self.client.get('/api/books/search', query_string={'query': 'ORWELL'})
+        self.assertEqual([b['id'] for b in response.get_json()], ['2'])
+
+    def test_search_requires_query(self):
+        self.assertEqual(self.client.get('/api/books/search').status_code, 400)
+
+    def test_search_modes(self):
+        def search(query, mode):
+            response = self.client.get('/api/books/search',
+                                       query_string={'query': query, 'mode': mode})
+            return [b['id'] for b in response.get_json()]
+
+        self.assertEqual(search('eat gats', 'substring'), ['3'])
+        self.assertEqual(search('o', 'substring'), ['1', '2', '3'])
+        self.assertEqual(search('geo orw', 'prefix'), ['2'])
+        self.assertEqual(search('orw geo', 'prefix'), ['2'])
+        self.assertEqual(search('eorge', 'prefix'), [])
+        self.assertEqual(search('gatsby scott', 'all'), ['3'])
+        self.assertEqual(search('gatsby orwell', 'all'), [])
+
+    def test_search_invalid_mode(self):
+        response = self.client.get('/api/books/search',
+                                   query_string={'query': 'lee', 'mode': 'fuzzy'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_index_follows_mutations(self):
+        self.client.put('/api/books/2', json={'title': 'Animal Farm'})
+        self.client.delete('/api/books/1')
+        self.client.post('/api/books', json={
+            'title': 'Nineteen Eighty-Four', 'author': 'George Orwell', 'price': 8
+        })
+
+        def titles(query):
+            response = self.client.get('/api/books/search', query_string={'query': query})
+            return [b['title'] for b in response.get_json()]
+
+        self.assertEqual(titles('1984'), [])
+        self.assertEqual(titles('farm'), ['Animal Farm'])
+        self.assertEqual(titles('mockingbird'), [])
+        self.assertEqual(titles('orwell'), ['Animal Farm', 'Nineteen Eighty-Four'])
+
+
+    def test_filters_and_facets(self):
+        for title, author, price, in_stock in (('Animal Farm', 'george orwell', 8, 'yes'),
+                                               ('Emma', 'Jane Austen', 25, 'no')):
+            self.client.post('/api/books', json={
+                'title': title, 'author': author, 'price': price, 'in_stock': in_stock
+            })
+
+        def query(**params):
+            response = self.client.get('/api/books', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            return response.get_json()
+
+        page = query(in_stock='true', max_price=15, sort='price')
+        self.assertEqual([b['title'] for b in page['books']],
+                         ['Animal Farm', '1984', 'To Kill a Mockingbird'])
+        self.assertEqual(page['total'], 3)
+        self.assertIsNone(page['next_offset'])
+        self.assertEqual(page['facets']['in_stock'], {'true': 3, 'false': 0})
+        self.assertEqual([b['count'] for b in page['facets']['price']], [1, 2, 0, 0])
+
+        page = query(author='GEORGE ORWELL', sort='-price')
+        self.assertEqual([b['title'] for b in page['books']], ['1984', 'Animal Farm'])
+        page = query(in_stock='false', sort='title')
+        self.assertEqual([b['title'] for b in page['books']], ['Emma', 'The Great Gatsby'])
+        self.assertEqual(query(min_price=11, max_price=12)['books'][0]['id'], '3')
+        self.assertEqual(query(min_price=30)['total'], 0)
+
+        page = query(sort='price', limit=2, offset=2, fields='title')
+        self.assertEqual(page['books'], [{'title': 'The Great Gatsby'},
+                                         {'title': 'To Kill a Mockingbird'}])
+        self.assertEqual((page['total'], page['next_offset']), (5, 4))
+        # Facets count every match, not just the page; authors case-insensitively
+        top_author = page['facets']['author'][0]
+        self.assertEqual((top_author['value'].lower(), top_author['count']), ('george orwell', 2))
+
+        # Filters are kept up to date by writes
+        self.client.put('/api/books/2', json={'in_stock': False, 'price': 30})
+        self.assertEqual([b['id'] for b in query(min_price=30)['books']], ['2'])
+        self.assertEqual(query(in_stock='true')['total'], 2)
+        self.client.delete('/api/books/2')
+        self.assertEqual(query(min_price=30)['total'], 0)
+
+        for params in ({'in_stock': 'maybe'}, {'min_price': 'cheap'}, {'sort': 'rating'}):
+            response = self.client.get('/api/books', query_string=params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_change_feed(self):
+        start = self.client.get('/api/books/changes').get_json()
+        self.assertEqual((start['reset'], start['changes']), (True, []))
+
+        self.client.put('/api/books/1', json={'price': 1})
+        self.client.delete('/api/books/2')
+        new_id = self.client.post('/api/books', json={
+            'title': 'Emma', 'author': 'Jane Austen', 'price': 7.5
+        }).get_json()['id']
+        self.client.put('/api/books/1', json={'price': 2})
+
+        feed = self.client.get('/api/books/changes',
+                               query_string={'since': start['cursor']}).get_json()
+        self.assertFalse(feed['reset'])
+        self.assertFalse(feed['more'])
+        # One change per book, in the order of their latest change
+        self.assertEqual([(c['op'], c['id']) for c in feed['changes']],
+                         [('delete', '2'), ('put', new_id), ('put', '1')])
+        self.assertEqual(feed['changes'][2]['book']['price'], 2)
+        seqs = [c['seq'] for c in feed['changes']]
+        self.assertEqual(seqs, sorted(seqs))
+
+        response = self.client.get('/api/books/changes',
+                                   query_string={'since': feed['cursor']})
+        self.assertEqual(response.get_json()['changes'], [])
+        self.assertEqual(response.get_json()['cursor'], feed['cursor'])
+
+        # Paging through the same changes
+        cursor, ids = start['cursor'], []
+        while True:
+            page = self.client.get('/api/books/changes',
+                                   query_string={'since': cursor, 'limit': 2}).get_json()
+            ids += [c['id'] for c in page['changes']]
+            cursor = page['cursor']
+            if not page['more']:
+                break
+        self.assertEqual(ids, ['2', new_id, '1'])
+        self.assertEqual(cursor, feed['cursor'])
+
+    def test_change_feed_reset(self):
+        epoch = self.client.get('/api/books/changes').get_json()['cursor'].rpartition('-')[0]
+        for cursor in ('other-0', f"{epoch}-999"):
+            feed = self.client.get('/api/books/changes', query_string={'since': cursor})
+            self.assertTrue(feed.get_json()['reset'])
+        response = self.client.get('/api/books/changes', query_string={'since': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_change_feed_long_poll(self):
+        cursor = self.client.get('/api/books/changes').get_json()['cursor']
+        writer = threading.Timer(0.3, lambda: self.repository.update('3', {'price': 1}))
+        writer.start()
+        self.addCleanup(writer.join)
+
+        start = time.monotonic()
+        with patch.object(bookstore_app, 'CHANGES_POLL_INTERVAL', 0.05):
+            feed = self.client.get('/api/books/changes', query_string={
+                'since': cursor, 'wait': 10
+            }).get_json()
+        self.assertEqual([c['id'] for c in feed['changes']], ['3'])
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_response_cache(self):
+        first = self.client.get('/api/books/1')
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        with patch.object(self.repository, 'get') as mock_get:
+            second = self.client.get('/api/books/1')
+        mock_get.assert_not_called()
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.get_data(), first.get_data())
+
+        stats = self.client.get('/api/cache/stats').get_json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_response_cache_invalidation(self):
+        self.client.get('/api/books')
+        self.client.get('/api/books/1')
+
+        # Changing book 2 drops the catalog listing but not book 1
+        self.client.put('/api/books/2', json={'price': 1})
+        self.assertEqual(self.client.get('/api/books/1').headers['X-Cache'], 'HIT')
+        response = self.client.get('/api/books')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.get_json()[1]['price'], 1)
+
+        self.client.post('/api/books/_bulk', data=json.dumps(
+            {'op': 'delete', 'id': '1'}) + '\n')
+        self.assertEqual(self.client.get('/api/books/1').status_code, 404)
+        self.assertEqual(len(self.client.get('/api/books').get_json()), 2)
+
+    def test_response_cache_gzip(self):
+        with patch.object(bookstore_app, 'COMPRESS_MIN_BYTES', 10):
+            response = self.client.get('/api/books', headers={'Accept-Encoding': 'gzip'})
+            plain = self.client.get('/api/books')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.get_data()), plain.get_data())
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+    def test_uncacheable_response_is_compressed(self):
+        with patch.object(bookstore_app, 'COMPRESS_MIN_BYTES', 10), \
+                patch.object(bookstore_app.response_cache, 'max_entry_bytes', 0):
+            response = self.client.get('/api/books', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.get_data()))), 3)
+
+    @unittest.skipIf(encoding.brotli is None, "brotli is not installed")
+    def test_response_cache_brotli(self):
+        with patch.object(bookstore_app, 'COMPRESS_MIN_BYTES', 10):
+            response = self.client.get('/api/books', headers={'Accept-Encoding': 'gzip, br'})
+            plain = self.client.get('/api/books')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(encoding.brotli.decompress(response.get_data()), plain.get_data())
+
+    @unittest.skipIf(encoding.msgpack is None, "msgpack is not installed")
+    def test_msgpack_responses(self):
+        headers = {'Accept': 'application/msgpack, application/json;q=0.9'}
+        for url in ('/api/books', '/api/books/search?query=orwell'):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.mimetype, 'application/msgpack')
+            self.assertIn('Accept', response.headers['Vary'])
+            self.assertEqual(encoding.msgpack.unpackb(response.get_data()),
+                             self.client.get(url).get_json())
+
+    def test_json_unless_msgpack_is_available(self):
+        with patch('encoding.BODY_MIMETYPES', ('application/json',)):
+            response = self.client.get('/api/books', headers={
+                'Accept': 'application/msgpack, application/json;q=0.9'
+            })
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(len(response.get_json()), 3)
+
+
+    def test_each_representation_has_its_own_etag(self):
+        with patch.object(bookstore_app, 'COMPRESS_MIN_BYTES', 10):
+            plain = self.client.get('/api/books')
+            gzipped = self.client.get('/api/books', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+            self.assertNotEqual(gzipped.headers['ETag'], plain.headers['ETag'])
+
+            # A cache holding the gzip body revalidates it with its own ETag
+            response = self.client.get('/api/books', headers={
+                'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['ETag']
+            })
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], gzipped.headers['ETag'])
+
+        # Any representation's ETag names the revision for a conditional write
+        etag = self.client.get('/api/books/1', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        response = self.client.put('/api/books/1', json={'price': 20},
+                                   headers={'If-Match': api_common.representation_etag(
+                                       etag.strip('"'), 'application/msgpack', 'gzip')})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.put('/api/books/1', json={'price': 30},
+                                   headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+
+    def test_representation_etags(self):
+        etag = 'ab12cd34-7'
+        self.assertEqual(api_common.representation_etag(etag, 'application/json', None), etag)
+        tags = {api_common.representation_etag(etag, mimetype, coding)
+                for mimetype in ('application/json', 'application/msgpack')
+                for coding in (None, 'gzip', 'br')}
+        self.assertEqual(len(tags), 6)
+        self.assertEqual({api_common.content_etag(tag) for tag in tags}, {etag})
+
+class TestBookstoreApiJournal(TestBookstoreApi):
+    backend = 'journal'
+
+    def make_repository(self):
+        storage = JournalStorage(self.data_file)
+        self.addCleanup(storage.close)
+        return BookRepository(storage, seed=bookstore_app.SAMPLE_BOOKS)
+
+
+class TestBookstoreApiSqlite(TestBookstoreApi):
+    backend = 'sqlite'
+
+    def make_repository(self):
+        repository = SqliteBookRepository(os.path.join(self.tmp_dir, 'books.db'),
+                                          seed=bookstore_app.SAMPLE_BOOKS)
+        self.addCleanup(repository.close)
+        return repository
+
+
+class TestBookRepository(BookstoreApiTestCase):
+    def test_reads_are_served_from_memory(self):
+        self.repository.all()
+        with patch('storage.json.load') as mock_load:
+            self.repository.all()
+            self.repository.get('1')
+        mock_load.assert_not_called()
+
+    def test_reloads_after_out_of_band_change(self):
+        self.repository.all()
+        books = self.read_data_file()
+        books.append({'id': '4', 'title': 'Emma', 'author': 'Jane Austen',
+                      'price': 7.5, 'in_stock': True})
+        with open(self.data_file, 'w') as f:
+            json.dump(books, f)
+
+        self.assertEqual(self.repository.get('4')['title'], 'Emma')
+
+    def test_non_finite_prices_are_left_out_of_price_filters(self):
+        # Written by an older version, before non-finite prices were rejected
+        self.repository.all()
+        books = self.read_data_file()
+        books += [{'id': 'n', 'title': 'NaN', 'author': 'A', 'price': 'nan', 'in_stock': True},
+                  {'id': 'i', 'title': 'Inf', 'author': 'A', 'price': 'inf', 'in_stock': True},
+                  {'id': '5', 'title': 'Five', 'author': 'A', 'price': 5.0, 'in_stock': True}]
+        with open(self.data_file, 'w') as f:
+            json.dump(books, f)
+
+        def query(**params):
+            response = self.client.get('/api/books', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            return [book['id'] for book in response.get_json()['books']]
+
+        self.assertEqual(query(max_price=6), ['5'])
+        self.assertEqual(query(author='a', sort='price'), ['5', 'i', 'n'])
+        self.client.delete('/api/books/n')
+        self.assertEqual(query(min_price=5, max_price=5), ['5'])
+        self.assertEqual(query(min_price=0, sort='price'), ['5', '2', '3', '1'])
+
+    def test_data_file_is_compact(self):
+        self.repository.update('1', {'price': 20.0})
+        with open(self.data_file) as f:
+            text = f.read()
+        self.assertEqual(text, json.dumps(json.loads(text), separators=(',', ':')))
+
+    def test_failed_writes_leave_memory_unchanged(self):
+        os.mkdir(os.path.join(self.tmp_dir, 'journal'))
+        journal = JournalStorage(os.path.join(self.tmp_dir, 'journal', 'books.json'))
+        self.addCleanup(journal.close)
+        for storage in (self.repository.storage, journal):
+            with self.subTest(storage=type(storage).__name__):
+                repository = BookRepository(storage, seed=bookstore_app.SAMPLE_BOOKS)
+                books = repository.all()
+                state = repository.state()
+                revision = repository.revision('1')
+
+                with patch.object(storage, 'commit', side_effect=OSError('disk full')):
+                    with self.assertRaises(OSError):
+                        repository.update('1', {'price': 1.0})
+                    with self.assertRaises(OSError):
+                        repository.bulk([('create', dict(books[0], id='9')),
+                                         ('delete', '2'), ('update', '9', {'price': 2.0})])
+
+                self.assertEqual(repository.all(), books)
+                self.assertEqual(repository.state(), state)
+                self.assertEqual(repository.revision('1'), revision)
+                self.assertIsNone(repository.get('9'))
+                self.assertEqual(repository.filter(max_price=2.0), [])
+                self.assertEqual(repository.search(books[1]['title'].lower()), [books[1]])
+
+                # The next write that gets through is stored as usual
+                repository.delete('2')
+                self.assertEqual([book['id'] for book in repository.all()], ['1', '3'])
+
+    def test_bulk_changes_to_one_book_are_stored_in_order(self):
+        results = self.repository.bulk([
+            ('create', {'id': '9', 'title': 'New', 'author': 'A', 'price': 1.0, 'in_stock': True}),
+            ('update', '9', {'price': 2.0}),
+            ('delete', '1'),
+            ('update', '1', {'price': 3.0}),
+            ('delete', '1'),
+        ])
+        self.assertEqual([results[1]['price'], results[3], results[4]], [2.0, None, False])
+        self.assertEqual([(book['id'], book['price']) for book in self.read_data_file()],
+                         [(book['id'], book['price']) for book in bookstore_app.SAMPLE_BOOKS[1:]]
+                         + [('9', 2.0)])
+        self.assertEqual(self.repository.get('9')['price'], 2.0)
+        self.assertEqual(self.stored_books(), self.repository.all())
+
+    def test_change_feed_forgets_old_tombstones(self):
+        epoch, version, _ = self.repository.state()
+        with patch('repository.MAX_TOMBSTONES', 2):
+            for book_id in ('1', '2', '3'):
+                self.repository.delete(book_id)
+        self.assertIsNone(self.repository.changes(epoch, version, 10)[2])
+        self.assertEqual([c[1] for c in self.repository.changes(epoch, version + 1, 10)[2]],
+                         ['2', '3'])
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_stale_etag_misses(self):
+        cache = ResponseCache()
+        cache.put('/a', 'v1', b'body')
+        self.assertIsNone(cache.get('/a', 'v2'))
+        self.assertEqual(cache.get('/a', 'v1').body, b'body')
+
+    def test_evicts_least_recently_used_within_budget(self):
+        cache = ResponseCache(max_bytes=30, max_entry_fraction=0.5)
+        cache.put('/a', 'v', b'x' * 10)
+        cache.put('/b', 'v', b'x' * 10)
+        cache.get('/a', 'v')
+        cache.put('/c', 'v', b'x' * 15)
+        self.assertIsNone(cache.get('/b', 'v'))
+        self.assertIsNotNone(cache.get('/a', 'v'))
+        self.assertIsNone(cache.put('/d', 'v', b'x' * 16))
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (2, 25, 1))
+
+    def test_invalidate_by_tag(self):
+        cache = ResponseCache()
+        cache.put('/books', 'v', b'[]', ['catalog'])
+        cache.put('/books/1', 'v', b'{}', ['book:1'])
+        cache.invalidate(['catalog', 'book:2'])
+        self.assertIsNone(cache.get('/books', 'v'))
+        self.assertIsNotNone(cache.get('/books/1', 'v'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+
+class TestLatencySimulator(unittest.TestCase):
+    delays = {'get_book': 0.2, 'add_book': 0.5}
+
+    def test_off_never_sleeps(self):
+        self.assertEqual(LatencySimulator('off', self.delays).delay_for('add_book'), 0)
+
+    def test_fixed_uses_route_delay(self):
+        simulator = LatencySimulator('fixed', self.delays)
+        self.assertEqual(simulator.delay_for('get_book'), 0.2)
+        self.assertEqual(simulator.delay_for('unknown_route'), 0)
+
+    def test_normal_varies_around_route_delay(self):
+        simulator = LatencySimulator('normal', self.delays, seed=1)
+        delays = [simulator.delay_for('add_book') for _ in range(1000)]
+        self.assertGreater(len(set(delays)), 1)
+        self.assertAlmostEqual(sum(delays) / len(delays), 0.5, places=1)
+        self.assertTrue(all(d >= 0 for d in delays))
+
+    def test_p99_adds_rare_slow_requests(self):
+        simulator = LatencySimulator('p99', self.delays, tail=10, seed=1)
+        delays = [simulator.delay_for('get_book') for _ in range(10000)]
+        slow = [d for d in delays if d > 0.2]
+        self.assertTrue(0 < len(slow) < 300)
+        self.assertEqual(set(slow), {2.0})
+
+    def test_from_env(self):
+        simulator = LatencySimulator.from_env({
+            'BOOKSTORE_LATENCY': 'fixed',
+            'BOOKSTORE_LATENCY_ROUTES': 'get_book=1.5, search_books=0',
+        }, self.delays)
+        self.assertEqual(simulator.route_delays,
+                         {'get_book': 1.5, 'add_book': 0.5, 'search_books': 0})
+
+    def test_invalid_configuration(self):
+        self.assertRaises(ValueError, LatencySimulator, 'sometimes')
+        self.assertRaises(ValueError, parse_route_delays, 'get_book')
+        self.assertRaises(ValueError, parse_route_delays, 'get_book=-1')
+
+    def test_requests_sleep_for_their_route(self):
+        mock_sleep = Mock()
+        simulator = LatencySimulator('fixed', bookstore_app.ROUTE_DELAYS, sleep=mock_sleep)
+        with patch.object(bookstore_app, 'latency', simulator):
+            bookstore_app.app.test_client().get('/api/books/search')
+        mock_sleep.assert_called_once_with(bookstore_app.ROUTE_DELAYS['search_books'])
+
+
+class TestJournalStorage(BookstoreApiTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.data_file, 'w') as f:
+            json.dump(bookstore_app.SAMPLE_BOOKS, f)
+        self.storage = self.open_storage()
+        self.addCleanup(self.storage.close)
+
+    def open_storage(self, **kwargs):
+        return JournalStorage(self.data_file, import_path=self.data_file, **kwargs)
+
+    def test_imports_books_json_on_first_load(self):
+        self.assertEqual([b['id'] for b in self.storage.load()], ['1', '2', '3'])
+        self.assertTrue(os.path.exists(self.storage.snapshot_path))
+
+    def test_changes_are_appended_and_replayed(self):
+        repository = BookRepository(self.storage)
+        repository.update('1', {'price': 20.0})
+        repository.delete('2')
+        repository.add({'id': '4', 'title': 'Emma', 'author': 'Jane Austen',
+                        'price': 7.5, 'in_stock': True})
+        self.storage.close()
+
+        with open(self.storage.journal_path) as f:
+            header, *changes = f.readlines()
+        self.assertEqual(json.loads(header)['op'], 'start')
+        self.assertEqual(len(changes), 3)
+        reopened = self.open_storage()
+        books = {b['id']: b for b in reopened.load()}
+        self.assertEqual(sorted(books), ['1', '3', '4'])
+        self.assertEqual(books['1']['price'], 20.0)
+
+    def test_torn_final_line_is_discarded(self):
+        self.storage.load()
+        self.storage.commit([('delete', '1')])
+        self.storage.close()
+        with open(self.storage.journal_path, 'a') as f:
+            f.write('{"op": "delete", "id"')
+
+        reopened = self.open_storage()
+        self.assertEqual([b['id'] for b in reopened.load()], ['2', '3'])
+        reopened.commit([('delete', '2')])
+        reopened.close()
+        self.assertEqual([b['id'] for b in self.open_storage().load()], ['3'])
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        storage = self.open_storage(compact_bytes=1)
+        self.addCleanup(storage.close)
+        storage.load()
+        storage.commit([('delete', '1')])
+        storage.commit([('delete', '2')])
+        storage.compact()
+
+        self.assertFalse(os.path.exists(storage.old_journal_path))
+        with open(storage.snapshot_path) as f:
+            snapshot = json.load(f)
+        self.assertEqual([b['id'] for b in snapshot['books']], ['3'])
+        # A fresh journal of the next generation, with nothing in it yet
+        with open(storage.journal_path) as f:
+            self.assertEqual(f.readlines(), [json.dumps(
+                {'op': 'start', 'generation': snapshot['generation'] + 1},
+                separators=(',', ':')) + '\n'])
+
+    def test_catch_up_with_other_writers(self):
+        other = self.open_storage()
+        self.addCleanup(other.close)
+        self.storage.load()
+        other.load()
+
+        with other.lock():
+            other.commit([('delete', '1')])
+        self.assertTrue(self.storage.changed())
+        self.assertEqual(self.storage.catch_up(), [('delete', '1')])
+        self.assertEqual(self.storage.catch_up(), [])
+
+        # After a rotation only a full load is reliable
+        other.compact()
+        self.assertIsNone(self.storage.catch_up())
+
+    def test_concurrent_increments_while_compacting(self):
+        processes, count = 3, 200
+        self.storage.load()
+        self.storage.close()
+
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=increment_while_compacting,
+                                   args=(self.data_file, count, 2000))
+                   for _ in range(processes)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+        self.assertEqual([p.exitcode for p in workers], [0] * processes)
+
+        books = {b['id']: b for b in self.open_storage().load()}
+        self.assertAlmostEqual(books['1']['price'],
+                               bookstore_app.SAMPLE_BOOKS[0]['price'] + processes * count)
+        self.assertFalse(glob.glob(os.path.join(self.tmp_dir, '*.new')))
+
+    def test_stale_journal_generation_means_full_load(self):
+        other = self.open_storage()
+        self.addCleanup(other.close)
+        self.storage.load()
+        other.load()
+        with other.lock():
+            other.commit([('delete', '1')])
+        self.assertEqual(self.storage.catch_up(), [('delete', '1')])
+
+        # A journal of another generation is another journal, even with the
+        # same size and inode as the one read
+        with open(self.storage.journal_path, 'rb') as f:
+            header, rest = f.readline(), f.read()
+        start = json.loads(header)
+        start['generation'] += 5
+        with open(self.storage.journal_path, 'r+b') as f:
+            f.write(json.dumps(start, separators=(',', ':')).encode() + b'\n' + rest)
+        self.assertIsNone(self.storage.catch_up())
+
+    def test_journals_without_headers_are_upgraded(self):
+        snapshot = [b for b in bookstore_app.SAMPLE_BOOKS if b['id'] != '3']
+        with open(self.storage.snapshot_path, 'w') as f:
+            json.dump(snapshot, f)
+        with open(self.storage.journal_path, 'w') as f:
+            f.write(json.dumps({'op': 'delete', 'id': '1'}) + '\n')
+
+        self.assertEqual([b['id'] for b in self.storage.load()], ['2'])
+        with open(self.storage.journal_path) as f:
+            self.assertEqual(json.loads(f.readline())['op'], 'start')
+        self.assertEqual([b['id'] for b in self.open_storage().load()], ['2'])
+
+    def test_export_json(self):
+        self.storage.load()
+        self.storage.commit([('delete', '3')])
+        export_file = os.path.join(self.tmp_dir, 'export.json')
+        self.storage.export_json(export_file)
+        with open(export_file) as f:
+            self.assertEqual([b['id'] for b in json.load(f)], ['1', '2'])
+
+
+if __name__ == '__main__':
+    print("Running tests for Bookstore API...")
+    unittest.main()
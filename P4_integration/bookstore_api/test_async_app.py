@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Test script for the asyncio Bookstore API
+"""
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+try:
+    import async_app
+except ImportError:  # quart is optional
+    async_app = None
+
+from latency import LatencySimulator
+from repository import BookRepository
+from response_cache import ResponseCache
+from storage import JsonFileStorage
+
+
+@unittest.skipIf(async_app is None, "quart is not installed")
+class TestAsyncBookstoreApi(unittest.IsolatedAsyncioTestCase):
+    """The asyncio app answers like app.py, against a fresh sample catalog."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, 'books.json')
+        self.repository = BookRepository(JsonFileStorage(self.data_file),
+                                         seed=async_app.SAMPLE_BOOKS)
+
+        for name, value in (('repository', self.repository),
+                            ('latency', LatencySimulator('off')),
+                            ('response_cache', ResponseCache())):
+            p = patch.object(async_app, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+        self.client = async_app.app.test_client()
+
+    async def test_get_books(self):
+        response = await self.client.get('/api/books')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(await response.get_json()), 3)
+
+        response = await self.client.get('/api/books', query_string={'limit': 2, 'fields': 'id'})
+        page = await response.get_json()
+        self.assertEqual(page['books'], [{'id': '1'}, {'id': '2'}])
+        self.assertIsNotNone(page['next_cursor'])
+
+    async def test_filtered_books(self):
+        response = await self.client.get('/api/books', query_string={
+            'in_stock': 'true', 'sort': '-price'
+        })
+        page = await response.get_json()
+        self.assertEqual([b['id'] for b in page['books']], ['1', '2'])
+        self.assertEqual(page['facets']['in_stock'], {'true': 2, 'false': 0})
+
+    async def test_get_books_ndjson(self):
+        with patch.object(async_app, 'STREAM_BATCH_SIZE', 2):
+            response = await self.client.get('/api/books', query_string={
+                'format': 'ndjson', 'fields': 'id'
+            })
+        lines = (await response.get_data(as_text=True)).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+    async def test_filtered_ndjson_is_streamed_in_batches(self):
+        with patch.object(async_app, 'STREAM_BATCH_SIZE', 2):
+            response = await self.client.get('/api/books', query_string={
+                'format': 'ndjson', 'sort': '-price', 'fields': 'id'
+            })
+            chunks = [chunk async for chunk in async_app.stream_filtered_ndjson(
+                {'sort': 'price', 'descending': True}, ['id'])]
+        lines = (await response.get_data(as_text=True)).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], ['1', '3', '2'])
+        self.assertEqual(chunks, [b'{"id": "1"}\n{"id": "3"}\n', b'{"id": "2"}\n'])
+
+    def test_import_does_not_load_the_flask_app(self):
+        # Importing app.py would build a second repository and response cache
+        code = "import sys, async_app; print('app' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        self.assertEqual(output.stdout.strip(), 'False')
+
+    async def test_get_book_conditional(self):
+        response = await self.client.get('/api/books/1')
+        self.assertEqual((await response.get_json())['title'], 'To Kill a Mockingbird')
+        etag = response.headers['ETag']
+        response = await self.client.get('/api/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.client.get('/api/books/999')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual((await response.get_json())['error'], 'Not Found')
+
+    async def test_add_update_delete(self):
+        response = await self.client.post('/api/books', json={
+            'title': 'Emma', 'author': 'Jane Austen', 'price': '7.5'
+        })
+        self.assertEqual(response.status_code, 201)
+        book_id = (await response.get_json())['id']
+
+        response = await self.client.put(f'/api/books/{book_id}', json={'price': 9})
+        self.assertEqual((await response.get_json())['price'], 9.0)
+        response = await self.client.delete(f'/api/books/{book_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['id'] for b in self.repository.all()], ['1', '2', '3'])
+
+        response = await self.client.post('/api/books', json={'title': 'Emma'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_if_match(self):
+        etag = (await self.client.get('/api/books/1')).headers['ETag']
+        await self.client.put('/api/books/1', json={'price': 20})
+        response = await self.client.put('/api/books/1', json={'price': 30},
+                                         headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+
+    async def test_bulk(self):
+        body = '\n'.join(json.dumps(op) for op in (
+            {'op': 'update', 'id': '1', 'book': {'price': 5}},
+            {'op': 'delete', 'id': '999'},
+        ))
+        response = await self.client.post('/api/books/_bulk', data=body)
+        result = await response.get_json()
+        self.assertEqual((result['succeeded'], result['failed']), (1, 1))
+
+    async def test_compressed_response(self):
+        with patch.object(async_app, 'COMPRESS_MIN_BYTES', 10):
+            response = await self.client.get('/api/books', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(await response.get_data()))), 3)
+        plain = await self.client.get('/api/books')
+        self.assertNotEqual(response.headers['ETag'], plain.headers['ETag'])
+
+    async def test_search(self):
+        response = await self.client.get('/api/books/search', query_string={'query': 'orwell'})
+        self.assertEqual([b['id'] for b in await response.get_json()], ['2'])
+        response = await self.client.get('/api/books/search', query_string={'query': ''})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_change_feed(self):
+        cursor = (await (await self.client.get('/api/books/changes')).get_json())['cursor']
+        with patch.object(async_app, 'CHANGES_POLL_INTERVAL', 0.05):
+            poll = asyncio.ensure_future(self.client.get('/api/books/changes', query_string={
+                'since': cursor, 'wait': 10
+            }))
+            await asyncio.sleep(0.2)
+            await self.client.delete('/api/books/2')
+            feed = await (await poll).get_json()
+        self.assertEqual(feed['changes'], [{'seq': 1, 'op': 'delete', 'id': '2'}])
+
+    async def test_slow_requests_overlap(self):
+        # Simulated latency suspends the request instead of blocking the loop
+        simulator = LatencySimulator('fixed', {'get_book': 0.2})
+        with patch.object(async_app, 'latency', simulator):
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(self.client.get('/api/books/1')
+                                               for _ in range(200)))
+            elapsed = time.perf_counter() - start
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertLess(elapsed, 5)
+
+
+if __name__ == '__main__':
+    print("Running tests for the asyncio Bookstore API...")
+    unittest.main()
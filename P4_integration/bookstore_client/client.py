@@ -5,18 +5,65 @@ Bookstore Client
 A client application for interacting with the Bookstore API.
 This client is intentionally incomplete and contains TODOs for implementation.
 """
+import argparse
+import itertools
 import requests
 import json
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from tabulate import tabulate
+from urllib3.util.retry import Retry
 import sys
+import time
 from colorama import Fore, Style, init
+from mirror import MIRROR_TTL, CatalogMirror
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
 
 # Initialize colorama
 init(autoreset=True)
 
 # Constants
 API_BASE_URL = "http://localhost:5000/api"
-BOOKS_ENDPOINT = f"{API_BASE_URL}/books"
+
+# Operations sent per bulk request
+BULK_BATCH_SIZE = 1000
+
+# Responses remembered for conditional requests
+RESPONSE_CACHE_SIZE = 128
+
+# Books per request when listing the catalog a page at a time (the API
+# allows up to 1000)
+LIST_PAGE_SIZE = 500
+
+# Listings and searches are requested as MessagePack when msgpack is
+# installed, as it is smaller and quicker to decode than JSON. Compressed
+# responses need nothing extra: requests asks for gzip, and for brotli too
+# when the brotli package is installed, and decompresses them.
+MSGPACK_MIMETYPE = "application/msgpack"
+ACCEPT = f"{MSGPACK_MIMETYPE}, application/json;q=0.9, */*;q=0.8" if msgpack else None
+
+# Connection settings for BookstoreClient
+POOL_SIZE = 10                 # keep-alive connections kept open to the API
+TIMEOUT = (3.05, 30)           # (connect, read) timeouts in seconds
+RETRIES = 3                    # retries of idempotent requests
+BACKOFF_FACTOR = 0.5           # retry n waits BACKOFF_FACTOR * 2 ** (n - 1) seconds
+RETRY_STATUSES = (502, 503, 504)
+
+# Requests in flight at once for the batch methods (one per pooled connection)
+MAX_WORKERS = POOL_SIZE
+
+# Streamed tables size their columns from the first TABLE_SAMPLE_SIZE books,
+# up to MAX_CELL_WIDTH characters; longer cells further down are cut to fit
+TABLE_HEADERS = ["ID", "Title", "Author", "Price", "In Stock"]
+TABLE_SAMPLE_SIZE = 100
+MAX_CELL_WIDTH = 40
 
 # Helper functions for formatting output
 def print_success(message):
@@ -40,38 +87,478 @@ def format_book_table(books):
     if isinstance(books, dict):
         books = [books]
     
-    headers = ["ID", "Title", "Author", "Price", "In Stock"]
-    rows = [
-        [
-            book.get("id", "N/A"),
-            book.get("title", "N/A"),
-            book.get("author", "N/A"),
-            f"${book.get('price', 0):.2f}",
-            "Yes" if book.get("in_stock", False) else "No"
-        ]
-        for book in books
-    ]
+    rows = [book_row(book) for book in books]
     
-    return tabulate(rows, headers=headers, tablefmt="grid")
+    return tabulate(rows, headers=TABLE_HEADERS, tablefmt="grid")
+
+def book_row(book):
+    """Return the table cells for a book."""
+    return [
+        str(book.get("id", "N/A")),
+        str(book.get("title", "N/A")),
+        str(book.get("author", "N/A")),
+        f"${book.get('price', 0):.2f}",
+        "Yes" if book.get("in_stock", False) else "No"
+    ]
 
-# API client functions
+def iter_book_table(books, sample_size=TABLE_SAMPLE_SIZE):
+    """
+    Yield the lines of a book table while the books are still arriving.
+
+    Unlike format_book_table(), this never holds more than `sample_size`
+    books: column widths come from the first ones, and every later row is
+    printed as soon as it is read.
+
+    Parameters:
+        books (iterable): Books, e.g. from BookstoreClient.iter_books()
+        sample_size (int): Books used to size the columns
+
+    Yields:
+        str: One line of the table at a time
+    """
+    books = iter(books)
+    sample = [book_row(book) for book in itertools.islice(books, sample_size)]
+    if not sample:
+        yield "No books found."
+        return
+
+    widths = [
+        min(MAX_CELL_WIDTH, max(len(header), *(len(row[i]) for row in sample)))
+        for i, header in enumerate(TABLE_HEADERS)
+    ]
+    border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+
+    def line(cells):
+        fitted = []
+        for i, (cell, width) in enumerate(zip(cells, widths)):
+            if len(cell) > width:
+                cell = cell[:width - 3] + "..."
+            # Prices line up on the right, like tabulate does for numbers
+            fitted.append(cell.rjust(width) if i == 3 else cell.ljust(width))
+        return "| " + " | ".join(fitted) + " |"
+
+    yield border
+    yield line(TABLE_HEADERS)
+    yield border.replace("-", "=")
+    for row in itertools.chain(sample, map(book_row, books)):
+        yield line(row)
+        yield border
+
+def page_lines(lines, page_size=None):
+    """
+    Print lines a screenful at a time, asking before each new page.
+
+    Parameters:
+        lines (iterable): Lines to print
+        page_size (int): Lines per page (the terminal height if None)
+
+    Returns:
+        bool: False if the user stopped before the end
+    """
+    if page_size is None:
+        page_size = max(1, shutil.get_terminal_size().lines - 1)
+    for count, text in enumerate(lines, 1):
+        print(text)
+        if count % page_size == 0:
+            answer = input("-- More -- (Enter for the next page, q to stop) ")
+            if answer.strip().lower() == "q":
+                return False
+    return True
+
+def decode_response(response):
+    """Return the data in a JSON or MessagePack response body."""
+    content_type = response.headers.get("Content-Type")
+    if isinstance(content_type, str) and content_type.startswith(MSGPACK_MIMETYPE):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+# API client
+
+class BookstoreClient:
+    """
+    Client for the Bookstore API.
+
+    All requests go through one requests.Session, so they reuse pooled
+    keep-alive connections instead of opening a new TCP connection each
+    time. Every request has connect and read timeouts. GET, PUT and DELETE
+    are idempotent, so they are retried with exponential backoff after a
+    dropped connection or a 502/503/504 reply; POSTs are only retried when
+    the connection couldn't be made at all.
+
+    Methods raise requests.exceptions.RequestException on failure, except
+    the batch methods (get_books_by_ids, update_books, delete_books), which
+    report an error per book instead.
+    """
+
+    def __init__(self, base_url=API_BASE_URL, pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 retries=RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 cache_size=RESPONSE_CACHE_SIZE):
+        """
+        Parameters:
+            base_url (str): Root of the API, e.g. http://localhost:5000/api
+            pool_size (int): Connections kept open for reuse
+            timeout (tuple): (connect, read) timeouts in seconds
+            retries (int): Retries of idempotent requests
+            backoff_factor (float): Retry n waits backoff_factor * 2 ** (n - 1) seconds
+            cache_size (int): Responses remembered for conditional requests
+        """
+        self.base_url = base_url.rstrip("/")
+        self.books_url = f"{self.base_url}/books"
+        self.timeout = timeout
+        self.cache_size = cache_size
+        # URL -> (ETag, Last-Modified, data), least recently used first
+        self._response_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if ACCEPT:
+            self.session.headers["Accept"] = ACCEPT
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def conditional_get(self, url, params=None):
+        """
+        GET a JSON resource, reusing the cached copy when the API says it is unchanged.
+
+        The ETag (or Last-Modified) from the last response for the same URL is
+        sent back, and a 304 reply returns the cached data without downloading
+        or decoding the body again. MessagePack bodies are decoded too.
+        """
+        key = requests.Request("GET", url, params=params).prepare().url
+        with self._cache_lock:
+            cached = self._response_cache.get(key)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            elif last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+        if cached and response.status_code == 304:
+            with self._cache_lock:
+                if key in self._response_cache:
+                    self._response_cache.move_to_end(key)
+            return cached[2]
+
+        response.raise_for_status()
+        data = decode_response(response)
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if isinstance(etag, str) or isinstance(last_modified, str):
+            with self._cache_lock:
+                self._response_cache[key] = (etag, last_modified, data)
+                self._response_cache.move_to_end(key)
+                while len(self._response_cache) > self.cache_size:
+                    self._response_cache.popitem(last=False)
+        return data
+
+    def clear_cache(self):
+        """Forget every cached response."""
+        with self._cache_lock:
+            self._response_cache.clear()
+
+    def get_all_books(self):
+        """Return every book in the catalog."""
+        return self.conditional_get(self.books_url)
+
+    def iter_books(self, fields=None):
+        """
+        Stream every book from the API without holding the catalog in memory.
+
+        Parameters:
+            fields (list): Only include these fields for each book (all if None)
+
+        Yields:
+            dict: One book at a time, in ID order
+        """
+        params = {"format": "ndjson"}
+        if fields:
+            params["fields"] = ",".join(fields)
+
+        with self.session.get(self.books_url, params=params, stream=True,
+                              timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def iter_book_pages(self, page_size=LIST_PAGE_SIZE):
+        """
+        Yield every book, fetching the catalog a page at a time.
+
+        Each page is a conditional request of its own, so pages that haven't
+        changed come from the response cache, and the next page is only
+        requested once the books before it have been read.
+
+        Parameters:
+            page_size (int): Books per request
+
+        Yields:
+            dict: One book at a time, in ID order
+        """
+        params = {"limit": page_size}
+        while True:
+            page = self.conditional_get(self.books_url, params=params)
+            yield from page["books"]
+            if not page["next_cursor"]:
+                return
+            params = {"limit": page_size, "cursor": page["next_cursor"]}
+
+    def get_book(self, book_id):
+        """Return the book with the given ID."""
+        return self.conditional_get(f"{self.books_url}/{book_id}")
+
+    def add_book(self, book):
+        """Create a book and return it as stored, with its new ID."""
+        response = self.session.post(self.books_url, json=book, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def update_book(self, book_id, changes):
+        """Change some fields of a book and return the updated book."""
+        response = self.session.put(f"{self.books_url}/{book_id}", json=changes,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def delete_book(self, book_id):
+        """Delete a book."""
+        response = self.session.delete(f"{self.books_url}/{book_id}", timeout=self.timeout)
+        response.raise_for_status()
+
+    def search_books(self, query, mode=None):
+        """Return the books whose title or author match the query."""
+        params = {"query": query}
+        if mode:
+            params["mode"] = mode
+        return self.conditional_get(f"{self.books_url}/search", params=params)
+
+    def get_changes(self, since=None, wait=None):
+        """
+        Return what changed in the catalog since a cursor from an earlier call.
+
+        Parameters:
+            since (str): Cursor to continue from (None for a starting cursor)
+            wait (int): Seconds the API may wait for a change before answering
+
+        Returns:
+            dict: The API's {"cursor", "reset", "more", "changes"} response
+        """
+        params = {}
+        if since:
+            params["since"] = since
+        if wait:
+            params["wait"] = wait
+        timeout = self.timeout
+        if wait:
+            timeout = (timeout[0], timeout[1] + wait)
+        response = self.session.get(f"{self.books_url}/changes", params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def send_bulk(self, operations):
+        """
+        Send one batch of operations to the bulk endpoint.
+
+        Parameters:
+            operations (list): Operations as dicts (or raw NDJSON lines)
+
+        Returns:
+            dict: The API's summary with a result for every operation
+        """
+        body = "".join(
+            (op if isinstance(op, str) else json.dumps(op)) + "\n" for op in operations
+        )
+        response = self.session.post(f"{self.books_url}/_bulk", data=body.encode("utf-8"),
+                                     headers={"Content-Type": "application/x-ndjson"},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def bulk_apply(self, operations, batch_size=BULK_BATCH_SIZE):
+        """
+        Apply any number of operations, batch_size at a time.
+
+        Parameters:
+            operations (iterable): Operations, e.g. from read_bulk_operations()
+            batch_size (int): Operations per request
+
+        Returns:
+            dict: Totals {"succeeded", "failed"} and "errors", a list of
+            (operation number, message) for every failed operation,
+            counting the operations from 1 (so blank lines in a file read
+            by read_bulk_operations aren't counted)
+        """
+        summary = {"succeeded": 0, "failed": 0, "errors": []}
+        operations = iter(operations)
+        offset = 0
+        while True:
+            batch = list(itertools.islice(operations, batch_size))
+            if not batch:
+                return summary
+            result = self.send_bulk(batch)
+            summary["succeeded"] += result["succeeded"]
+            summary["failed"] += result["failed"]
+            summary["errors"].extend(
+                (offset + r["index"] + 1, r.get("error", "Unknown error"))
+                for r in result["results"] if r["status"] >= 400
+            )
+            offset += len(batch)
+
+    def _for_each_book(self, call, args_by_id, max_workers):
+        """
+        Run call(book_id, *args) for many books on a bounded thread pool.
+
+        Returns:
+            dict: "results" (book ID -> return value) and "errors" (book ID ->
+            message), both in the order the IDs were given
+        """
+        def run(book_id):
+            try:
+                return call(book_id, *args_by_id[book_id]), None
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    return None, "Book not found"
+                return None, str(e)
+            except requests.exceptions.RequestException as e:
+                return None, str(e)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            outcomes = dict(zip(args_by_id, pool.map(run, args_by_id)))
+
+        summary = {"results": {}, "errors": {}}
+        for book_id, (result, error) in outcomes.items():
+            if error is None:
+                summary["results"][book_id] = result
+            else:
+                summary["errors"][book_id] = error
+        return summary
+
+    def get_books_by_ids(self, book_ids, max_workers=MAX_WORKERS):
+        """
+        Fetch many books concurrently.
+
+        Parameters:
+            book_ids (iterable): IDs of the books to fetch
+            max_workers (int): Requests in flight at once
+
+        Returns:
+            dict: "results" (book ID -> book) and "errors" (book ID -> message)
+        """
+        return self._for_each_book(self.get_book, {book_id: () for book_id in book_ids},
+                                   max_workers)
+
+    def update_books(self, changes, max_workers=MAX_WORKERS):
+        """
+        Update many books concurrently.
+
+        Parameters:
+            changes (dict): Book ID -> fields to change
+            max_workers (int): Requests in flight at once
+
+        Returns:
+            dict: "results" (book ID -> updated book) and "errors" (book ID -> message)
+        """
+        return self._for_each_book(self.update_book,
+                                   {book_id: (fields,) for book_id, fields in changes.items()},
+                                   max_workers)
+
+    def delete_books(self, book_ids, max_workers=MAX_WORKERS):
+        """
+        Delete many books concurrently.
+
+        Returns:
+            dict: "results" (book ID -> None) and "errors" (book ID -> message)
+        """
+        return self._for_each_book(self.delete_book, {book_id: () for book_id in book_ids},
+                                   max_workers)
+
+# Client used by the menu and the command line (replaced in main() when
+# connection options are given)
+api = BookstoreClient()
+
+# Local copy of the catalog for listing and searching (set up by main()
+# when --cache is given)
+mirror = None
+
+# Whether long listings stop after every screenful (--pager)
+use_pager = False
+
+def report_stale_mirror():
+    """Tell the user when results come from a mirror that couldn't be synced."""
+    if mirror and mirror.stale:
+        synced = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mirror.synced_at))
+        print_info(f"API unavailable; showing the local copy from {synced}.")
+
+def catalog_changed():
+    """Make the next listing or search sync the mirror."""
+    if mirror:
+        mirror.expire()
+
+# Menu actions
 
 def get_all_books():
-    """Retrieve all books from the API."""
+    """Retrieve all books from the API (or the local mirror, if enabled)."""
     try:
-        response = requests.get(BOOKS_ENDPOINT)
-        response.raise_for_status()
-        books = response.json()
-        return books
+        if mirror:
+            books = mirror.books()
+            report_stale_mirror()
+            return books
+        return api.get_all_books()
     except requests.exceptions.RequestException as e:
         print_error(f"Failed to retrieve books: {e}")
         return []
 
 def display_all_books():
-    """Display all books in a formatted table."""
+    """
+    Display all books in a table, printing rows as the pages arrive.
+
+    Each page is fetched with a conditional request, so pages of an
+    unchanged catalog come from the response cache (and as MessagePack or
+    compressed, if available). With --pager, pages after the screenful the
+    user stops at aren't fetched at all.
+    """
     print_info("Fetching all books...")
-    books = get_all_books()
-    print(format_book_table(books))
+    lines = None
+    try:
+        if mirror:
+            books = mirror.iter_books()
+            report_stale_mirror()
+        else:
+            books = api.iter_book_pages(LIST_PAGE_SIZE)
+        lines = iter_book_table(books)
+        if use_pager:
+            page_lines(lines)
+        else:
+            for text in lines:
+                print(text)
+    except requests.exceptions.RequestException as e:
+        print_error(f"Failed to retrieve books: {e}")
+    finally:
+        if lines is not None:
+            # No more pages are fetched if the pager was left early
+            lines.close()
 
 def get_book_by_id(book_id):
     """
@@ -84,9 +571,7 @@ def get_book_by_id(book_id):
         dict: The book data if found, None otherwise
     """
     try:
-        response = requests.get(f"{BOOKS_ENDPOINT}/{book_id}")
-        response.raise_for_status()
-        return response.json()
+        return api.get_book(book_id)
     except requests.exceptions.HTTPError as http_err:
         # Try to access status code from the error's response object
         if hasattr(http_err, 'response') and http_err.response is not None and http_err.response.status_code == 404:
@@ -146,9 +631,8 @@ def add_book():
     }
 
     try:
-        response = requests.post(BOOKS_ENDPOINT, json=new_book_data)
-        response.raise_for_status()
-        new_book = response.json()
+        new_book = api.add_book(new_book_data)
+        catalog_changed()
         print_success(f"Book added successfully: {new_book['title']} by {new_book['author']}")
     except requests.exceptions.RequestException as e:
         print_error(f"Failed to add book: {e}")
@@ -206,9 +690,8 @@ def update_book():
     }
 
     try:
-        response = requests.put(f"{BOOKS_ENDPOINT}/{book_id}", json=updated_data)
-        response.raise_for_status()
-        updated_book = response.json()
+        updated_book = api.update_book(book_id, updated_data)
+        catalog_changed()
         print_success("Book updated successfully!")
         print(format_book_table(updated_book))
     except requests.exceptions.RequestException as e:
@@ -238,8 +721,8 @@ def delete_book():
         return
 
     try:
-        response = requests.delete(f"{BOOKS_ENDPOINT}/{book_id}")
-        response.raise_for_status()
+        api.delete_book(book_id)
+        catalog_changed()
         print_success(f"Book with ID {book_id} deleted successfully.")
     except requests.exceptions.RequestException as e:
         print_error(f"Failed to delete book: {e}")
@@ -256,9 +739,11 @@ def search_books():
         return
 
     try:
-        response = requests.get(f"{BOOKS_ENDPOINT}/search", params={"query": query})
-        response.raise_for_status()
-        results = response.json()
+        if mirror:
+            results = mirror.search(query)
+            report_stale_mirror()
+        else:
+            results = api.search_books(query)
 
         if results:
             print_success(f"Found {len(results)} matching book(s):")
@@ -268,6 +753,128 @@ def search_books():
     except requests.exceptions.RequestException as e:
         print_error(f"Failed to perform search: {e}")
 
+def export_books():
+    """
+    Export the whole catalog to a newline-delimited JSON file.
+
+    Books are written as they arrive, so memory use stays flat no matter
+    how large the catalog is.
+    """
+    path = input("Enter the file to export to [books.ndjson]: ").strip() or "books.ndjson"
+
+    count = 0
+    try:
+        with open(path, "w") as f:
+            for book in api.iter_books():
+                f.write(json.dumps(book) + "\n")
+                count += 1
+        print_success(f"Exported {count} book(s) to {path}")
+    except requests.exceptions.RequestException as e:
+        print_error(f"Failed to export books after {count} book(s): {e}")
+    except OSError as e:
+        print_error(f"Failed to write {path}: {e}")
+
+def read_bulk_operations(path):
+    """
+    Read bulk operations from a newline-delimited JSON file.
+
+    Each line is an operation such as {"op": "update", "id": "1", "book": {...}}.
+    Lines holding a plain book (no "op") are treated as creates, so a file
+    written by Export Books can be imported as-is. Lines that aren't valid
+    JSON are passed through for the API to report.
+
+    Yields:
+        dict or str: One operation per non-blank line
+    """
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                yield line.strip()
+                continue
+            if isinstance(item, dict) and "op" not in item:
+                item = {"op": "create", "book": item}
+            yield item
+
+def bulk_import(path, batch_size=BULK_BATCH_SIZE):
+    """Apply the operations in an NDJSON file and report the outcome."""
+    print_info(f"Applying operations from {path}...")
+    try:
+        summary = api.bulk_apply(read_bulk_operations(path), batch_size)
+        catalog_changed()
+    except OSError as e:
+        print_error(f"Failed to read {path}: {e}")
+        return 1
+    except requests.exceptions.RequestException as e:
+        print_error(f"Bulk request failed: {e}")
+        return 1
+
+    for number, message in summary["errors"][:20]:
+        print_error(f"Operation {number}: {message}")
+    if len(summary["errors"]) > 20:
+        print_error(f"... and {len(summary['errors']) - 20} more")
+    print_success(f"{summary['succeeded']} operation(s) applied, {summary['failed']} failed.")
+    return 0 if summary["failed"] == 0 else 1
+
+def read_book_ids(path):
+    """Read book IDs from a file, one per line."""
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def read_book_changes(path):
+    """
+    Read per-book changes from a newline-delimited JSON file.
+
+    Each line holds a book's "id" and the fields to change, for example
+    {"id": "1", "price": 9.99}.
+
+    Returns:
+        dict: Book ID -> fields to change
+
+    Raises:
+        ValueError: If a line isn't a JSON object with an "id"
+    """
+    changes = {}
+    with open(path, "r") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if not isinstance(item, dict) or "id" not in item:
+                raise ValueError(f"line {number} must be a JSON object with an \"id\"")
+            book_id = str(item.pop("id"))
+            changes[book_id] = item
+    return changes
+
+def batch_command(command, path, max_workers=MAX_WORKERS):
+    """Fetch, update or delete the books listed in a file and report each one."""
+    try:
+        if command == "update":
+            summary = api.update_books(read_book_changes(path), max_workers)
+        elif command == "delete":
+            summary = api.delete_books(read_book_ids(path), max_workers)
+        else:
+            summary = api.get_books_by_ids(read_book_ids(path), max_workers)
+    except (OSError, ValueError) as e:
+        print_error(f"Failed to read {path}: {e}")
+        return 1
+
+    if command != "fetch":
+        catalog_changed()
+    if command != "delete" and summary["results"]:
+        print(format_book_table(list(summary["results"].values())))
+    for book_id, message in summary["errors"].items():
+        print_error(f"Book {book_id}: {message}")
+    done = {"fetch": "fetched", "update": "updated", "delete": "deleted"}[command]
+    print_success(f"{len(summary['results'])} book(s) {done}, {len(summary['errors'])} failed.")
+    return 0 if not summary["errors"] else 1
+
 def display_menu():
     """Display the main menu options."""
     print("\n" + "=" * 50)
@@ -279,15 +886,69 @@ def display_menu():
     print("4. Update Book")
     print("5. Delete Book")
     print("6. Search Books")
-    print("7. Exit")
+    print("7. Export Books")
+    print("8. Exit")
     print("=" * 50)
 
-def main():
+def parse_args(argv):
+    """Parse command-line arguments for the non-interactive commands."""
+    parser = argparse.ArgumentParser(
+        description="Bookstore client. Run without a command for the interactive menu.")
+    parser.add_argument("--url", default=API_BASE_URL,
+                        help=f"root of the API (default {API_BASE_URL})")
+    parser.add_argument("--connect-timeout", type=float, default=TIMEOUT[0],
+                        help=f"seconds to wait for a connection (default {TIMEOUT[0]})")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT[1],
+                        help=f"seconds to wait for a response (default {TIMEOUT[1]})")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+                        help=f"retries of idempotent requests (default {RETRIES})")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help=f"keep-alive connections to reuse (default {POOL_SIZE})")
+    parser.add_argument("--pager", action="store_true",
+                        help="stop after every screenful when listing all books")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="keep a local copy of the catalog in this SQLite file and "
+                             "list and search books from it")
+    parser.add_argument("--cache-ttl", type=float, default=MIRROR_TTL,
+                        help=f"seconds before the local copy is checked against the API "
+                             f"(default {MIRROR_TTL})")
+    commands = parser.add_subparsers(dest="command")
+
+    bulk = commands.add_parser("bulk", help="apply create/update/delete operations from an NDJSON file")
+    bulk.add_argument("path", help="NDJSON file with one operation (or book) per line")
+    bulk.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE,
+                      help=f"operations per request (default {BULK_BATCH_SIZE})")
+
+    for name, help_text, path_help in (
+            ("fetch", "show the books whose IDs are listed in a file", "file with one book ID per line"),
+            ("update", "change the books listed in an NDJSON file",
+             'NDJSON file with an "id" and the fields to change per line'),
+            ("delete", "delete the books whose IDs are listed in a file", "file with one book ID per line")):
+        batch = commands.add_parser(name, help=help_text)
+        batch.add_argument("path", help=path_help)
+        batch.add_argument("--workers", type=int, default=MAX_WORKERS,
+                           help=f"requests in flight at once (default {MAX_WORKERS})")
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main application function."""
+    global api, mirror, use_pager
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    api = BookstoreClient(args.url, pool_size=args.pool_size,
+                          timeout=(args.connect_timeout, args.timeout), retries=args.retries)
+    if args.cache:
+        mirror = CatalogMirror(api, args.cache, ttl=args.cache_ttl)
+    use_pager = args.pager
+    if args.command == "bulk":
+        return bulk_import(args.path, args.batch_size)
+    if args.command in ("fetch", "update", "delete"):
+        return batch_command(args.command, args.path, args.workers)
+
     try:
         while True:
             display_menu()
-            choice = input("Enter your choice (1-7): ")
+            choice = input("Enter your choice (1-8): ")
             
             if choice == "1":
                 display_all_books()
@@ -302,10 +963,12 @@ def main():
             elif choice == "6":
                 search_books()
             elif choice == "7":
+                export_books()
+            elif choice == "8":
                 print_info("Exiting Bookstore Client. Goodbye!")
                 break
             else:
-                print_error("Invalid choice. Please enter a number between 1 and 7.")
+                print_error("Invalid choice. Please enter a number between 1 and 8.")
             
             input("\nPress Enter to continue...")
             
@@ -0,0 +1,178 @@
+"""
+Catalog Mirror
+
+An optional local copy of the catalog for the Bookstore client, kept in a
+SQLite file. Listing and searching are answered from the mirror, which is
+brought up to date with the API at most once per TTL:
+
+- After the first download, only the changes since the last sync are
+  fetched, from the API's change feed (GET /api/books/changes). The whole
+  catalog is downloaded again only when the feed asks for a reset.
+- If the API can't be reached, the mirror keeps serving its last copy
+  (read-only) and reports that it is stale.
+- A mirror made for a different API URL is emptied on open.
+"""
+import json
+import sqlite3
+import time
+
+import requests
+
+# Seconds a synced mirror is used before checking the API again
+MIRROR_TTL = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+UPSERT = """
+INSERT INTO books (id, title, author, data) VALUES (?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    title = excluded.title, author = excluded.author, data = excluded.data
+"""
+
+
+def _row(book):
+    """Return the UPSERT parameters for a book; title and author are lowercased for search."""
+    return (str(book["id"]), str(book.get("title", "")).lower(),
+            str(book.get("author", "")).lower(), json.dumps(book))
+
+
+class CatalogMirror:
+    """Local SQLite copy of the catalog, synced from a BookstoreClient."""
+
+    def __init__(self, api, path, ttl=MIRROR_TTL):
+        """
+        Parameters:
+            api (BookstoreClient): Client used to sync with the API
+            path (str): Location of the SQLite file
+            ttl (float): Seconds a sync stays fresh
+        """
+        self.api = api
+        self.path = path
+        self.ttl = ttl
+        self.stale = False  # True when the last sync couldn't reach the API
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        if self._get("base_url") != api.base_url:
+            with self._db:
+                self._db.execute("DELETE FROM books")
+                self._db.execute("DELETE FROM meta")
+                self._set("base_url", api.base_url)
+
+    def _get(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def synced_at(self):
+        """Time of the last successful sync, or None if the mirror is empty."""
+        return self._get("synced_at")
+
+    def close(self):
+        """Close the SQLite file."""
+        self._db.close()
+
+    def expire(self):
+        """Make the next read sync with the API, e.g. after changing the catalog."""
+        with self._db:
+            self._set("expires_at", 0)
+
+    def sync(self, force=False):
+        """
+        Bring the mirror up to date if its TTL has run out.
+
+        Parameters:
+            force (bool): Check with the API even if the TTL hasn't run out
+
+        Returns:
+            bool: False if the API couldn't be reached and the mirror may be out of date
+
+        Raises:
+            requests.exceptions.RequestException: If the API couldn't be
+                reached and the mirror has never been synced
+        """
+        expires_at = self._get("expires_at")
+        if not force and expires_at is not None and time.time() < expires_at:
+            return True
+
+        try:
+            self._download()
+        except requests.exceptions.RequestException:
+            if self.synced_at is None:
+                raise
+            self.stale = True
+            return False
+        self.stale = False
+        return True
+
+    def _download(self):
+        """Apply the API's changes since the last sync, or copy the whole catalog."""
+        cursor = self._get("cursor")
+        while cursor is not None:
+            feed = self.api.get_changes(cursor)
+            if feed["reset"]:
+                break
+            with self._db:
+                for change in feed["changes"]:
+                    if change["op"] == "delete":
+                        self._db.execute("DELETE FROM books WHERE id = ?", (change["id"],))
+                    else:
+                        self._db.execute(UPSERT, _row(change["book"]))
+                cursor = feed["cursor"]
+                self._set("cursor", cursor)
+                if not feed["more"]:
+                    self._synced()
+                    return
+
+        # Take the cursor before downloading, so changes made meanwhile are
+        # applied (again) on the next sync rather than missed
+        cursor = self.api.get_changes()["cursor"]
+        with self._db:
+            self._db.execute("DELETE FROM books")
+            self._db.executemany(UPSERT, (_row(book) for book in self.api.iter_books()))
+            self._set("cursor", cursor)
+            self._synced()
+
+    def _synced(self):
+        now = time.time()
+        self._set("synced_at", now)
+        self._set("expires_at", now + self.ttl)
+
+    def books(self):
+        """Return every book, in the order the API lists them."""
+        return list(self.iter_books())
+
+    def iter_books(self):
+        """Sync, then return an iterator over every book that reads them as it goes."""
+        self.sync()
+        rows = self._db.execute("SELECT data FROM books ORDER BY position")
+        return (json.loads(data) for data, in rows)
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None if it isn't in the catalog."""
+        self.sync()
+        row = self._db.execute("SELECT data FROM books WHERE id = ?", (book_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(self, query):
+        """Return the books whose title or author contain the query (case-insensitive)."""
+        self.sync()
+        query = query.lower()
+        rows = self._db.execute(
+            "SELECT data FROM books WHERE instr(title, ?) > 0 OR instr(author, ?) > 0 "
+            "ORDER BY position", (query, query))
+        return [json.loads(data) for data, in rows]
@@ -2,16 +2,30 @@
 """
 Test script for the Bookstore Client
 """
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock
+import client
+from mirror import CatalogMirror
 from client import (
+    BookstoreClient,
     get_all_books,
     get_book_by_id,
     add_book,
     update_book,
     delete_book,
-    search_books
+    search_books,
+    iter_book_table,
+    page_lines,
+    read_book_changes,
+    read_bulk_operations
 )
 
 class TestBookstoreClient(unittest.TestCase):
@@ -33,8 +47,13 @@ class TestBookstoreClient(unittest.TestCase):
             }
         ]
         self.single_book = self.sample_books[0]
+        self.api = BookstoreClient()
+        self.addCleanup(self.api.close)
+        api_patch = patch('client.api', self.api)
+        api_patch.start()
+        self.addCleanup(api_patch.stop)
 
-    @patch('client.requests.get')
+    @patch('client.api.session.get')
     def test_get_all_books(self, mock_get):
         mock_response = MagicMock()
         mock_response.json.return_value = self.sample_books
@@ -44,8 +63,137 @@ class TestBookstoreClient(unittest.TestCase):
         result = get_all_books()
         self.assertEqual(result, self.sample_books)
         mock_get.assert_called_once()
+        self.assertEqual(mock_get.call_args.kwargs["timeout"], self.api.timeout)
 
-    @patch('client.requests.get')
+    @patch('client.api.session.get')
+    def test_get_all_books_revalidates_cached_copy(self, mock_get):
+        first = MagicMock(status_code=200, headers={"ETag": '"v1"'})
+        first.json.return_value = self.sample_books
+        not_modified = MagicMock(status_code=304, headers={"ETag": '"v1"'})
+        mock_get.side_effect = [first, not_modified]
+
+        self.assertEqual(get_all_books(), self.sample_books)
+        self.assertEqual(get_all_books(), self.sample_books)
+        self.assertEqual(mock_get.call_args.kwargs["headers"], {"If-None-Match": '"v1"'})
+        not_modified.json.assert_not_called()
+
+    @unittest.skipIf(client.msgpack is None, "msgpack is not installed")
+    @patch('client.api.session.get')
+    def test_get_all_books_msgpack(self, mock_get):
+        mock_get.return_value = MagicMock(
+            status_code=200, headers={"Content-Type": "application/msgpack"},
+            content=client.msgpack.packb(self.sample_books))
+
+        self.assertEqual(get_all_books(), self.sample_books)
+        self.assertIn("application/msgpack", self.api.session.headers["Accept"])
+
+    @patch('client.api.session.get')
+    def test_iter_books(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.__enter__.return_value = mock_response
+        mock_response.iter_lines.return_value = [
+            json.dumps(book).encode() for book in self.sample_books
+        ] + [b""]
+        mock_response.raise_for_status.return_value = None
+        mock_get.return_value = mock_response
+
+        result = list(self.api.iter_books(fields=["id", "title"]))
+        self.assertEqual(result, self.sample_books)
+        self.assertEqual(mock_get.call_args.kwargs["params"],
+                         {"format": "ndjson", "fields": "id,title"})
+        self.assertTrue(mock_get.call_args.kwargs["stream"])
+
+    def test_iter_book_table_streams(self):
+        def endless_books():
+            for i in itertools.count(1):
+                yield {"id": str(i), "title": "T" * i, "author": "A", "price": i, "in_stock": True}
+
+        # Rows come out before the source is exhausted, sized from the sample
+        lines = list(itertools.islice(iter_book_table(endless_books(), sample_size=3), 15))
+        self.assertEqual(len({len(line) for line in lines}), 1)
+        self.assertIn("| TTT   |", lines[7])
+        self.assertIn("| TT... |", lines[13])
+        self.assertEqual(list(iter_book_table([])), ["No books found."])
+
+    @patch('builtins.input', side_effect=["", "q"])
+    @patch('builtins.print')
+    def test_page_lines(self, mock_print, mock_input):
+        self.assertFalse(page_lines((str(i) for i in range(100)), page_size=10))
+        self.assertEqual(mock_print.call_count, 20)
+        self.assertTrue(page_lines(["a", "b"], page_size=10))
+
+    def paged(self, page_size=1):
+        """A conditional_get stand-in serving sample_books in cursor pages."""
+        def conditional_get(url, params=None):
+            start = int(params.get("cursor", 0))
+            end = start + params["limit"]
+            more = end < len(self.sample_books)
+            return {"books": self.sample_books[start:end], "next_cursor": str(end) if more else None}
+        return MagicMock(side_effect=conditional_get)
+
+    def test_iter_book_pages(self):
+        self.sample_books.append(dict(self.single_book, id="3"))
+        with patch.object(self.api, 'conditional_get', self.paged()) as mock_get:
+            books = self.api.iter_book_pages(page_size=2)
+            self.assertEqual(next(books), self.sample_books[0])
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(list(books), self.sample_books[1:])
+        self.assertEqual([c.kwargs["params"] for c in mock_get.call_args_list],
+                         [{"limit": 2}, {"limit": 2, "cursor": "2"}])
+
+    @patch('client.api.session.get')
+    def test_iter_book_pages_revalidates_each_page(self, mock_get):
+        pages = [{"books": self.sample_books[:1], "next_cursor": "1"},
+                 {"books": self.sample_books[1:], "next_cursor": None}]
+        responses = []
+        for i, page in enumerate(pages):
+            response = MagicMock(status_code=200, headers={"ETag": f'"p{i}"'})
+            response.json.return_value = page
+            responses.append(response)
+        not_modified = MagicMock(status_code=304)
+        mock_get.side_effect = responses + [not_modified, not_modified]
+
+        self.assertEqual(list(self.api.iter_book_pages(page_size=1)), self.sample_books)
+        self.assertEqual(list(self.api.iter_book_pages(page_size=1)), self.sample_books)
+        self.assertEqual([c.kwargs["headers"] for c in mock_get.call_args_list],
+                         [{}, {}, {"If-None-Match": '"p0"'}, {"If-None-Match": '"p1"'}])
+
+    @patch('builtins.print')
+    def test_display_all_books_prints_each_page_as_it_arrives(self, mock_print):
+        # Enough books to fill the sample the columns are sized from, and more
+        self.sample_books = [dict(self.single_book, id=str(i), title=f"Book {i}")
+                             for i in range(1, client.TABLE_SAMPLE_SIZE * 2)]
+        fetched = []
+
+        def conditional_get(url, params=None):
+            fetched.append(len(mock_print.call_args_list))
+            return paged(url, params)
+
+        paged = self.paged()
+        with patch.object(self.api, 'conditional_get', side_effect=conditional_get), \
+                patch.object(self.api, 'iter_books') as mock_iter, \
+                patch('client.LIST_PAGE_SIZE', client.TABLE_SAMPLE_SIZE + 10):
+            client.display_all_books()
+        mock_iter.assert_not_called()
+        printed = [str(call.args[0]) for call in mock_print.call_args_list]
+        self.assertIn(f"Book {len(self.sample_books)} ", "\n".join(printed))
+        # The first page's rows were printed before the second page was requested
+        self.assertEqual(len(fetched), 2)
+        self.assertIn("Book 110 ", "\n".join(printed[:fetched[1]]))
+        self.assertNotIn("Book 111 ", "\n".join(printed[:fetched[1]]))
+
+    @patch('builtins.print')
+    def test_display_all_books_with_pager_stops_fetching(self, mock_print):
+        self.sample_books = [dict(self.single_book, id=str(i))
+                             for i in range(client.TABLE_SAMPLE_SIZE * 3)]
+        with patch('client.use_pager', True), \
+                patch('client.LIST_PAGE_SIZE', client.TABLE_SAMPLE_SIZE), \
+                patch('client.page_lines', side_effect=lambda lines: next(lines)), \
+                patch.object(self.api, 'conditional_get', self.paged()) as mock_get:
+            client.display_all_books()
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('client.api.session.get')
     def test_get_book_by_id(self, mock_get):
         mock_response = MagicMock()
         mock_response.json.return_value = self.single_book
@@ -56,7 +204,7 @@ class TestBookstoreClient(unittest.TestCase):
         self.assertEqual(result, self.single_book)
         mock_get.assert_called_once()
 
-    @patch('client.requests.get')
+    @patch('client.api.session.get')
     def test_get_book_by_id_error(self, mock_get):
         mock_response = MagicMock()
         mock_response.status_code = 404
@@ -67,7 +215,7 @@ class TestBookstoreClient(unittest.TestCase):
         result = get_book_by_id("999")
         self.assertIsNone(result)
 
-    @patch('client.requests.post')
+    @patch('client.api.session.post')
     @patch('builtins.input', side_effect=["Test Book", "Test Author", "9.99", "yes"])
     def test_add_book(self, mock_input, mock_post):
         mock_response = MagicMock()
@@ -84,7 +232,7 @@ class TestBookstoreClient(unittest.TestCase):
         add_book()
         mock_post.assert_called_once()
 
-    @patch('client.requests.put')
+    @patch('client.api.session.put')
     @patch('client.get_book_by_id')
     @patch('builtins.input', side_effect=["1", "", "", "", ""])
     def test_update_book(self, mock_input, mock_get, mock_put):
@@ -98,7 +246,7 @@ class TestBookstoreClient(unittest.TestCase):
         update_book()
         mock_put.assert_called_once()
 
-    @patch('client.requests.delete')
+    @patch('client.api.session.delete')
     @patch('client.get_book_by_id')
     @patch('builtins.input', side_effect=["1", "yes"])
     def test_delete_book(self, mock_input, mock_get, mock_delete):
@@ -111,7 +259,7 @@ class TestBookstoreClient(unittest.TestCase):
         delete_book()
         mock_delete.assert_called_once()
 
-    @patch('client.requests.get')
+    @patch('client.api.session.get')
     @patch('builtins.input', return_value="test")
     def test_search_books(self, mock_input, mock_get):
         mock_response = MagicMock()
@@ -122,6 +270,234 @@ class TestBookstoreClient(unittest.TestCase):
         search_books()
         mock_get.assert_called_once()
 
+    @patch('client.api.session.post')
+    def test_bulk_apply_batches(self, mock_post):
+        def respond(url, data, headers, timeout):
+            lines = data.decode().splitlines()
+            mock_response = MagicMock()
+            mock_response.raise_for_status.return_value = None
+            mock_response.json.return_value = {
+                "results": [{"index": i, "status": 201} for i in range(len(lines) - 1)]
+                + [{"index": len(lines) - 1, "status": 400, "error": "bad"}],
+                "succeeded": len(lines) - 1,
+                "failed": 1,
+            }
+            return mock_response
+        mock_post.side_effect = respond
+
+        operations = [{"op": "delete", "id": str(i)} for i in range(5)]
+        summary = self.api.bulk_apply(operations, batch_size=2)
+
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual((summary["succeeded"], summary["failed"]), (2, 3))
+        self.assertEqual(summary["errors"], [(2, "bad"), (4, "bad"), (5, "bad")])
+
+    @patch('client.api.session.get')
+    def test_get_changes(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"cursor": "e-1", "changes": []}
+        mock_get.return_value = mock_response
+
+        self.assertEqual(self.api.get_changes("e-0", wait=20)["cursor"], "e-1")
+        self.assertEqual(mock_get.call_args.kwargs["params"], {"since": "e-0", "wait": 20})
+        # The read timeout covers the time the API may hold the request
+        self.assertEqual(mock_get.call_args.kwargs["timeout"][1], self.api.timeout[1] + 20)
+
+    @patch('client.api.session.get')
+    def test_get_books_by_ids_concurrently(self, mock_get):
+        # Every request waits for the other two, so this only passes if they overlap
+        barrier = threading.Barrier(3, timeout=5)
+        def respond(url, params, headers, timeout):
+            barrier.wait()
+            book_id = url.rsplit("/", 1)[1]
+            mock_response = MagicMock(status_code=200, headers={})
+            if book_id == "999":
+                error = requests.exceptions.HTTPError("404 Not Found")
+                error.response = MagicMock(status_code=404)
+                mock_response.raise_for_status.side_effect = error
+            mock_response.json.return_value = {"id": book_id}
+            return mock_response
+        mock_get.side_effect = respond
+
+        summary = self.api.get_books_by_ids(["2", "999", "1"], max_workers=3)
+        self.assertEqual(list(summary["results"]), ["2", "1"])
+        self.assertEqual(summary["results"]["1"], {"id": "1"})
+        self.assertEqual(summary["errors"], {"999": "Book not found"})
+
+    @patch('client.api.session.put')
+    def test_update_books(self, mock_put):
+        def respond(url, json, timeout):
+            if url.endswith("/2"):
+                raise requests.exceptions.ConnectionError("refused")
+            mock_response = MagicMock()
+            mock_response.json.return_value = dict(self.single_book, **json)
+            return mock_response
+        mock_put.side_effect = respond
+
+        summary = self.api.update_books({"1": {"price": 5.0}, "2": {"price": 6.0}})
+        self.assertEqual(summary["results"]["1"]["price"], 5.0)
+        self.assertEqual(summary["errors"], {"2": "refused"})
+
+    def test_read_book_changes(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as f:
+            f.write('{"id": 1, "price": 5}\n\n{"id": "2", "in_stock": false}\n')
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(read_book_changes(f.name),
+                         {"1": {"price": 5}, "2": {"in_stock": False}})
+
+        with open(f.name, "a") as out:
+            out.write('{"price": 5}\n')
+        with self.assertRaisesRegex(ValueError, "line 4"):
+            read_book_changes(f.name)
+
+    def test_read_bulk_operations(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as f:
+            f.write(json.dumps(self.single_book) + "\n\n")
+            f.write(json.dumps({"op": "delete", "id": "2"}) + "\n")
+            f.write("not json\n")
+        self.addCleanup(os.remove, f.name)
+
+        self.assertEqual(list(read_bulk_operations(f.name)), [
+            {"op": "create", "book": self.single_book},
+            {"op": "delete", "id": "2"},
+            "not json",
+        ])
+
+class TestCatalogMirror(unittest.TestCase):
+    """The local catalog copy, synced through a mocked change feed."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "mirror.db")
+        self.api = BookstoreClient()
+        self.addCleanup(self.api.close)
+        self.books = [
+            {"id": "2", "title": "Nineteen Eighty-Four", "author": "George Orwell", "price": 9.5},
+            {"id": "1", "title": "Émile", "author": "Jean-Jacques Rousseau", "price": 7.0},
+        ]
+        self.feed = []  # responses for calls with a cursor
+        for name, side_effect in (("get_changes", self.changes), ("iter_books", self.iter_books)):
+            p = patch.object(self.api, name, side_effect=side_effect)
+            setattr(self, f"mock_{name}", p.start())
+            self.addCleanup(p.stop)
+
+    def changes(self, since=None):
+        if since is None:
+            return {"cursor": "e-0", "reset": True, "more": False, "changes": []}
+        return self.feed.pop(0)
+
+    def iter_books(self):
+        return iter(self.books)
+
+    def open_mirror(self, api=None, ttl=60):
+        mirror = CatalogMirror(api or self.api, self.path, ttl=ttl)
+        self.addCleanup(mirror.close)
+        return mirror
+
+    def test_reads_are_local_until_ttl_runs_out(self):
+        mirror = self.open_mirror()
+        self.assertEqual(mirror.books(), self.books)
+        self.assertEqual(mirror.search("ORWELL"), [self.books[0]])
+        self.assertEqual(mirror.search("émi"), [self.books[1]])
+        self.assertEqual(mirror.get("1"), self.books[1])
+        self.assertIsNone(mirror.get("3"))
+        self.assertEqual(self.mock_iter_books.call_count, 1)
+        self.assertEqual(self.mock_get_changes.call_count, 1)
+
+    def test_syncs_changes_since_last_sync(self):
+        self.open_mirror(ttl=0).books()
+
+        # A new process reuses the file and only fetches the changes
+        added = {"id": "3", "title": "Emma", "author": "Jane Austen", "price": 7.5}
+        renamed = dict(self.books[0], title="1984")
+        self.feed = [
+            {"cursor": "e-2", "reset": False, "more": True, "changes": [
+                {"seq": 1, "op": "delete", "id": "1"},
+                {"seq": 2, "op": "put", "id": "3", "book": added},
+            ]},
+            {"cursor": "e-3", "reset": False, "more": False, "changes": [
+                {"seq": 3, "op": "put", "id": "2", "book": renamed},
+            ]},
+        ]
+        mirror = self.open_mirror(ttl=0)
+        self.assertEqual(mirror.books(), [renamed, added])
+        self.assertEqual(self.mock_iter_books.call_count, 1)
+        self.assertEqual(self.mock_get_changes.call_args.args, ("e-2",))
+
+        # A reset from the feed downloads the whole catalog again
+        self.feed = [{"cursor": "f-0", "reset": True, "more": False, "changes": []}]
+        self.assertEqual(mirror.books(), self.books)
+        self.assertEqual(self.mock_iter_books.call_count, 2)
+
+    def test_serves_last_copy_when_api_is_down(self):
+        mirror = self.open_mirror(ttl=0)
+        mirror.sync()
+
+        self.mock_get_changes.side_effect = requests.exceptions.ConnectionError("refused")
+        self.assertEqual(mirror.search("orwell"), [self.books[0]])
+        self.assertTrue(mirror.stale)
+
+        # Nothing to fall back on for a different API
+        other_api = BookstoreClient("http://other:5000/api")
+        other_api.get_changes = self.mock_get_changes
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.open_mirror(other_api).books()
+
+class FlakyApiHandler(BaseHTTPRequestHandler):
+    """Answers 503 to every other request, over keep-alive HTTP/1.1 connections."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        server.requests += 1
+        server.connections.add(self.client_address)
+        status = 503 if server.requests % 2 else 200
+        body = json.dumps([] if status == 200 else {"error": "busy"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_PUT = do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+class TestBookstoreClientConnections(unittest.TestCase):
+    """BookstoreClient against a real local HTTP server."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyApiHandler)
+        self.server.requests = 0
+        self.server.connections = set()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        host, port = self.server.server_address
+        self.api = BookstoreClient(f"http://{host}:{port}/api", backoff_factor=0)
+        self.addCleanup(self.api.close)
+
+    def test_idempotent_requests_are_retried(self):
+        self.assertEqual(self.api.get_all_books(), [])
+        self.assertEqual(self.api.update_book("1", {"price": 1}), [])
+        self.assertEqual(self.server.requests, 4)
+
+    def test_post_is_not_retried(self):
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.api.add_book({"title": "T"})
+        self.assertEqual(self.server.requests, 1)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.api.get_all_books()
+        self.assertEqual(self.server.requests, 6)
+        self.assertEqual(len(self.server.connections), 1)
+
 if __name__ == '__main__':
     print("Running tests for Bookstore Client implementation...")
     unittest.main()